@@ -0,0 +1,465 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Writes meetup stream data into compressed, hourly archive files whose rows
+conform to the BigQuery schemas in ``bq_table_schema``.
+"""
+import os
+import json
+import zlib
+import gzip
+import uuid
+import time
+import weakref
+import datetime
+import threading
+from enum import Enum
+from typing import Callable, List
+from custom_typing import Logger
+from bq_schema import SCHEMA_DIR, LABEL_SCHEMAS, load_schema, conform, \
+    arrow_schema
+from fast_json import json_dumps
+
+try:
+    import pyarrow.parquet
+except ImportError:  # Only needed for writing Parquet files.
+    pyarrow = None
+
+
+class ArchiveFormats(Enum):
+    ndjson_gz = 'ndjson.gz'
+    parquet = 'parquet'
+
+
+def get_hour(data: dict, default_time: float = None) -> str:
+    """
+    :param data: A data item streamed from meetup.
+    :param default_time: The unix time used if ``data`` has no ``mtime``. If
+        None, the current time is used.
+    :return: The UTC hour of the ``mtime`` of ``data`` (milliseconds since
+        the epoch), formatted as YYYYMMDDHH.
+    """
+    mtime = data.get('mtime')
+    if isinstance(mtime, (int, float)):
+        timestamp = mtime / 1000
+    elif default_time is not None:
+        timestamp = default_time
+    else:
+        timestamp = time.time()
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc) \
+        .strftime('%Y%m%d%H')
+
+
+def get_archive_path(directory: str,
+                     label: str,
+                     hour: str,
+                     file_id: str,
+                     file_format: str) -> str:
+    """
+    :param directory: The folder of the archive files.
+    :param label: The label of the stream of the file.
+    :param hour: The hour of the file, formatted as YYYYMMDDHH.
+    :param file_id: An ID that is unique for each file of ``hour``.
+    :param file_format: A value of *ArchiveFormats*.
+    :return: The path of the archive file.
+    """
+    folder = os.path.join(directory, label,
+                          f'dt={hour[:4]}-{hour[4:6]}-{hour[6:8]}',
+                          f'hour={hour[8:]}')
+    return os.path.join(folder, f'{label}-{hour}-{file_id}.{file_format}')
+
+
+class ArchiveFile(object):
+    """
+    An archive file that is being written. Newline-delimited JSON files are
+    compressed as the rows are written, while the rows of Parquet files are
+    held in memory until the file is closed.
+    """
+
+    def __init__(self,
+                 path: str,
+                 file_format: str,
+                 fields: List[dict] = None):
+        """
+        Initializes an instance of class *ArchiveFile*.
+
+        :param path: The path of the file, once it is closed.
+        :param file_format: A value of *ArchiveFormats*.
+        :param fields: The BigQuery schema of the rows. If None, the schema
+            of Parquet files is inferred from the rows.
+        """
+        self.path = path
+        self.part_path = f'{path}.part'  # The file is written to this path
+        # until it is closed.
+        self.file_format = file_format
+        self.fields = fields
+        self.rows = []
+        self.num_rows = 0
+        self.commits = []  # Stores the functions called once the rows are
+        # committed.
+        self.gzip_file = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if file_format == ArchiveFormats.ndjson_gz.value:
+            self.gzip_file = gzip.open(self.part_path, 'wb')
+
+    def write(self, row: dict):
+        """
+        Writes ``row`` to the file.
+
+        :param row: A row conforming to the schema of the file.
+        """
+        if self.gzip_file:
+            self.gzip_file.write(json_dumps(row) + b'\n')
+            if self.num_rows % 1000 == 999:
+                # Make the rows written so far recoverable after a crash.
+                self.gzip_file.flush()
+        else:
+            self.rows.append(row)
+        self.num_rows += 1
+
+    def close(self):
+        """
+        Finishes writing the file, and moves it to self.path.
+        """
+        if self.gzip_file:
+            self.gzip_file.close()
+        else:
+            table = pyarrow.Table.from_pylist(
+                self.rows,
+                schema=arrow_schema(self.fields) if self.fields else None)
+            pyarrow.parquet.write_table(table, self.part_path,
+                                        compression='snappy')
+            self.rows = []
+        os.replace(self.part_path, self.path)
+
+
+class ArchiveWriter(object):
+    """
+    A thread-safe writer that buffers stream data items per label and hour,
+    and writes them to compressed archive files. The files of an hour are
+    closed ``grace`` seconds after the hour ends, or once they hold
+    ``max_rows`` rows, and are then passed to ``uploader``. Files are closed
+    and uploaded by a background thread, so writing never waits for an
+    upload.
+
+    Files are named
+    ``{label}/dt={YYYY-MM-DD}/hour={HH}/{label}-{YYYYMMDDHH}-{id}.{format}``,
+    so they can be queried as a hive-partitioned BigQuery external table.
+    """
+    instances = weakref.WeakSet()  # Stores all open writers, so that they
+    # can be closed on shutdown.
+
+    def __init__(self,
+                 directory: str,
+                 file_format: str = ArchiveFormats.ndjson_gz.value,
+                 max_rows: int = 100000,
+                 grace: float = 10 * 60,
+                 uploader: Callable[[str, str], bool] = None,
+                 logger: Logger = None,
+                 schema_dir: str = SCHEMA_DIR,
+                 discard_uncommitted: bool = False):
+        """
+        Initializes an instance of class *ArchiveWriter*, and recovers the
+        files left by a previous run.
+
+        :param directory: The local folder of the archive files.
+        :param file_format: A value of *ArchiveFormats*.
+        :param max_rows: The maximum number of rows in a file.
+        :param grace: The number of seconds after the end of an hour during
+            which late data items are added to the files of the hour.
+        :param uploader: A function called with the local path and the name
+            of each closed file, which returns whether the file was
+            uploaded. Uploaded files are deleted. If None, the files are
+            kept in ``directory``.
+        :param logger: A Stackdriver logger for logging errors.
+        :param schema_dir: The folder of the BigQuery schemas.
+        :param discard_uncommitted: Whether the files left by a previous run
+            whose rows were not committed are deleted instead of recovered,
+            because their rows are replayed from the spool.
+        """
+        if file_format == ArchiveFormats.parquet.value and pyarrow is None:
+            raise ImportError('Writing Parquet files requires pyarrow.')
+        self.directory = directory
+        self.file_format = file_format
+        self.max_rows = max_rows
+        self.grace = grace
+        self.uploader = uploader
+        self.logger = logger
+        self.schema_dir = schema_dir
+        self.discard_uncommitted = discard_uncommitted
+        self.files = {}  # Stores the open file of each label and hour.
+        self.pending = []  # Stores the full files waiting to be committed by
+        # the background thread.
+        self.leftovers = self.__list_files()  # Stores the files left by a
+        # previous run, which are recovered by the background thread.
+        self.closed = False
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.closer = threading.Thread(target=self.__close_expired,
+                                       name='archive-closer',
+                                       daemon=True)
+        self.closer.start()
+        ArchiveWriter.instances.add(self)
+
+    def write(self,
+              label: str,
+              data: dict,
+              on_commit: Callable = None):
+        """
+        Adds ``data`` to the archive file of its label and hour. The hour is
+        taken from the ``mtime`` of ``data``.
+
+        :param label: The label of the stream of ``data``.
+        :param data: A data item streamed from meetup.
+        :param on_commit: A function called without parameters once the
+            file containing ``data`` is closed and uploaded, from the
+            background thread.
+        """
+        row = conform(data, load_schema(label, self.schema_dir)) \
+            if label in LABEL_SCHEMAS else data
+        hour = get_hour(data)
+        with self.lock:
+            archive_file = self.files.get((label, hour))
+            if archive_file is None:
+                archive_file = self.__open(label, hour)
+                self.files[(label, hour)] = archive_file
+            archive_file.write(row)
+            if on_commit:
+                archive_file.commits.append(on_commit)
+            if archive_file.num_rows >= self.max_rows:
+                self.pending.append(self.files.pop((label, hour)))
+                self.condition.notify()
+
+    def commit(self, archive_file: ArchiveFile):
+        """
+        Closes ``archive_file``, uploads it, and calls its commit functions.
+
+        :param archive_file: A file that is no longer written to.
+        """
+        try:
+            archive_file.close()
+        except Exception as e:
+            self.__log_error('Error while closing an archive file.',
+                             archive_file.path, e)
+            return
+        if self.upload(archive_file.path):
+            for on_commit in archive_file.commits:
+                on_commit()
+
+    def upload(self, path: str) -> bool:
+        """
+        Uploads the closed archive file at ``path`` using self.uploader, and
+        deletes it once it is uploaded.
+
+        :param path: The local path of a closed archive file.
+        :return: Whether the file is committed.
+        """
+        if self.uploader is None:
+            return True
+        name = os.path.relpath(path, self.directory).replace(os.sep, '/')
+        if not self.uploader(path, name):
+            return False  # The file is uploaded again on the next startup.
+        os.remove(path)
+        return True
+
+    def close(self):
+        """
+        Stops the background thread once it has committed the file it is
+        committing, and commits all other full and open files.
+        """
+        with self.lock:
+            self.closed = True
+            files = self.pending + list(self.files.values())
+            self.pending = []
+            self.files = {}
+            self.condition.notify()
+        if self.closer is not threading.current_thread():
+            self.closer.join()
+        for archive_file in files:
+            self.commit(archive_file)
+        ArchiveWriter.instances.discard(self)
+
+    @classmethod
+    def close_all(cls):
+        """
+        Closes all open writers.
+        """
+        for writer in list(cls.instances):
+            writer.close()
+
+    def recover(self):
+        """
+        Commits the files left by a previous run. The rows of files that
+        were not closed are recovered up to the last complete row.
+
+        If self.discard_uncommitted is True, the files that were not closed,
+        or not uploaded, are deleted instead, since the spool replays all of
+        their rows, which would otherwise be archived twice.
+        """
+        discarded = 0
+        while self.leftovers:
+            path = self.leftovers.pop()
+            try:
+                if self.discard_uncommitted and \
+                        (path.endswith('.part') or self.uploader is not None):
+                    os.remove(path)
+                    discarded += 1
+                    continue
+                if path.endswith('.part'):
+                    path = self.__recover_part(path)
+                if path:
+                    self.upload(path)
+            except Exception as e:
+                self.__log_error('Error while recovering an archive file.',
+                                 path, e)
+        if discarded and self.logger:
+            self.logger.log_struct(
+                {'desc': 'Discarded the uncommitted archive files of a '
+                         'previous run, whose rows are replayed from the '
+                         'spool.',
+                 'files': discarded,
+                 'directory': self.directory}, severity='NOTICE')
+
+    def stats(self) -> dict:
+        """
+        :return: A dictionary containing the number of open files, the
+            number of rows in them, and the number of full files waiting to
+            be committed.
+        """
+        with self.lock:
+            return {'open_files': len(self.files),
+                    'rows': sum(f.num_rows for f in self.files.values()),
+                    'pending_files': len(self.pending)}
+
+    def __open(self, label: str, hour: str) -> ArchiveFile:
+        """
+        Creates a new archive file. Should be called while holding
+        self.lock.
+
+        :param label: The label of the stream of the file.
+        :param hour: The hour of the file, formatted as YYYYMMDDHH.
+        :return: The new *ArchiveFile*.
+        """
+        path = get_archive_path(self.directory, label, hour,
+                                uuid.uuid4().hex[:12], self.file_format)
+        fields = load_schema(label, self.schema_dir) \
+            if label in LABEL_SCHEMAS else None
+        return ArchiveFile(path=path,
+                           file_format=self.file_format,
+                           fields=fields)
+
+    def __list_files(self) -> List[str]:
+        """
+        Lists the archive files of the two newest hour partitions of each
+        label, which are the current and the previous hour of the previous
+        run. The files of older hours were closed before the previous run
+        ended, so the rest of the archive is not walked.
+
+        :return: The paths of the archive files, including the files that
+            were not closed.
+        """
+        paths = []
+        if not os.path.isdir(self.directory):
+            return paths
+        for label in sorted(os.listdir(self.directory)):
+            label_dir = os.path.join(self.directory, label)
+            if not os.path.isdir(label_dir):
+                continue
+            days = sorted(day for day in os.listdir(label_dir)
+                          if day.startswith('dt='))
+            hour_dirs = []
+            for day in days[-2:]:
+                day_dir = os.path.join(label_dir, day)
+                hour_dirs.extend(os.path.join(day_dir, hour)
+                                 for hour in sorted(os.listdir(day_dir))
+                                 if hour.startswith('hour='))
+            for hour_dir in hour_dirs[-2:]:
+                for name in os.listdir(hour_dir):
+                    if name.endswith((f'.{self.file_format}',
+                                      f'.{self.file_format}.part')):
+                        paths.append(os.path.join(hour_dir, name))
+        return sorted(paths)
+
+    def __close_expired(self):
+        """
+        Recovers the files left by a previous run, then commits the full
+        files, and the files of the hours that ended more than self.grace
+        seconds ago, until the writer is closed.
+        """
+        self.recover()
+        while True:
+            with self.condition:
+                if not self.pending and not self.closed:
+                    self.condition.wait(60)
+                if self.closed:
+                    return
+                expired = [key for key in self.files
+                           if self.__hour_end(key[1]) + self.grace <
+                           time.time()]
+                files = self.pending + [self.files.pop(key)
+                                        for key in expired]
+                self.pending = []
+            for archive_file in files:
+                self.commit(archive_file)
+
+    def __recover_part(self, part_path: str) -> str:
+        """
+        Rewrites the complete rows of a newline-delimited JSON file that was
+        not closed into a new closed file. Partial Parquet files can not be
+        recovered, and are deleted.
+
+        :param part_path: The path of the file that was not closed.
+        :return: The path of the closed file, or None if no rows were
+            recovered.
+        """
+        path = part_path[:-len('.part')]
+        if self.file_format == ArchiveFormats.parquet.value:
+            os.remove(part_path)
+            return None
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        num_rows = 0
+        buffer = b''
+        with open(part_path, 'rb') as part_file, \
+                gzip.open(path, 'wb') as gzip_file:
+            for chunk in iter(lambda: part_file.read(1 << 20), b''):
+                try:
+                    buffer += decompressor.decompress(chunk)
+                except zlib.error:  # The rest of the file is corrupted.
+                    break
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    gzip_file.write(line + b'\n')
+                    num_rows += 1
+        os.remove(part_path)
+        if not num_rows:
+            os.remove(path)
+            return None
+        return path
+
+    def __log_error(self, desc: str, path: str, e: Exception):
+        """
+        Logs an error of the writer.
+
+        :param desc: A description of the error.
+        :param path: The path of the file the error is about.
+        :param e: The exception.
+        """
+        log_struct = {'desc': desc,
+                      'path': path,
+                      'exc_type': str(type(e)),
+                      'exc_args': str(e.args)}
+        if self.logger:
+            self.logger.log_struct(log_struct, severity='ERROR')
+        else:
+            print(json.dumps(log_struct, indent=4))
+
+    @staticmethod
+    def __hour_end(hour: str) -> float:
+        """
+        :param hour: An hour formatted as YYYYMMDDHH.
+        :return: The unix time of the end of ``hour``.
+        """
+        start = datetime.datetime.strptime(hour, '%Y%m%d%H') \
+            .replace(tzinfo=datetime.timezone.utc)
+        return start.timestamp() + 60 * 60
+
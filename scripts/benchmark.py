@@ -0,0 +1,243 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks trigger_gcf.py offline, against a local *StreamSimulator*.
+
+For each engine, the script is started in a subprocess with its logs written
+to a local file. The simulated streams then produce data items for
+``--duration`` seconds, and the script gets up to ``--drain`` more seconds to
+save them before it is stopped with SIGTERM. The benchmark reports the
+throughput, the percentiles of the end-to-end latency (from the moment a data
+item is streamed until save_stream_data first receives it), the peak memory
+of the script's processes, and the number of dropped and duplicated data
+items.
+
+Usage:
+    python benchmark.py --engines threads asyncio --duration 60 --rate 100 \\
+        --configs '{"stream_batch_size": 50}'
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import argparse
+import tempfile
+import subprocess
+from typing import Dict
+from stream_simulator import StreamSimulator, STREAM_LABELS
+import trigger_gcf
+from trigger_gcf import pprint, BColors, Engines, OptConfigs, LOCAL_LOG_ENV
+
+REPORT_COLUMNS = (('engine', '{}'),
+                  ('events_per_second', '{:.1f}'),
+                  ('latency_p50', '{:.3f}'),
+                  ('latency_p95', '{:.3f}'),
+                  ('latency_p99', '{:.3f}'),
+                  ('peak_rss_mib', '{:.1f}'),
+                  ('emitted', '{}'),
+                  ('dropped', '{}'),
+                  ('duplicates', '{}'),
+                  ('errors_logged', '{}'))
+
+
+def process_tree_rss(pid: int) -> int:
+    """
+    :param pid: The ID of a process.
+    :return: The total resident memory, in bytes, of the process and all of
+        its descendants. Only supported on Linux; 0 elsewhere.
+    """
+    children = {}
+    rss = {}
+    for name in os.listdir('/proc') if os.path.isdir('/proc') else []:
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as stat_file:
+                fields = stat_file.read().rsplit(')', 1)[1].split()
+        except OSError:  # The process exited.
+            continue
+        children.setdefault(int(fields[1]), []).append(int(name))
+        rss[int(name)] = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        total += rss.get(current, 0)
+        pending.extend(children.get(current, []))
+    return total
+
+
+def count_logged_errors(log_path: str) -> int:
+    """
+    :param log_path: The path of the log file of a *LocalLogger*.
+    :return: The number of logs with severity ERROR or higher.
+    """
+    if not os.path.exists(log_path):
+        return 0
+    severities = {'ERROR', 'CRITICAL', 'ALERT', 'EMERGENCY'}
+    with open(log_path) as log_file:
+        return sum(json.loads(line).get('severity') in severities
+                   for line in log_file if line.strip())
+
+
+def run_engine(engine: str, args: argparse.Namespace) -> Dict:
+    """
+    Benchmarks trigger_gcf.py with the ``engine`` config set to ``engine``.
+
+    :param engine: A value of *Engines*.
+    :param args: The command line arguments of the benchmark.
+    :return: The results of the benchmark.
+    """
+    simulator = StreamSimulator(labels=args.streams,
+                                rate=args.rate,
+                                item_size=args.item_size,
+                                disconnect_interval=args.disconnect_interval,
+                                gcf_latency=args.gcf_latency,
+                                gcf_error_rate=args.gcf_error_rate,
+                                profile_latency=args.profile_latency,
+                                profile_error_rate=args.profile_error_rate,
+                                seed=args.seed)
+    simulator.start()
+    work_dir = tempfile.mkdtemp(prefix=f'benchmark-{engine}-')
+    configs = {**simulator.gcf_configs,
+               OptConfigs.engine.value: engine,
+               OptConfigs.spill_dir.value: os.path.join(work_dir, 'spill'),
+               OptConfigs.spool_dir.value: os.path.join(work_dir, 'spool'),
+               OptConfigs.checkpoint_dir.value:
+                   os.path.join(work_dir, 'checkpoints'),
+               OptConfigs.archive_dir.value: os.path.join(work_dir, 'archive'),
+               OptConfigs.bq_dry_run_dir.value:
+                   os.path.join(work_dir, 'bq_dry_run'),
+               OptConfigs.meetup_rate_limit.value: 1000,
+               OptConfigs.meetup_rate_burst.value: 1000,
+               **json.loads(args.configs)}
+    config_path = os.path.join(work_dir, 'config.json')
+    with open(config_path, 'w') as config_file:
+        json.dump(configs, config_file)
+    log_path = os.path.join(work_dir, 'trigger.log')
+    with open(os.path.join(work_dir, 'stdout.log'), 'w') as stdout_file:
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--child',
+             config_path, *simulator.stream_urls],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env={**os.environ, LOCAL_LOG_ENV: log_path},
+            stdout=stdout_file,
+            stderr=subprocess.STDOUT)
+    pprint(f'Benchmarking the {engine} engine for {args.duration}s...',
+           pformat=BColors.OKBLUE)
+    peak_rss = 0
+    try:
+        time.sleep(args.warmup)  # Lets the streams connect.
+        simulator.produce()
+        produce_end = time.monotonic() + args.duration
+        drain_end = produce_end + args.drain
+        while time.monotonic() < drain_end and process.poll() is None:
+            time.sleep(0.5)
+            peak_rss = max(peak_rss, process_tree_rss(process.pid))
+            if time.monotonic() >= produce_end:
+                simulator.produce(False)
+                if not simulator.results()['dropped']:
+                    break
+    finally:
+        simulator.produce(False)
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=args.shutdown_timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        simulator.stop()
+    results = {'engine': engine,
+               **simulator.results(),
+               'peak_rss_mib': peak_rss / 1024 / 1024,
+               'errors_logged': count_logged_errors(log_path),
+               'exit_code': process.returncode}
+    if args.keep:
+        results['work_dir'] = work_dir
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def print_report(results: list):
+    """
+    Prints a table of the main results of each engine.
+
+    :param results: The results of the benchmark of each engine.
+    """
+    widths = [max(len(name), 10) for name, _ in REPORT_COLUMNS]
+    header = '  '.join(name.rjust(width) for (name, _), width
+                       in zip(REPORT_COLUMNS, widths))
+    pprint(header, pformat=[BColors.BOLD, BColors.HEADER], timestamp=False)
+    for result in results:
+        cells = []
+        for (name, fmt), width in zip(REPORT_COLUMNS, widths):
+            value = result.get(name)
+            cells.append(('-' if value is None else fmt.format(value))
+                         .rjust(width))
+        failed = result['dropped'] or result['exit_code'] not in (0, None)
+        pprint('  '.join(cells),
+               pformat=BColors.WARNING if failed else BColors.OKGREEN,
+               timestamp=False)
+
+
+def run_child(config_path: str, stream_urls: list):
+    """
+    The entry point of the benchmarked subprocess.
+
+    :param config_path: The path of the configuration file.
+    :param stream_urls: The URLs of the simulated streams.
+    """
+    trigger_gcf.main(stream_urls=stream_urls, config_path=config_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--engines', nargs='+',
+                        default=[Engines.threads.value, Engines.asyncio.value],
+                        choices=[e.value for e in Engines])
+    parser.add_argument('--streams', nargs='+', default=list(STREAM_LABELS),
+                        choices=STREAM_LABELS)
+    parser.add_argument('--duration', type=float, default=30,
+                        help='Seconds during which data items are streamed.')
+    parser.add_argument('--drain', type=float, default=30,
+                        help='Maximum seconds for saving the remaining data '
+                             'items, after the streams stop.')
+    parser.add_argument('--warmup', type=float, default=3,
+                        help='Seconds for connecting to the streams.')
+    parser.add_argument('--shutdown-timeout', type=float, default=90)
+    parser.add_argument('--rate', type=float, default=50,
+                        help='Data items per second of each stream.')
+    parser.add_argument('--item-size', type=int, default=1000)
+    parser.add_argument('--disconnect-interval', type=float, default=0,
+                        help='Mean seconds between dropped stream '
+                             'connections. 0 never drops them.')
+    parser.add_argument('--gcf-latency', type=float, default=0.05)
+    parser.add_argument('--gcf-error-rate', type=float, default=0)
+    parser.add_argument('--profile-latency', type=float, default=0.1)
+    parser.add_argument('--profile-error-rate', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--configs', default='{}',
+                        help='Configs of trigger_gcf.py, as JSON.')
+    parser.add_argument('--output', default=None,
+                        help='A file to write the results to, as JSON.')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the logs, spool and checkpoints of each '
+                             'run.')
+    parser.add_argument('--child', nargs='+', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(config_path=args.child[0], stream_urls=args.child[1:])
+        return
+    results = [run_engine(engine, args) for engine in args.engines]
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Loads meetup stream data into BigQuery tables whose schemas are in
+``bq_table_schema``, in batches of load jobs or streaming inserts.
+"""
+import io
+import os
+import json
+import time
+import hashlib
+import weakref
+import threading
+from enum import Enum
+from typing import Callable, List, Any, Tuple
+from custom_typing import Logger
+from bq_schema import SCHEMA_DIR, LABEL_SCHEMAS, load_schema, conform
+from fast_json import json_dumps
+
+try:
+    from google.cloud import bigquery
+except ImportError:  # Not needed for dry runs.
+    bigquery = None
+
+
+class LoadModes(Enum):
+    load = 'load'  # Batch load jobs, which are free but limited per day.
+    insert = 'insert'  # Streaming inserts, which are billed per byte.
+    dry_run = 'dry_run'  # Rows are appended to local files instead.
+
+
+class LoadBatch(object):
+    """
+    The rows of a table that are waiting to be loaded.
+    """
+
+    def __init__(self, label: str):
+        """
+        Initializes an instance of class *LoadBatch*.
+
+        :param label: The label of the stream of the rows.
+        """
+        self.label = label
+        self.lines = []  # Stores the rows, encoded as JSON.
+        self.num_bytes = 0
+        self.commits = []  # Stores the function called once each row is
+        # loaded, or None.
+        self.failures = []  # Stores the function called if each row can
+        # not be loaded, or None.
+        self.created = time.monotonic()
+
+    def add(self,
+            line: bytes,
+            on_commit: Callable = None,
+            on_failure: Callable = None):
+        """
+        Adds a row to the batch.
+
+        :param line: A row encoded as JSON.
+        :param on_commit: A function called without parameters once the row
+            is loaded.
+        :param on_failure: A function called without parameters if the row
+            can not be loaded.
+        """
+        self.lines.append(line)
+        self.num_bytes += len(line) + 1
+        self.commits.append(on_commit)
+        self.failures.append(on_failure)
+
+
+class BigQueryLoader(object):
+    """
+    A thread-safe loader that validates stream data items against the
+    schemas in ``bq_table_schema``, and loads them into one table per label.
+    Rows are batched per table, and a batch is loaded once it holds
+    ``max_rows`` rows or ``max_bytes`` bytes, or is ``max_age`` seconds old.
+    The batches of each table are loaded by a background thread of their
+    own, so retrying the batches of one table never delays the others.
+    """
+    instances = weakref.WeakSet()  # Stores all open loaders, so that they
+    # can be closed on shutdown.
+
+    def __init__(self,
+                 dataset: str,
+                 mode: str = LoadModes.load.value,
+                 max_rows: int = 10000,
+                 max_bytes: int = 10 * 1024 * 1024,
+                 max_age: float = 5 * 60,
+                 table_prefix: str = '',
+                 dry_run_dir: str = None,
+                 attempt: Callable[[Callable, list], bool] = None,
+                 logger: Logger = None,
+                 schema_dir: str = SCHEMA_DIR):
+        """
+        Initializes an instance of class *BigQueryLoader*.
+
+        :param dataset: The BigQuery dataset of the tables, as
+            ``project.dataset`` or ``dataset``.
+        :param mode: A value of *LoadModes*.
+        :param max_rows: The maximum number of rows in a batch.
+        :param max_bytes: The maximum number of bytes in a batch.
+        :param max_age: The maximum number of seconds a row waits before it
+            is loaded.
+        :param table_prefix: A prefix of the names of the tables. The name
+            of a table is the prefix followed by the label of its stream.
+        :param dry_run_dir: The folder of the files rows are appended to
+            when ``mode`` is 'dry_run'.
+        :param attempt: A function called with a loading function and its
+            parameters, which returns whether the call succeeded. It can be
+            used for retrying failed calls. A failed streaming insert narrows
+            its rows down to the rows that were not inserted, so that only
+            they are retried. If None, the loading function is called once.
+        :param logger: A Stackdriver logger for logging errors.
+        :param schema_dir: The folder of the BigQuery schemas.
+        """
+        self.dataset = dataset
+        self.mode = mode
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.table_prefix = table_prefix
+        self.dry_run_dir = dry_run_dir
+        self.attempt = attempt or self.__attempt_once
+        self.logger = logger
+        self.schema_dir = schema_dir
+        self.client = None
+        if mode == LoadModes.dry_run.value:
+            os.makedirs(dry_run_dir, exist_ok=True)
+        elif bigquery is None:
+            raise ImportError('Loading into BigQuery requires '
+                              'google-cloud-bigquery.')
+        else:
+            self.client = bigquery.Client()
+        self.batches = {}  # Stores the open batch of each label.
+        self.ready = {}  # Stores the batches of each label that are waiting
+        # to be loaded.
+        self.flushers = {}  # Stores the background thread of each label.
+        self.num_loaded = 0
+        self.num_failed = 0
+        self.num_invalid = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        BigQueryLoader.instances.add(self)
+
+    def write(self,
+              label: str,
+              data: dict,
+              on_commit: Callable = None,
+              on_failure: Callable = None):
+        """
+        Validates ``data`` against the schema of ``label``, and adds it to
+        the batch of the table of ``label``. Values that can not be coerced
+        to the types of their fields are loaded as null, and logged.
+
+        :param label: The label of the stream of ``data``.
+        :param data: A data item streamed from meetup.
+        :param on_commit: A function called without parameters once
+            ``data`` is loaded.
+        :param on_failure: A function called without parameters if ``data``
+            can not be loaded.
+        """
+        if label not in LABEL_SCHEMAS:
+            raise ValueError(f'There is no BigQuery schema for {label}.')
+        errors = []
+        row = conform(data, load_schema(label, self.schema_dir), errors)
+        if errors:
+            self.__log({'desc': 'Data item does not conform to the schema.',
+                        'label': label,
+                        'fields': errors}, severity='WARNING')
+        line = json_dumps(row)
+        with self.lock:
+            if errors:
+                self.num_invalid += 1
+            batch = self.batches.get(label)
+            if batch is None:
+                batch = self.batches[label] = LoadBatch(label)
+            batch.add(line, on_commit, on_failure)
+            if label not in self.flushers:
+                self.__start_flusher(label)
+            if len(batch.lines) >= self.max_rows or \
+                    batch.num_bytes >= self.max_bytes:
+                self.ready.setdefault(label, []).append(
+                    self.batches.pop(label))
+                self.condition.notify_all()
+
+    def flush(self):
+        """
+        Loads all batches, including the ones that are not full.
+        """
+        with self.lock:
+            batches = [batch for ready in self.ready.values()
+                       for batch in ready] + list(self.batches.values())
+            self.ready = {}
+            self.batches = {}
+        for batch in batches:
+            self.load(batch)
+
+    def load(self, batch: LoadBatch):
+        """
+        Loads the rows of ``batch`` into its table, and calls the commit
+        functions of the rows that were loaded. The rows that can not be
+        loaded are dropped, and their failure functions are called.
+
+        :param batch: A batch that is no longer added to.
+        """
+        table_id = self.table_id(batch.label)
+        if self.mode == LoadModes.dry_run.value:
+            func = self.__dry_run
+        elif self.mode == LoadModes.insert.value:
+            func = self.__insert
+        else:
+            func = self.__load_job
+        rows = list(enumerate(batch.lines))  # Narrowed down to the rows that
+        # were not loaded, by failed streaming inserts.
+        success = self.attempt(func, [table_id, batch.label, rows])
+        failed = set() if success else {index for index, _ in rows}
+        with self.lock:
+            self.num_loaded += len(batch.lines) - len(failed)
+            self.num_failed += len(failed)
+        if failed:
+            self.__log({'desc': 'Failed to load a batch into BigQuery.',
+                        'table': table_id,
+                        'rows': len(failed)}, severity='ERROR')
+        for index, (on_commit, on_failure) in enumerate(
+                zip(batch.commits, batch.failures)):
+            if index in failed:
+                if on_failure:
+                    on_failure()
+            elif on_commit:
+                on_commit()
+
+    def table_id(self, label: str) -> str:
+        """
+        :param label: The label of a stream.
+        :return: The ID of the table of ``label``.
+        """
+        return f'{self.dataset}.{self.table_prefix}{label}'
+
+    def close(self):
+        """
+        Loads all batches, and stops the background thread.
+        """
+        with self.lock:
+            self.closed = True
+            self.condition.notify_all()
+            flushers = list(self.flushers.values())
+        for flusher in flushers:
+            flusher.join()
+        self.flush()
+        BigQueryLoader.instances.discard(self)
+
+    @classmethod
+    def close_all(cls):
+        """
+        Closes all open loaders.
+        """
+        for loader in list(cls.instances):
+            loader.close()
+
+    def stats(self) -> dict:
+        """
+        :return: A dictionary containing the number of rows waiting to be
+            loaded, loaded, failed to load, and not conforming to their
+            schema.
+        """
+        with self.lock:
+            pending = sum(len(b.lines) for ready in self.ready.values()
+                          for b in ready) + \
+                sum(len(b.lines) for b in self.batches.values())
+            return {'pending': pending,
+                    'loaded': self.num_loaded,
+                    'failed': self.num_failed,
+                    'invalid': self.num_invalid}
+
+    def __start_flusher(self, label: str):
+        """
+        Starts the background thread that loads the batches of ``label``.
+        Should be called while holding self.lock.
+
+        :param label: The label of a stream.
+        """
+        flusher = threading.Thread(target=self.__flush_batches,
+                                   args=(label,),
+                                   name=f'bq-loader-{label}',
+                                   daemon=True)
+        self.flushers[label] = flusher
+        flusher.start()
+
+    def __flush_batches(self, label: str):
+        """
+        Loads the full batches of ``label``, and its batch once it is older
+        than self.max_age, until the loader is closed.
+
+        :param label: The label of a stream.
+        """
+        while True:
+            with self.condition:
+                if not self.ready.get(label) and not self.closed:
+                    self.condition.wait(min(1, self.max_age))
+                if self.closed:
+                    return
+                batches = self.ready.pop(label, [])
+                batch = self.batches.get(label)
+                if batch is not None and \
+                        time.monotonic() - batch.created >= self.max_age:
+                    batches.append(self.batches.pop(label))
+            for batch in batches:
+                try:
+                    self.load(batch)
+                except Exception as e:
+                    self.__log({'desc': 'Error while loading a batch.',
+                                'table': self.table_id(batch.label),
+                                'exc_type': str(type(e)),
+                                'exc_args': str(e.args)}, severity='ERROR')
+
+    def __load_job(self,
+                   table_id: str,
+                   label: str,
+                   rows: List[Tuple[int, bytes]]):
+        """
+        Loads ``rows`` into ``table_id`` using a load job, and waits for
+        the job to finish.
+
+        :param table_id: The ID of the table.
+        :param label: The label of the stream of the rows.
+        :param rows: The indexes of the rows in their batch, and the rows
+            encoded as JSON.
+        """
+        fields = load_schema(label, self.schema_dir)
+        job_config = bigquery.LoadJobConfig()
+        job_config.schema = [bigquery.SchemaField.from_api_repr(field)
+                             for field in fields]
+        job_config.source_format = \
+            bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
+        job_config.write_disposition = bigquery.WriteDisposition.WRITE_APPEND
+        job_config.create_disposition = \
+            bigquery.CreateDisposition.CREATE_IF_NEEDED
+        job = self.client.load_table_from_file(
+            io.BytesIO(b'\n'.join(line for _, line in rows)),
+            table_id,
+            job_config=job_config)
+        job.result()
+
+    def __insert(self,
+                 table_id: str,
+                 label: str,
+                 rows: List[Tuple[int, bytes]]):
+        """
+        Inserts ``rows`` into ``table_id`` using streaming inserts. The
+        insert ID of a row is its hash, so rows inserted again by a retry are
+        deduplicated by BigQuery. If some rows are not inserted, ``rows`` is
+        narrowed down to them before the error is raised, so that a retry
+        only inserts those.
+
+        :param table_id: The ID of the table.
+        :param label: The label of the stream of the rows.
+        :param rows: The indexes of the rows in their batch, and the rows
+            encoded as JSON.
+        """
+        errors = self.client.insert_rows_json(
+            table_id, [json.loads(line) for _, line in rows],
+            row_ids=[hashlib.md5(line).hexdigest() for _, line in rows])
+        if errors:
+            failed = {error['index'] for error in errors
+                      if isinstance(error.get('index'), int)}
+            if failed:
+                rows[:] = [row for i, row in enumerate(rows) if i in failed]
+            raise RuntimeError(f'{len(errors)} rows of {label} were not '
+                               f'inserted: {errors[:3]}')
+
+    def __dry_run(self,
+                  table_id: str,
+                  label: str,
+                  rows: List[Tuple[int, bytes]]):
+        """
+        Appends ``rows`` to the file of ``table_id`` in self.dry_run_dir.
+
+        :param table_id: The ID of the table.
+        :param label: The label of the stream of the rows.
+        :param rows: The indexes of the rows in their batch, and the rows
+            encoded as JSON.
+        """
+        path = os.path.join(self.dry_run_dir, f'{table_id}.ndjson')
+        with open(path, 'ab') as dry_run_file:
+            dry_run_file.write(b''.join(line + b'\n' for _, line in rows))
+
+    def __attempt_once(self, func: Callable, params: List[Any]) -> bool:
+        """
+        Calls ``func`` once.
+
+        :param func: A loading function.
+        :param params: The parameters of ``func``.
+        :return: Whether the call succeeded.
+        """
+        try:
+            func(*params)
+            return True
+        except Exception as e:
+            self.__log({'desc': 'Error while loading a batch.',
+                        'func': func.__name__,
+                        'exc_type': str(type(e)),
+                        'exc_args': str(e.args)}, severity='ERROR')
+            return False
+
+    def __log(self, log_struct: dict, severity: str):
+        """
+        Logs an event of the loader.
+
+        :param log_struct: The structure to log.
+        :param severity: The severity of the event.
+        """
+        if self.logger:
+            self.logger.log_struct(log_struct, severity=severity)
+        else:
+            print(json.dumps(log_struct, indent=4))
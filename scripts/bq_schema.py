@@ -0,0 +1,148 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Loads the BigQuery table schemas in ``bq_table_schema``, and converts meetup
+stream data items into rows that conform to them.
+"""
+import os
+import json
+from typing import List, Any
+
+try:
+    import pyarrow
+except ImportError:  # Only needed for writing Parquet files.
+    pyarrow = None
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '..', 'bq_table_schema')
+# The schema file of each stream label.
+LABEL_SCHEMAS = {
+    'event_comments': 'event_comments.json',
+    'open_events': 'open_events.json',
+    'open_venues': 'open_venues.json',
+    'photos': 'photos.json',
+    'rsvps': 'rsvp.json',
+}
+_SCHEMAS = {}  # Stores the schemas that were loaded.
+
+
+def load_schema(label: str, schema_dir: str = SCHEMA_DIR) -> List[dict]:
+    """
+    Loads the BigQuery schema of the stream with label ``label``.
+
+    :param label: The label of a stream, e.g. 'rsvps'.
+    :param schema_dir: The folder of the schema files.
+    :return: The list of fields of the schema.
+    """
+    path = os.path.join(schema_dir, LABEL_SCHEMAS[label])
+    if path not in _SCHEMAS:
+        with open(path) as schema_file:
+            _SCHEMAS[path] = json.load(schema_file)
+    return _SCHEMAS[path]
+
+
+def conform(data: dict,
+            fields: List[dict],
+            errors: List[str] = None,
+            path: str = '') -> dict:
+    """
+    Converts ``data`` into a row that conforms to ``fields``. Values that are
+    not in the schema are dropped, values are coerced to the types of their
+    fields, and records of REPEATED fields are wrapped in lists. Values that
+    can not be coerced are set to None.
+
+    :param data: A data item streamed from meetup.
+    :param fields: The fields of a BigQuery schema.
+    :param errors: If not None, the paths of the values that could not be
+        coerced are appended to it.
+    :param path: The path of ``data`` inside the data item, used in
+        ``errors``.
+    :return: A row that can be loaded into a table with schema ``fields``.
+    """
+    row = {}
+    for field in fields:
+        name = field['name']
+        field_path = f'{path}.{name}' if path else name
+        value = data.get(name) if isinstance(data, dict) else None
+        if field.get('mode') == 'REPEATED':
+            if value is None:
+                value = []
+            elif not isinstance(value, list):
+                value = [value]
+            row[name] = []
+            for v in value:
+                coerced = _coerce(v, field, errors, field_path)
+                if coerced is not None:
+                    row[name].append(coerced)
+        else:
+            row[name] = _coerce(value, field, errors, field_path)
+    return row
+
+
+def _coerce(value: Any,
+            field: dict,
+            errors: List[str] = None,
+            path: str = '') -> Any:
+    """
+    Coerces ``value`` to the type of ``field``.
+
+    :param value: A value of a data item.
+    :param field: A field of a BigQuery schema.
+    :param errors: If not None, ``path`` is appended to it if ``value`` can
+        not be coerced.
+    :param path: The path of ``value`` inside the data item.
+    :return: The coerced value, or None if it can not be coerced.
+    """
+    if value is None:
+        return None
+    field_type = field['type']
+    coerced = value
+    try:
+        if field_type == 'RECORD':
+            coerced = conform(value, field['fields'], errors, path) \
+                if isinstance(value, dict) else None
+        elif field_type == 'STRING':
+            coerced = value if isinstance(value, str) else json.dumps(value)
+        elif field_type == 'INTEGER':
+            coerced = int(value)
+        elif field_type == 'FLOAT':
+            coerced = float(value)
+        elif field_type == 'BOOLEAN':
+            coerced = value.lower() == 'true' \
+                if isinstance(value, str) else bool(value)
+    except (TypeError, ValueError, OverflowError):
+        coerced = None
+    if coerced is None and errors is not None:
+        errors.append(path)
+    return coerced
+
+
+def arrow_schema(fields: List[dict]) -> 'pyarrow.Schema':
+    """
+    Converts a BigQuery schema into a pyarrow schema, for writing Parquet
+    files.
+
+    :param fields: The fields of a BigQuery schema.
+    :return: The equivalent pyarrow schema.
+    """
+    if pyarrow is None:
+        raise ImportError('Writing Parquet files requires pyarrow.')
+    return pyarrow.schema([_arrow_field(field) for field in fields])
+
+
+def _arrow_field(field: dict) -> 'pyarrow.Field':
+    """
+    :param field: A field of a BigQuery schema.
+    :return: The equivalent pyarrow field.
+    """
+    if field['type'] == 'RECORD':
+        arrow_type = pyarrow.struct(
+            [_arrow_field(subfield) for subfield in field['fields']])
+    else:
+        arrow_type = {'STRING': pyarrow.string(),
+                      'INTEGER': pyarrow.int64(),
+                      'FLOAT': pyarrow.float64(),
+                      'BOOLEAN': pyarrow.bool_()}[field['type']]
+    if field.get('mode') == 'REPEATED':
+        arrow_type = pyarrow.list_(arrow_type)
+    return pyarrow.field(field['name'], arrow_type)
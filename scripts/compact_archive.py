@@ -0,0 +1,527 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Compacts the per-event files written by save_stream_data into large, hourly,
+compressed archive files, in the layout written by *ArchiveWriter*.
+
+The compaction has two phases. First, the objects of a label are listed page
+by page and read concurrently, and their data items are appended to one
+staging file per hour. Then, the data items of each hour are deduplicated by
+ID and mtime, and written to archive files. Progress is saved to a manifest
+after each page and each hour, so an interrupted compaction resumes where it
+stopped.
+
+Usage:
+    python compact_archive.py --label rsvps --source gs://meetup-bucket \\
+        --dest ../compacted
+"""
+import os
+import ast
+import json
+import time
+import argparse
+from enum import Enum
+from concurrent.futures import ThreadPoolExecutor
+from typing import Generator, List, Tuple, Union
+from google.cloud import storage
+from archive_writer import ArchiveFile, ArchiveFormats, get_hour, \
+    get_archive_path
+from bq_schema import LABEL_SCHEMAS, load_schema, conform
+
+
+class BColors(Enum):
+    """
+    The color codes of the text printed by ``pprint``, which are the ones
+    of trigger_gcf. They are not imported from it, as it sets up the whole
+    streaming stack on import.
+    """
+    OKBLUE = '\033[96m'
+    OKWHITE = '\033[98m'
+    OKGREEN = '\033[92m'
+    FAIL = '\033[91m'
+    ENDC = '\033[0m'
+
+
+def pprint(text: str, pformat: BColors = BColors.OKWHITE) -> None:
+    """
+    Prints ``text`` in the color ``pformat``, after the local time.
+
+    :param text: The text to be printed.
+    :param pformat: The color of the text.
+    """
+    print(f'{time.strftime("%b %d, %H:%M:%S")} — {pformat.value}{text}'
+          f'{BColors.ENDC.value}', flush=True)
+
+
+class LocalSource(object):
+    """
+    A local folder with the same layout as the GCS bucket, which can be used
+    instead of it.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Initializes an instance of class *LocalSource*.
+
+        :param directory: The folder that stands in for the bucket.
+        """
+        self.directory = directory
+
+    def list_pages(self,
+                   prefix: str,
+                   page_token: str = None,
+                   page_size: int = 1000
+                   ) -> Generator[Tuple[List[str], str], None, None]:
+        """
+        Lists the names of the objects starting with ``prefix``, in pages.
+
+        :param prefix: The prefix of the names, e.g. 'rsvps/'.
+        :param page_token: The token of the page to start from. If None,
+            the listing starts from the first page.
+        :param page_size: The number of names in a page.
+        :return: A generator of the names of each page, and the token of the
+            next page (None for the last page).
+        """
+        names = []
+        for root, _, files in os.walk(os.path.join(self.directory, prefix)):
+            for file in files:
+                path = os.path.relpath(os.path.join(root, file),
+                                       self.directory)
+                names.append(path.replace(os.sep, '/'))
+        names = sorted(name for name in names
+                       if page_token is None or name > page_token)
+        for start in range(0, len(names), page_size):
+            page = names[start:start + page_size]
+            next_token = page[-1] if start + page_size < len(names) else None
+            yield page, next_token
+
+    def read(self, name: str) -> bytes:
+        """
+        :param name: The name of an object.
+        :return: The content of the object.
+        """
+        with open(os.path.join(self.directory, name), 'rb') as object_file:
+            return object_file.read()
+
+
+class GcsSource(object):
+    """
+    A GCS bucket.
+    """
+
+    def __init__(self, bucket_name: str):
+        """
+        Initializes an instance of class *GcsSource*.
+
+        :param bucket_name: The name of the bucket.
+        """
+        self.bucket = storage.Client().bucket(bucket_name)
+
+    def list_pages(self,
+                   prefix: str,
+                   page_token: str = None,
+                   page_size: int = 1000
+                   ) -> Generator[Tuple[List[str], str], None, None]:
+        """
+        The equivalent of ``LocalSource.list_pages``, which uses the
+        paginated listing of GCS. GCS pages hold up to 1000 names, so
+        ``page_size`` is ignored.
+        """
+        blobs = self.bucket.list_blobs(prefix=prefix, page_token=page_token)
+        for page in blobs.pages:
+            yield [blob.name for blob in page], blobs.next_page_token
+
+    def read(self, name: str) -> bytes:
+        """
+        :param name: The name of an object.
+        :return: The content of the object.
+        """
+        return self.bucket.blob(name).download_as_string()
+
+
+def parse_object(name: str, content: bytes) -> List[dict]:
+    """
+    Parses the data items of an object written by save_stream_data or
+    save_stream_batch. Older objects hold the Python representation of a
+    data item, which is parsed as a literal, so no code is executed.
+
+    :param name: The name of the object.
+    :param content: The content of the object.
+    :return: The data items of the object.
+    """
+    text = content.decode('utf-8')
+    payloads = text.splitlines() if name.endswith('.ndjson') else [text]
+    data_items = []
+    for payload in payloads:
+        if not payload.strip():
+            continue
+        try:
+            data_item = json.loads(payload)
+        except ValueError:
+            data_item = ast.literal_eval(payload)
+        if not isinstance(data_item, dict):
+            raise ValueError(f'{name} does not hold a data item.')
+        data_items.append(data_item)
+    return data_items
+
+
+def get_object_time(name: str) -> Union[float, None]:
+    """
+    :param name: The name of an object, ending in ``_{timestamp}.json``.
+    :return: The unix time the object was written at, or None if ``name``
+        does not include it.
+    """
+    try:
+        return float(name.rsplit('_', 1)[1].rsplit('.', 1)[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def get_data_id(data: dict, label: str) -> Union[str, int, None]:
+    """
+    Parses the unique ID of a data item, based on the stream it came from.
+    The equivalent of ``get_data_id`` of save_stream_data.
+
+    :param data: The data item.
+    :param label: The label describing the stream of the data item.
+    :return: The unique ID of the data item, or None if it has none.
+    """
+    if label == 'rsvps':
+        return data.get('rsvp_id')
+    elif label == 'photos':
+        return data.get('photo_id')
+    return data.get('id')
+
+
+class Compaction(object):
+    """
+    The compaction of the objects of one label.
+    """
+
+    def __init__(self,
+                 source: Union[LocalSource, GcsSource],
+                 label: str,
+                 dest_dir: str,
+                 work_dir: str,
+                 file_format: str = ArchiveFormats.ndjson_gz.value,
+                 workers: int = 32,
+                 page_size: int = 1000,
+                 max_rows: int = 1000000,
+                 dest_bucket: str = None,
+                 report_interval: float = 10):
+        """
+        Initializes an instance of class *Compaction*, and loads its
+        manifest, if it exists.
+
+        :param source: The source of the objects.
+        :param label: The label of the objects, which is also their folder.
+        :param dest_dir: The folder of the archive files.
+        :param work_dir: The folder of the manifest and the staging files.
+        :param file_format: A value of *ArchiveFormats*.
+        :param workers: The number of threads reading objects.
+        :param page_size: The number of objects listed at once.
+        :param max_rows: The maximum number of rows in an archive file.
+        :param dest_bucket: A GCS bucket the archive files are uploaded to.
+            If None, the files are kept in ``dest_dir``.
+        :param report_interval: The number of seconds between two reports
+            of the throughput.
+        """
+        self.source = source
+        self.label = label
+        self.dest_dir = dest_dir
+        self.file_format = file_format
+        self.workers = workers
+        self.page_size = page_size
+        self.max_rows = max_rows
+        self.dest_bucket = storage.Client().bucket(dest_bucket) \
+            if dest_bucket else None
+        self.report_interval = report_interval
+        self.staging_dir = os.path.join(work_dir, 'staging', label)
+        self.manifest_path = os.path.join(work_dir, f'{label}.manifest.json')
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self.manifest = {'page_token': None,
+                         'listing_done': False,
+                         'staged': {},  # The size of each staging file.
+                         'compacted': [],
+                         'files': {},  # The number of archive files
+                         # written for each compacted hour.
+                         'failed': [],  # The objects that were not read.
+                         'counts': {'objects': 0,
+                                    'bytes': 0,
+                                    'data_items': 0,
+                                    'duplicates': 0,
+                                    'rows': 0}}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as manifest_file:
+                self.manifest = json.load(manifest_file)
+            self.manifest.setdefault('files', {})
+            pprint(f'Resuming the compaction of {label}.',
+                   pformat=BColors.OKBLUE)
+        self.started = time.monotonic()
+        self.reported = self.started
+        self.start_counts = dict(self.manifest['counts'])
+
+    def run(self):
+        """
+        Runs both phases of the compaction. Once the listing is done, only
+        the objects that could not be read by a previous run are staged.
+        """
+        self.restore_staging()
+        if not self.manifest['listing_done']:
+            self.stage()
+        else:
+            self.stage_failed()
+        self.compact()
+        self.report(final=True)
+
+    def restore_staging(self):
+        """
+        Truncates the staging files to their sizes in the manifest, which
+        removes the data items of a page that was not finished.
+        """
+        staged = self.manifest['staged']
+        for name in os.listdir(self.staging_dir):
+            hour = name.split('.')[0]
+            path = os.path.join(self.staging_dir, name)
+            if hour not in staged or hour in self.manifest['compacted']:
+                os.remove(path)
+            else:
+                os.truncate(path, staged[hour])
+
+    def stage(self):
+        """
+        Reads the objects of self.label page by page, and appends their
+        data items to the staging file of their hour. The objects that
+        could not be read by a previous run are read again first. Objects
+        that still can not be read are left in the manifest, and are read
+        again by the next run.
+        """
+        self.stage_failed()
+        pages = self.source.list_pages(prefix=f'{self.label}/',
+                                       page_token=self.manifest['page_token'],
+                                       page_size=self.page_size)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for names, next_token in pages:
+                self.stage_page(names, executor)
+                self.manifest['page_token'] = next_token
+                self.save_manifest()
+                self.report()
+        self.manifest['listing_done'] = True
+        self.save_manifest()
+
+    def stage_failed(self):
+        """
+        Reads the objects that could not be read by a previous run again,
+        and appends their data items to the staging files. The objects that
+        still can not be read are left in the manifest.
+        """
+        failed = self.manifest['failed']
+        self.manifest['failed'] = []
+        if failed:
+            self.stage_page(failed)
+            self.save_manifest()
+
+    def stage_page(self,
+                   names: List[str],
+                   executor: ThreadPoolExecutor = None):
+        """
+        Reads the objects named ``names`` concurrently, and appends their
+        data items to the staging files. An hour that was already compacted
+        is compacted again, into new archive files.
+
+        :param names: The names of the objects.
+        :param executor: The pool of threads reading the objects.
+        """
+        if executor is None:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                return self.stage_page(names, executor)
+        counts = self.manifest['counts']
+        staging_files = {}
+        try:
+            for name, result in zip(names, executor.map(self.read, names)):
+                if isinstance(result, Exception):
+                    self.manifest['failed'].append(name)
+                    pprint(f'Could not read {name}: {result!r}',
+                           pformat=BColors.FAIL)
+                    continue
+                content, data_items = result
+                counts['objects'] += 1
+                counts['bytes'] += len(content)
+                default_time = get_object_time(name)
+                for data_item in data_items:
+                    hour = get_hour(data_item, default_time=default_time)
+                    if hour not in staging_files:
+                        if hour in self.manifest['compacted']:
+                            self.manifest['compacted'].remove(hour)
+                        staging_files[hour] = open(
+                            os.path.join(self.staging_dir, f'{hour}.ndjson'),
+                            'ab')
+                    staging_files[hour].write(
+                        json.dumps(data_item).encode('utf-8') + b'\n')
+                    counts['data_items'] += 1
+        finally:
+            for hour, staging_file in staging_files.items():
+                staging_file.flush()
+                os.fsync(staging_file.fileno())
+                self.manifest['staged'][hour] = staging_file.tell()
+                staging_file.close()
+
+    def read(self, name: str) -> Union[Tuple[bytes, List[dict]], Exception]:
+        """
+        Reads and parses an object. Called by the threads of the executor.
+
+        :param name: The name of the object.
+        :return: The content and the data items of the object, or the
+            exception raised while reading it.
+        """
+        try:
+            content = self.source.read(name)
+            return content, parse_object(name, content)
+        except Exception as e:
+            return e
+
+    def compact(self):
+        """
+        Writes the data items of each staged hour, deduplicated by ID and
+        mtime and sorted by mtime, to archive files. The archive files of an
+        hour compacted again are numbered after its previous ones.
+        """
+        counts = self.manifest['counts']
+        fields = load_schema(self.label) \
+            if self.label in LABEL_SCHEMAS else None
+        for hour in sorted(self.manifest['staged']):
+            if hour in self.manifest['compacted']:
+                continue
+            path = os.path.join(self.staging_dir, f'{hour}.ndjson')
+            seen = set()
+            data_items = []
+            with open(path, 'rb') as staging_file:
+                for line in staging_file:
+                    data_item = json.loads(line)
+                    key = (json.dumps(get_data_id(data_item, self.label)),
+                           data_item.get('mtime'))
+                    if key[0] != 'null':
+                        if key in seen:
+                            counts['duplicates'] += 1
+                            continue
+                        seen.add(key)
+                    data_items.append(data_item)
+            data_items.sort(key=lambda item: item.get('mtime') or 0)
+            first = self.manifest['files'].get(hour, 0)
+            for index in range(0, len(data_items), self.max_rows):
+                self.write_file(hour, first + index // self.max_rows, fields,
+                                data_items[index:index + self.max_rows])
+            counts['rows'] += len(data_items)
+            self.manifest['files'][hour] = \
+                first + -(-len(data_items) // self.max_rows)
+            self.manifest['compacted'].append(hour)
+            self.save_manifest()
+            os.remove(path)
+            self.report()
+
+    def write_file(self,
+                   hour: str,
+                   number: int,
+                   fields: Union[List[dict], None],
+                   data_items: List[dict]):
+        """
+        Writes an archive file, and uploads it to self.dest_bucket. The
+        names of the files are deterministic, so a file written again after
+        an interruption replaces the old one.
+
+        :param hour: The hour of the file, formatted as YYYYMMDDHH.
+        :param number: The number of the file within ``hour``.
+        :param fields: The BigQuery schema of the rows, or None if the
+            label has no schema.
+        :param data_items: The data items of the file.
+        """
+        path = get_archive_path(self.dest_dir, self.label, hour,
+                                f'compacted-{number:03d}', self.file_format)
+        archive_file = ArchiveFile(path=path,
+                                   file_format=self.file_format,
+                                   fields=fields)
+        for data_item in data_items:
+            archive_file.write(conform(data_item, fields)
+                               if fields else data_item)
+        archive_file.close()
+        if self.dest_bucket is not None:
+            name = os.path.relpath(path, self.dest_dir).replace(os.sep, '/')
+            self.dest_bucket.blob(name).upload_from_filename(path)
+            os.remove(path)
+
+    def save_manifest(self):
+        """
+        Atomically writes the manifest to disk.
+        """
+        tmp_path = f'{self.manifest_path}.tmp'
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def report(self, final: bool = False):
+        """
+        Prints the progress and throughput of this run, at most once every
+        self.report_interval seconds.
+
+        :param final: Whether this is the report at the end of the run,
+            which is always printed.
+        """
+        now = time.monotonic()
+        if not final and now - self.reported < self.report_interval:
+            return
+        self.reported = now
+        elapsed = max(now - self.started, 1e-9)
+        counts = self.manifest['counts']
+        objects = counts['objects'] - self.start_counts['objects']
+        num_bytes = counts['bytes'] - self.start_counts['bytes']
+        pprint(f'{self.label}: {counts["objects"]} objects '
+               f'({objects / elapsed:.1f}/s, '
+               f'{num_bytes / elapsed / 1024 / 1024:.2f} MiB/s), '
+               f'{counts["data_items"]} data items, '
+               f'{counts["duplicates"]} duplicates, '
+               f'{counts["rows"]} rows written, '
+               f'{len(self.manifest["compacted"])}/'
+               f'{len(self.manifest["staged"])} hours compacted, '
+               f'{len(self.manifest["failed"])} failed objects.',
+               pformat=BColors.OKGREEN if final else BColors.OKWHITE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--label', required=True,
+                        help='The label (folder) of the objects, e.g. rsvps.')
+    parser.add_argument('--source', required=True,
+                        help='gs://{bucket} or a local folder with the '
+                             'same layout.')
+    parser.add_argument('--dest', default='../compacted',
+                        help='The folder of the archive files.')
+    parser.add_argument('--dest-bucket', default=None,
+                        help='A GCS bucket to upload the archive files to.')
+    parser.add_argument('--work-dir', default='../compaction',
+                        help='The folder of the manifest and staging files.')
+    parser.add_argument('--format', default=ArchiveFormats.ndjson_gz.value,
+                        choices=[f.value for f in ArchiveFormats])
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--max-rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    if args.source.startswith('gs://'):
+        source = GcsSource(args.source[len('gs://'):].strip('/'))
+    else:
+        source = LocalSource(args.source)
+    Compaction(source=source,
+               label=args.label,
+               dest_dir=args.dest,
+               work_dir=args.work_dir,
+               file_format=args.format,
+               workers=args.workers,
+               page_size=args.page_size,
+               max_rows=args.max_rows,
+               dest_bucket=args.dest_bucket).run()
+
+
+if __name__ == "__main__":
+    main()
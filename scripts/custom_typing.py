@@ -4,4 +4,7 @@
 from typing import NewType
 from google.cloud import logging
 
-Logger = NewType('Logger', logging.logger)
+try:
+    Logger = NewType('Logger', logging.logger)
+except AttributeError:  # google-cloud-logging >= 2.0 only exports the class.
+    Logger = NewType('Logger', logging.Logger)
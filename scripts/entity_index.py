@@ -0,0 +1,585 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+An in-memory index of the members, groups, events and venues linked by the
+data items of all streams, which is built while the streams are read, and
+saved to disk periodically.
+
+IDs are interned into consecutive integers per kind of entity, and the links
+between two kinds are stored as one array of integers per entity, so the
+index stays compact, and queries such as "which members attend the events of
+a group" are answered without scanning the stored stream data.
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import array
+import base64
+import weakref
+import threading
+import collections
+from enum import Enum
+from typing import Dict, Iterable, List, Tuple, Union
+from custom_typing import Logger
+
+ARRAY_TYPECODE = 'I'  # The type of the interned IDs in the adjacency arrays.
+SNAPSHOT_VERSION = 1
+SNAPSHOT_COMPRESSION = 1  # The gzip level of the snapshots, which favors
+# speed, since the arrays hardly compress.
+
+
+class EntityKinds(Enum):
+    member = 'member'
+    group = 'group'
+    event = 'event'
+    venue = 'venue'
+
+
+# The pairs of kinds of entities that are linked directly.
+RELATIONS = ((EntityKinds.member.value, EntityKinds.group.value),
+             (EntityKinds.member.value, EntityKinds.event.value),
+             (EntityKinds.group.value, EntityKinds.event.value),
+             (EntityKinds.event.value, EntityKinds.venue.value))
+
+# The paths of the ID of each kind of entity in a data item, in order of
+# preference. The streams nest the linked entities differently.
+ENTITY_PATHS = {
+    EntityKinds.member.value: (('member', 'member_id'), ('member', 'id')),
+    EntityKinds.group.value: (('group', 'id'), ('group', 'group_id'),
+                              ('event', 'group', 'id'),
+                              ('photo_album', 'group', 'id')),
+    EntityKinds.event.value: (('event', 'event_id'), ('event', 'id'),
+                              ('photo_album', 'event', 'id')),
+    EntityKinds.venue.value: (('venue', 'venue_id'), ('venue', 'id'))}
+
+# The kind of entity whose ID is the top-level ``id`` of the data items of
+# a stream.
+ROOT_KINDS = {'open_events': EntityKinds.event.value,
+              'open_venues': EntityKinds.venue.value}
+
+# All fields of a data item read by the index.
+INDEXED_PATHS = (('id',), ('response',)) + tuple(
+    path for paths in ENTITY_PATHS.values() for path in paths)
+
+
+def get_path(data: dict, path: Tuple[str, ...]):
+    """
+    :param data: A data item.
+    :param path: The keys of a nested field.
+    :return: The value of the field, or None if it is missing.
+    """
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def get_entity_ids(label: str, data: dict) -> Dict[str, str]:
+    """
+    :param label: The label of the stream of ``data``.
+    :param data: A data item.
+    :return: The ID of each kind of entity linked by ``data``, as a string.
+    """
+    entity_ids = {}
+    root_kind = ROOT_KINDS.get(label)
+    if root_kind is not None and data.get('id') is not None:
+        entity_ids[root_kind] = str(data['id'])
+    for kind, paths in ENTITY_PATHS.items():
+        if kind in entity_ids:
+            continue
+        for path in paths:
+            value = get_path(data, path)
+            if value is not None and not isinstance(value, dict):
+                entity_ids[kind] = str(value)
+                break
+    return entity_ids
+
+
+def get_kind_path(kind: str, related_kind: str,
+                  via: str = None) -> List[str]:
+    """
+    :param kind: The kind of the entity a query starts from.
+    :param related_kind: The kind of the entities returned by the query.
+    :param via: The kind of the entities linking them. If None, the
+        shortest path between ``kind`` and ``related_kind`` is used.
+    :return: The kinds of entities visited by the query, from ``kind`` to
+        ``related_kind``.
+    """
+    kinds = [k.value for k in EntityKinds]
+    for k in (kind, related_kind, via):
+        if k is not None and k not in kinds:
+            raise ValueError(f'Unknown kind of entity: {k}. Expected one '
+                             f'of {kinds}.')
+    if via is not None:
+        for pair in ((kind, via), (via, related_kind)):
+            if tuple(pair) not in RELATIONS and \
+                    tuple(reversed(pair)) not in RELATIONS:
+                raise ValueError(f'{pair[0]} is not linked to {pair[1]}.')
+        return [kind, via, related_kind]
+    if kind == related_kind:
+        raise ValueError('Entities of the same kind are only related '
+                         'through another kind. Set "via".')
+    paths = collections.deque([[kind]])
+    while paths:  # A breadth-first search of the kinds.
+        path = paths.popleft()
+        for a, b in RELATIONS:
+            for source, target in ((a, b), (b, a)):
+                if source == path[-1] and target not in path:
+                    if target == related_kind:
+                        return path + [target]
+                    paths.append(path + [target])
+    raise ValueError(f'{kind} is not linked to {related_kind}.')
+
+
+class IdTable(object):
+    """
+    Interns the IDs of one kind of entity into consecutive integers.
+    """
+    __slots__ = ('ids', 'indexes')
+
+    def __init__(self, ids: Iterable[str] = ()):
+        self.ids = list(ids)  # Stores the ID of each integer.
+        self.indexes = {entity_id: index
+                        for index, entity_id in enumerate(self.ids)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def intern(self, entity_id: str) -> int:
+        """
+        :param entity_id: The ID of an entity.
+        :return: The integer of ``entity_id``, which is assigned if the ID
+            is new.
+        """
+        index = self.indexes.get(entity_id)
+        if index is None:
+            index = self.indexes[entity_id] = len(self.ids)
+            self.ids.append(entity_id)
+        return index
+
+    def get(self, entity_id: str) -> Union[int, None]:
+        """
+        :param entity_id: The ID of an entity.
+        :return: The integer of ``entity_id``, or None if it was never
+            interned.
+        """
+        return self.indexes.get(entity_id)
+
+
+class Relation(object):
+    """
+    The links between the entities of two kinds, stored as an array of the
+    linked integers of each entity, in both directions.
+    """
+    __slots__ = ('forward', 'backward', 'num_links')
+
+    def __init__(self):
+        self.forward = []  # Stores the array of each entity of the first
+        # kind, or None if it has no links.
+        self.backward = []  # Stores the array of each entity of the second
+        # kind.
+        self.num_links = 0
+
+    def link(self, a: int, b: int) -> bool:
+        """
+        Links entity ``a`` of the first kind to entity ``b`` of the second
+        kind.
+
+        :return: Whether the link is new.
+        """
+        forward = self.__get(self.forward, a)
+        backward = self.__get(self.backward, b)
+        # Only the shorter array is searched, e.g. the groups of a member
+        # rather than the members of a group.
+        if len(forward) <= len(backward):
+            if b in forward:
+                return False
+        elif a in backward:
+            return False
+        self.__append(self.forward, a, b)
+        self.__append(self.backward, b, a)
+        self.num_links += 1
+        return True
+
+    def unlink(self, a: int, b: int) -> bool:
+        """
+        Removes the link between entity ``a`` of the first kind and entity
+        ``b`` of the second kind.
+
+        :return: Whether the entities were linked.
+        """
+        forward = self.__get(self.forward, a)
+        if b not in forward:
+            return False
+        forward.remove(b)
+        self.__get(self.backward, b).remove(a)
+        self.num_links -= 1
+        return True
+
+    def neighbors(self, index: int, backward: bool = False) -> Iterable[int]:
+        """
+        :param index: The integer of an entity.
+        :param backward: Whether the entity is of the second kind.
+        :return: The integers of the entities linked to the entity.
+        """
+        return self.__get(self.backward if backward else self.forward, index)
+
+    def to_csr(self, backward: bool = False) \
+            -> Tuple[array.array, array.array]:
+        """
+        :param backward: Whether to return the links of the entities of the
+            second kind.
+        :return: The offsets of the links of each entity, and the
+            concatenated integers of the linked entities.
+        """
+        offsets = array.array(ARRAY_TYPECODE, [0])
+        targets = array.array(ARRAY_TYPECODE)
+        for links in self.backward if backward else self.forward:
+            if links:
+                targets.extend(links)
+            offsets.append(len(targets))
+        return offsets, targets
+
+    @classmethod
+    def from_csr(cls,
+                 forward: Tuple[array.array, array.array],
+                 backward: Tuple[array.array, array.array]) -> 'Relation':
+        """
+        :param forward: The offsets and integers returned by ``to_csr``.
+        :param backward: The offsets and integers returned by ``to_csr``
+            with ``backward``.
+        :return: The relation stored by ``to_csr``.
+        """
+        relation = cls()
+        for lists, (offsets, targets) in ((relation.forward, forward),
+                                          (relation.backward, backward)):
+            lists.extend(targets[start:end] if end > start else None
+                         for start, end in zip(offsets, offsets[1:]))
+        relation.num_links = len(forward[1])
+        return relation
+
+    @staticmethod
+    def __get(lists: list, index: int) -> Iterable[int]:
+        """
+        :return: The array of entity ``index`` in ``lists``, or an empty
+            tuple if it has no links.
+        """
+        if index < len(lists) and lists[index] is not None:
+            return lists[index]
+        return ()
+
+    @staticmethod
+    def __append(lists: list, index: int, value: int):
+        """
+        Appends ``value`` to the array of entity ``index`` in ``lists``.
+        """
+        if index >= len(lists):
+            lists.extend([None] * (index + 1 - len(lists)))
+        if lists[index] is None:
+            lists[index] = array.array(ARRAY_TYPECODE, (value,))
+        else:
+            lists[index].append(value)
+
+
+class EntityIndex(object):
+    """
+    A thread-safe index of the members, groups, events and venues linked by
+    the data items of the streams. A data item links all the entities it
+    mentions, e.g. an RSVP links its member, group, event and venue, except
+    that an RSVP whose response is "no" unlinks its member from its event.
+
+    If ``path`` is given, the index is loaded from it on startup, and saved
+    to it every ``interval`` seconds, and when it is closed.
+    """
+    instances = weakref.WeakSet()  # Stores all open indexes, so that they
+    # can be saved on shutdown.
+
+    def __init__(self,
+                 path: str = None,
+                 interval: float = 300,
+                 logger: Logger = None):
+        """
+        Initializes an instance of class *EntityIndex*, and loads the
+        snapshot saved in ``path``, if any.
+
+        :param path: The path of the snapshot file. If None, the index is
+            only kept in memory.
+        :param interval: The number of seconds between two snapshots. 0
+            only saves a snapshot when the index is closed.
+        :param logger: A Stackdriver logger for logging errors.
+        """
+        self.path = path
+        self.interval = interval
+        self.logger = logger
+        self.tables = {kind.value: IdTable() for kind in EntityKinds}
+        self.relations = {pair: Relation() for pair in RELATIONS}
+        self.num_items = 0  # Stores the number of data items indexed.
+        self.saved_items = 0  # Stores self.num_items at the last snapshot.
+        self.saved_at = None
+        self.closed = False
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        if path:
+            self.__load()
+        if path and interval > 0:
+            threading.Thread(target=self.__save_periodically,
+                             name='entity-index',
+                             daemon=True).start()
+        EntityIndex.instances.add(self)
+
+    def add(self, label: str, data: dict):
+        """
+        Links the entities mentioned by ``data``.
+
+        :param label: The label of the stream of ``data``.
+        :param data: A data item.
+        """
+        entity_ids = get_entity_ids(label, data)
+        unlink = data.get('response') == 'no'
+        with self.lock:
+            self.num_items += 1
+            indexes = {kind: self.tables[kind].intern(entity_id)
+                       for kind, entity_id in entity_ids.items()}
+            for pair, relation in self.relations.items():
+                a, b = pair
+                if a not in indexes or b not in indexes:
+                    continue
+                if unlink and pair == (EntityKinds.member.value,
+                                       EntityKinds.event.value):
+                    relation.unlink(indexes[a], indexes[b])
+                else:
+                    relation.link(indexes[a], indexes[b])
+
+    def related(self,
+                kind: str,
+                entity_id: str,
+                related_kind: str,
+                via: str = None,
+                limit: int = 100) -> List[Tuple[str, int]]:
+        """
+        Finds the entities of kind ``related_kind`` linked to an entity,
+        e.g. the members of a group, the venues of the events of a member,
+        or the members who attended the same events as a member.
+
+        :param kind: The kind of the entity.
+        :param entity_id: The ID of the entity.
+        :param related_kind: The kind of the entities to find.
+        :param via: The kind of the entities linking them. If None, the
+            shortest path between the kinds is used.
+        :param limit: The maximum number of entities returned. 0 returns
+            all of them.
+        :return: The ID of each entity found, and the number of paths
+            linking it to the entity, sorted by the number of paths. Direct
+            links are returned in the order they were indexed.
+        :raises LookupError: If the entity is not in the index.
+        """
+        kinds = get_kind_path(kind, related_kind, via)
+        with self.lock:
+            index = self.tables[kind].get(str(entity_id))
+            if index is None:
+                raise LookupError(f'{kind} {entity_id} is not indexed.')
+            counts = collections.Counter({index: 1})
+            for source, target in zip(kinds, kinds[1:]):
+                next_counts = collections.Counter()
+                for source_index, count in counts.items():
+                    for target_index in self.__neighbors(source, target,
+                                                         source_index):
+                        next_counts[target_index] += count
+                counts = next_counts
+            if kind == related_kind:
+                counts.pop(index, None)
+            if len(kinds) > 2:
+                found = counts.most_common(limit or None)
+            else:
+                found = list(counts.items())[:limit or None]
+            ids = self.tables[related_kind].ids
+            return [(ids[i], count) for i, count in found]
+
+    def degrees(self, kind: str, entity_id: str) -> Dict[str, int]:
+        """
+        :param kind: The kind of an entity.
+        :param entity_id: The ID of the entity.
+        :return: The number of entities of each kind directly linked to the
+            entity.
+        :raises LookupError: If the entity is not in the index.
+        """
+        if kind not in self.tables:
+            raise ValueError(f'Unknown kind of entity: {kind}.')
+        with self.lock:
+            index = self.tables[kind].get(str(entity_id))
+            if index is None:
+                raise LookupError(f'{kind} {entity_id} is not indexed.')
+            return {target: len(self.__neighbors(source, target, index))
+                    for source, target in self.__pairs()
+                    if source == kind}
+
+    def stats(self) -> dict:
+        """
+        :return: A dictionary containing the number of data items indexed,
+            the number of entities of each kind, the number of links of
+            each relation, and the age of the last snapshot in seconds.
+        """
+        with self.lock:
+            return {'items': self.num_items,
+                    'entities': {kind: len(table)
+                                 for kind, table in self.tables.items()},
+                    'links': {'-'.join(pair): relation.num_links
+                              for pair, relation in self.relations.items()},
+                    'snapshot_age': (round(time.time() - self.saved_at)
+                                     if self.saved_at else None)}
+
+    def save(self):
+        """
+        Writes a snapshot of the index to self.path, by replacing the file
+        atomically, if data items were indexed since the last snapshot.
+        """
+        if not self.path:
+            return
+        with self.lock:
+            if self.num_items == self.saved_items:
+                return
+            num_items = self.num_items
+            snapshot = {'version': SNAPSHOT_VERSION,
+                        'items': num_items,
+                        'typecode': ARRAY_TYPECODE,
+                        'itemsize': array.array(ARRAY_TYPECODE).itemsize,
+                        'byteorder': sys.byteorder,
+                        'ids': {kind: list(table.ids)
+                                for kind, table in self.tables.items()},
+                        'relations': {}}
+            for pair, relation in self.relations.items():
+                snapshot['relations']['-'.join(pair)] = {
+                    direction: relation.to_csr(backward=backward)
+                    for direction, backward in (('forward', False),
+                                                ('backward', True))}
+        # The snapshot is encoded and written outside the lock, so the
+        # streams are only blocked while the arrays are copied.
+        for relation in snapshot['relations'].values():
+            for direction, arrays in relation.items():
+                relation[direction] = [
+                    base64.b64encode(values.tobytes()).decode('ascii')
+                    for values in arrays]
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            with gzip.open(tmp_path, 'wt', encoding='utf-8',
+                           compresslevel=SNAPSHOT_COMPRESSION) as tmp_file:
+                json.dump({**snapshot, 'saved_at': time.time()}, tmp_file)
+            with open(tmp_path, 'rb') as tmp_file:
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.__log_error('Failed to save the entity index.', e)
+            return
+        self.saved_items = num_items
+        self.saved_at = time.time()
+
+    def close(self):
+        """
+        Saves a last snapshot, and stops the background thread.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.save()
+        EntityIndex.instances.discard(self)
+
+    @classmethod
+    def close_all(cls):
+        """
+        Closes all open indexes.
+        """
+        for entity_index in list(cls.instances):
+            entity_index.close()
+
+    def __pairs(self) -> Iterable[Tuple[str, str]]:
+        """
+        :return: Each pair of linked kinds, in both directions.
+        """
+        for a, b in RELATIONS:
+            yield a, b
+            yield b, a
+
+    def __neighbors(self, source: str, target: str,
+                    index: int) -> Iterable[int]:
+        """
+        :return: The integers of the entities of kind ``target`` linked to
+            entity ``index`` of kind ``source``. Should be called while
+            holding self.lock.
+        """
+        if (source, target) in self.relations:
+            return self.relations[(source, target)].neighbors(index)
+        return self.relations[(target, source)].neighbors(index,
+                                                          backward=True)
+
+    def __save_periodically(self):
+        """
+        Saves a snapshot every self.interval seconds, until the index is
+        closed.
+        """
+        while True:
+            with self.condition:
+                if not self.closed:
+                    self.condition.wait(self.interval)
+                if self.closed:
+                    return
+            self.save()
+
+    def __load(self):
+        """
+        Loads the snapshot saved in self.path, if it exists. A snapshot that
+        is corrupted, or was saved on another platform, is logged and
+        ignored.
+        """
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as file:
+                snapshot = json.load(file)
+            if snapshot.get('version') != SNAPSHOT_VERSION or \
+                    snapshot.get('typecode') != ARRAY_TYPECODE or \
+                    snapshot.get('itemsize') != \
+                    array.array(ARRAY_TYPECODE).itemsize:
+                raise ValueError('The snapshot has another format.')
+            tables = {kind.value: IdTable(snapshot['ids'][kind.value])
+                      for kind in EntityKinds}
+            relations = {}
+            for pair in RELATIONS:
+                stored = snapshot['relations']['-'.join(pair)]
+                csr = {}
+                for direction in ('forward', 'backward'):
+                    csr[direction] = []
+                    for data in stored[direction]:
+                        values = array.array(ARRAY_TYPECODE)
+                        values.frombytes(base64.b64decode(data))
+                        if snapshot['byteorder'] != sys.byteorder:
+                            values.byteswap()
+                        csr[direction].append(values)
+                relations[pair] = Relation.from_csr(**csr)
+        except FileNotFoundError:
+            return
+        except (OSError, EOFError, ValueError, KeyError, TypeError) as e:
+            self.__log_error('Entity index snapshot is corrupted.', e,
+                             severity='WARNING')
+            return
+        self.tables, self.relations = tables, relations
+        self.num_items = self.saved_items = snapshot.get('items', 0)
+        self.saved_at = snapshot.get('saved_at')
+
+    def __log_error(self, desc: str, e: Exception, severity: str = 'ERROR'):
+        """
+        Logs an error of the index.
+
+        :param desc: A description of the error.
+        :param e: The exception.
+        :param severity: The severity of the log.
+        """
+        log_struct = {'desc': desc,
+                      'path': self.path,
+                      'exc_type': str(type(e)),
+                      'exc_args': str(e.args)}
+        if self.logger:
+            self.logger.log_struct(log_struct, severity=severity)
+        else:
+            print(json.dumps(log_struct, indent=4))
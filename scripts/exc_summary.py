@@ -0,0 +1,105 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Summaries of the exceptions handled by the trigger, which stay cheap when
+the same error repeats for every data item during an outage.
+"""
+import time
+import hashlib
+import inspect
+import threading
+import traceback
+import collections
+from types import TracebackType
+from typing import List
+
+
+def get_fingerprint(exc_type: type, tb: TracebackType) -> str:
+    """
+    :param exc_type: The type of an exception.
+    :param tb: The traceback of the exception.
+    :return: A short hash of the type of the exception and the file, line
+        and function of each frame of its traceback. Exceptions with the
+        same fingerprint were raised the same way.
+    """
+    frames = [exc_type.__module__, exc_type.__qualname__]
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        frames.append(f'{code.co_filename}:{tb.tb_lineno}:{code.co_name}')
+        tb = tb.tb_next
+    return hashlib.md5('|'.join(frames).encode('utf-8')).hexdigest()[:12]
+
+
+class ExceptionSummaries(object):
+    """
+    A thread-safe registry of the exceptions handled by the trigger, by
+    fingerprint. The traceback of a fingerprint is formatted once, and only
+    included in the summary of its first occurrence in each window of
+    ``window`` seconds. The other summaries count the occurrences in the
+    window instead.
+    """
+
+    def __init__(self, window: float = 60, max_size: int = 1000):
+        """
+        Initializes an instance of class *ExceptionSummaries*.
+
+        :param window: The number of seconds during which the occurrences
+            of a fingerprint are counted.
+        :param max_size: The maximum number of fingerprints remembered. The
+            least recently seen ones are forgotten first.
+        """
+        self.window = window
+        self.max_size = max_size
+        self.fingerprints = collections.OrderedDict()  # Stores the
+        # formatted traceback, the start of the window and the number of
+        # occurrences in the window of each fingerprint.
+        self.parameters = {}  # Stores the names of the parameters of the
+        # constructor of each exception type.
+        self.lock = threading.Lock()
+
+    def summarize(self,
+                  exc_type: type,
+                  exc_obj: BaseException,
+                  tb: TracebackType) -> dict:
+        """
+        :param exc_type: The type of an exception.
+        :param exc_obj: The exception.
+        :param tb: The traceback of the exception.
+        :return: A dictionary containing the fingerprint of the exception,
+            the number of its occurrences in the current window, and its
+            formatted traceback if this is the first occurrence.
+        """
+        fingerprint = get_fingerprint(exc_type, tb)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.fingerprints.get(fingerprint)
+            if entry is None:
+                entry = self.fingerprints[fingerprint] = [None, now, 0]
+                if len(self.fingerprints) > self.max_size:
+                    self.fingerprints.popitem(last=False)
+            else:
+                self.fingerprints.move_to_end(fingerprint)
+                if now - entry[1] >= self.window:
+                    entry[1], entry[2] = now, 0
+            entry[2] += 1
+            occurrences = entry[2]
+        summary = {'fingerprint': fingerprint, 'occurrences': occurrences}
+        if occurrences == 1:
+            if entry[0] is None:
+                entry[0] = ''.join(
+                    traceback.format_exception(exc_type, exc_obj, tb))
+            summary['traceback'] = entry[0]
+        return summary
+
+    def parameter_names(self, exc_obj: BaseException) -> List[str]:
+        """
+        :param exc_obj: An exception.
+        :return: The names of the parameters of the constructor of the type
+            of ``exc_obj``.
+        """
+        exc_type = type(exc_obj)
+        names = self.parameters.get(exc_type)
+        if names is None:
+            names = self.parameters[exc_type] = \
+                list(inspect.signature(exc_obj.__init__).parameters)
+        return names
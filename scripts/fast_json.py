@@ -0,0 +1,125 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+JSON encoding and decoding for the hot paths of the trigger, using orjson
+when it is installed, and the raw data items of the pass-through mode.
+"""
+import json
+from typing import Any, Tuple, Union
+
+try:
+    import orjson
+except ImportError:  # The standard library is used instead.
+    orjson = None
+
+# The paths of the fields of a data item, besides ``mtime``, that the
+# trigger uses.
+LINKED_FIELDS = (('member', 'member_id'), ('group', 'id'))
+
+
+def json_loads(data: Union[bytes, str]) -> Any:
+    """
+    :param data: A JSON document. Bytes are decoded without copying them
+        into a string first.
+    :return: The decoded document.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(data: Any) -> bytes:
+    """
+    :param data: A JSON serializable object.
+    :return: ``data`` encoded as UTF-8 JSON.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:  # E.g. integers that do not fit in 64 bits.
+            pass
+    return json.dumps(data).encode('utf-8')
+
+
+def encode_json(data: Any) -> bytes:
+    """
+    Encodes ``data`` as JSON. *RawDataItem* objects, including the ones in
+    lists and tuples, are written as their original bytes.
+
+    :param data: A JSON serializable object.
+    :return: ``data`` encoded as UTF-8 JSON.
+    """
+    if isinstance(data, RawDataItem):
+        return data.raw
+    if isinstance(data, (list, tuple)) and \
+            any(isinstance(item, (RawDataItem, list, tuple))
+                for item in data):
+        return b'[' + b','.join(encode_json(item) for item in data) + b']'
+    return json_dumps(data)
+
+
+def decode_item(data: dict) -> dict:
+    """
+    :param data: A data item, which may be a *RawDataItem*.
+    :return: All the fields of ``data``.
+    """
+    if isinstance(data, RawDataItem):
+        return data.decode()
+    return data
+
+
+class RawDataItem(dict):
+    """
+    A data item of the pass-through mode. It only holds the fields used by
+    the trigger (``mtime``, and ``member.member_id`` and ``group.id`` by
+    default), and keeps the original bytes of the data item, which are
+    forwarded to the sinks without being encoded again.
+
+    The decoded data item can be kept until it is first decoded, so that
+    sinks that need all the fields do not decode the bytes again.
+    """
+    __slots__ = ('raw', 'data')
+
+    def __init__(self,
+                 raw: bytes,
+                 data: dict = None,
+                 paths: Tuple[Tuple[str, ...], ...] = LINKED_FIELDS,
+                 keep: bool = False):
+        """
+        Initializes an instance of class *RawDataItem*.
+
+        :param raw: The JSON of the data item, as streamed.
+        :param data: The decoded data item. If None, ``raw`` is decoded.
+        :param paths: The paths of the nested fields to keep, besides
+            ``mtime``.
+        :param keep: Whether to keep the decoded data item until ``decode``
+            is first called.
+        """
+        if data is None:
+            data = json_loads(raw)
+        fields = {}
+        if 'mtime' in data:
+            fields['mtime'] = data['mtime']
+        for path in paths:
+            value, found = data, True
+            for key in path:
+                if not isinstance(value, dict) or key not in value:
+                    found = False
+                    break
+                value = value[key]
+            if found:
+                parent = fields
+                for key in path[:-1]:
+                    parent = parent.setdefault(key, {})
+                parent[path[-1]] = value
+        super().__init__(fields)
+        self.raw = raw
+        self.data = data if keep else None
+
+    def decode(self) -> dict:
+        """
+        :return: All the fields of the data item. The decoded data item that
+            was kept is returned by the first call, and is then released.
+        """
+        data, self.data = self.data, None
+        return data if data is not None else json_loads(self.raw)
@@ -0,0 +1,282 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Ships the logs of the trigger to Stackdriver-Logging from a background
+thread, so that logging never blocks the streams.
+"""
+import json
+import time
+import weakref
+import threading
+import collections
+from typing import Tuple
+from custom_typing import Logger
+
+# The fields of a structured log that identify repeats of the same event.
+# The stream and the label are included, so that the logs of different
+# streams, e.g. the Script-Monitor heartbeats, are not merged.
+FINGERPRINT_FIELDS = ('desc', 'fingerprint', 'exc_type', 'api_call', 'tag',
+                      'stream_url', 'stream', 'label', 'reason')
+
+
+class LogShipper(object):
+    """
+    A logger with the interface of a Stackdriver Logger, whose calls only
+    add the log to a bounded buffer and return immediately. A background
+    thread writes the buffered logs in batches. If the buffer is full, new
+    logs are dropped and counted, and if a batch can not be written, it is
+    retried with a growing delay, so an outage of Stackdriver-Logging never
+    stalls the callers.
+
+    Logs that repeat within ``aggregate_window`` seconds (the same severity
+    and the same FINGERPRINT_FIELDS) are only written once. The number of
+    repeats is written at the end of the window, with the last repeat.
+    """
+    instances = weakref.WeakSet()  # Stores all open shippers, so that they
+    # can be flushed on shutdown.
+
+    def __init__(self,
+                 logger: Logger,
+                 buffer_size: int = 10000,
+                 batch_size: int = 100,
+                 flush_interval: float = 1,
+                 aggregate_window: float = 60,
+                 max_retry_sleep: float = 60):
+        """
+        Initializes an instance of class *LogShipper*.
+
+        :param logger: The logger the logs are written to. If it has a
+            ``batch`` method, as Stackdriver Loggers do, each batch of logs
+            is written with a single request.
+        :param buffer_size: The maximum number of logs waiting to be
+            written.
+        :param batch_size: The maximum number of logs written at once.
+        :param flush_interval: The maximum number of seconds a log waits
+            before it is written.
+        :param aggregate_window: The number of seconds during which the
+            repeats of a log are counted instead of written. 0 writes every
+            log.
+        :param max_retry_sleep: The maximum number of seconds to wait
+            before writing a failed batch again.
+        """
+        self.logger = logger
+        self.name = getattr(logger, 'name', None)
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.aggregate_window = aggregate_window
+        self.max_retry_sleep = max_retry_sleep
+        self.buffer = collections.deque()  # Stores the (method, payload,
+        # kwargs) tuples of the logs waiting to be written.
+        self.windows = {}  # Stores the start time, the number of repeats
+        # and the last repeat of each log in its aggregation window.
+        self.num_written = 0
+        self.num_dropped = 0
+        self.num_aggregated = 0
+        self.num_failures = 0
+        self.reported_drops = 0  # Stores the number of dropped logs that
+        # were already reported.
+        self.closed = False
+        self.condition = threading.Condition()
+        self.shipper = threading.Thread(target=self.__ship_logs,
+                                        name='log-shipper',
+                                        daemon=True)
+        self.shipper.start()
+        LogShipper.instances.add(self)
+
+    def log_struct(self, info: dict, severity: str = None, **kwargs):
+        self.__enqueue('log_struct', info, severity, kwargs)
+
+    def log_text(self, text: str, severity: str = None, **kwargs):
+        self.__enqueue('log_text', text, severity, kwargs)
+
+    @property
+    def pending(self) -> int:
+        """
+        :return: The number of logs waiting to be written.
+        """
+        return len(self.buffer)
+
+    def close(self, timeout: float = None):
+        """
+        Writes the buffered logs and the counts of the open aggregation
+        windows, and stops the background thread.
+
+        :param timeout: The maximum number of seconds to wait for the logs
+            to be written. If None, waits until they are all written.
+        """
+        with self.condition:
+            self.__expire_windows(force=True)
+            self.closed = True
+            self.condition.notify()
+        self.shipper.join(timeout)
+        LogShipper.instances.discard(self)
+
+    @classmethod
+    def close_all(cls, timeout: float = None):
+        """
+        Closes all open shippers.
+
+        :param timeout: The maximum number of seconds to wait for each
+            shipper to write its logs.
+        """
+        for shipper in list(cls.instances):
+            shipper.close(timeout)
+
+    def stats(self) -> dict:
+        """
+        :return: A dictionary containing the number of logs waiting,
+            written, dropped because the buffer was full, and aggregated,
+            and the number of failed writes.
+        """
+        return {'pending': self.pending,
+                'written': self.num_written,
+                'dropped': self.num_dropped,
+                'aggregated': self.num_aggregated,
+                'failures': self.num_failures}
+
+    def __enqueue(self, method: str, payload, severity: str, kwargs: dict):
+        """
+        Adds a log to the buffer, unless it repeats a log of an open
+        aggregation window, or the buffer is full.
+
+        :param method: 'log_struct' or 'log_text'.
+        :param payload: The structure or the text of the log.
+        :param severity: The severity of the log.
+        :param kwargs: The other parameters of the log.
+        """
+        if severity is not None:
+            kwargs = {**kwargs, 'severity': severity}
+        with self.condition:
+            if self.closed:
+                return
+            if self.aggregate_window > 0:
+                key = self.__fingerprint(method, payload, kwargs)
+                window = self.windows.get(key)
+                if window is not None:
+                    window[1] += 1
+                    window[2] = (method, payload, kwargs)
+                    self.num_aggregated += 1
+                    return
+                self.windows[key] = [time.monotonic(), 0, None]
+            self.__append((method, payload, kwargs))
+
+    def __append(self, entry: Tuple[str, object, dict]):
+        """
+        Adds ``entry`` to the buffer, or drops it if the buffer is full.
+        Should be called while holding self.condition.
+
+        :param entry: A (method, payload, kwargs) tuple.
+        """
+        if len(self.buffer) >= self.buffer_size:
+            self.num_dropped += 1
+            return
+        self.buffer.append(entry)
+        if len(self.buffer) >= self.batch_size:
+            self.condition.notify()
+
+    def __fingerprint(self, method: str, payload, kwargs: dict) -> tuple:
+        """
+        :return: A key identifying the repeats of a log.
+        """
+        if method == 'log_struct' and isinstance(payload, dict):
+            fields = tuple(str(payload.get(field))
+                           for field in FINGERPRINT_FIELDS)
+        else:
+            fields = (str(payload),)
+        return (method, kwargs.get('severity'), kwargs.get('log_name'),
+                *fields)
+
+    def __expire_windows(self, force: bool = False):
+        """
+        Closes the aggregation windows that are older than
+        self.aggregate_window, and adds a log of the repeats of each of
+        them to the buffer. Should be called while holding self.condition.
+
+        :param force: Whether to close all windows regardless of their age.
+        """
+        now = time.monotonic()
+        expired = [key for key, (started, _, _) in self.windows.items()
+                   if force or now - started >= self.aggregate_window]
+        for key in expired:
+            _, repeats, last = self.windows.pop(key)
+            if not repeats:
+                continue
+            method, payload, kwargs = last
+            if method == 'log_struct':
+                payload = {**payload,
+                           'repeats': repeats,
+                           'repeat_window': self.aggregate_window}
+            else:
+                payload = f'{payload} (repeated {repeats} times in ' \
+                          f'{self.aggregate_window} seconds)'
+            self.__append((method, payload, kwargs))
+
+    def __take_batch(self) -> list:
+        """
+        Waits until a batch is due, and takes it from the buffer.
+
+        :return: A list of (method, payload, kwargs) tuples, which is empty
+            if the shipper is closed and the buffer is empty.
+        """
+        with self.condition:
+            if len(self.buffer) < self.batch_size and not self.closed:
+                self.condition.wait(self.flush_interval)
+            self.__expire_windows()
+            dropped = self.num_dropped - self.reported_drops
+            if dropped and len(self.buffer) < self.buffer_size:
+                self.reported_drops = self.num_dropped
+                self.buffer.append(('log_struct', {
+                    'desc': 'Dropped logs because the log buffer was full.',
+                    'dropped': dropped}, {'severity': 'WARNING'}))
+            return [self.buffer.popleft()
+                    for _ in range(min(self.batch_size, len(self.buffer)))]
+
+    def __ship_logs(self):
+        """
+        Writes the buffered logs in batches, until the shipper is closed and
+        the buffer is empty. A batch that fails is put back at the front of
+        the buffer, and retried after a growing delay.
+        """
+        retry_sleep = 0
+        while True:
+            batch = self.__take_batch()
+            if not batch:
+                if self.closed:
+                    return
+                continue
+            try:
+                self.__write(batch)
+                self.num_written += len(batch)
+                retry_sleep = 0
+            except Exception as e:
+                self.num_failures += 1
+                with self.condition:
+                    self.buffer.extendleft(reversed(batch))
+                    while len(self.buffer) > self.buffer_size:
+                        self.buffer.pop()
+                        self.num_dropped += 1
+                if self.closed:  # Do not delay the shutdown.
+                    print(json.dumps({'desc': 'Failed to write logs.',
+                                      'exc_type': str(type(e)),
+                                      'exc_args': str(e.args),
+                                      'pending': len(self.buffer)}))
+                    return
+                retry_sleep = min(self.max_retry_sleep,
+                                  max(1., retry_sleep * 2))
+                time.sleep(retry_sleep)
+
+    def __write(self, batch: list):
+        """
+        Writes ``batch`` to self.logger.
+
+        :param batch: A list of (method, payload, kwargs) tuples.
+        """
+        if hasattr(self.logger, 'batch'):
+            logger_batch = self.logger.batch()
+            for method, payload, kwargs in batch:
+                getattr(logger_batch, method)(payload, **kwargs)
+            logger_batch.commit()
+        else:
+            for method, payload, kwargs in batch:
+                getattr(self.logger, method)(payload, **kwargs)
@@ -0,0 +1,392 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+An in-process registry of counters, gauges and histograms, which can be
+scraped over HTTP in the Prometheus text format, or logged as a structure.
+
+Metrics are looked up once, with ``labels``, and the returned child is kept
+by the caller, so recording a value on the hot path only takes a lock and an
+addition. Values that are already tracked elsewhere, such as queue depths,
+are read with a function when the metrics are collected instead.
+"""
+import json
+import math
+import bisect
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Callable, Dict, List, Tuple
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+
+class MetricChild(object):
+    """
+    The value of a metric for one combination of label values.
+    """
+    __slots__ = ('lock', 'value', 'function')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+        self.function = None
+
+    def inc(self, amount: float = 1):
+        """
+        Increments the value by ``amount``.
+        """
+        with self.lock:
+            self.value += amount
+
+    def set(self, value: float):
+        """
+        Sets the value. Only meaningful for gauges.
+        """
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """
+        Makes the value the return value of ``function``, which is called
+        when the metrics are collected.
+
+        :param function: A function without parameters returning a number.
+        """
+        self.function = function
+
+    def get(self) -> float:
+        """
+        :return: The current value.
+        """
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+
+class HistogramChild(object):
+    """
+    The observations of a histogram for one combination of label values.
+    """
+    __slots__ = ('lock', 'buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf.
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value: float):
+        """
+        Adds an observation.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def get(self) -> dict:
+        """
+        :return: The cumulative count of each bucket, the sum and the count
+            of the observations.
+        """
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+            running += bucket_count
+            cumulative.append((bound, running))
+        return {'buckets': cumulative, 'sum': total, 'count': count}
+
+
+class Metric(object):
+    """
+    A named metric with a fixed list of label names.
+    """
+    kind = 'untyped'
+
+    def __init__(self,
+                 name: str,
+                 description: str,
+                 label_names: Tuple[str, ...] = ()):
+        """
+        Initializes an instance of class *Metric*.
+
+        :param name: The name of the metric.
+        :param description: A description of the metric.
+        :param label_names: The names of the labels of the metric.
+        """
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *label_values):
+        """
+        :param label_values: The values of the labels, in the order of
+            self.label_names.
+        :return: The child of the metric for ``label_values``, which should
+            be kept by the caller.
+        """
+        if len(label_values) != len(self.label_names):
+            raise ValueError(f'{self.name} expects the labels '
+                             f'{self.label_names}.')
+        key = tuple(str(value) for value in label_values)
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(key, self.new_child())
+        return child
+
+    def new_child(self):
+        return MetricChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """
+        :return: The name, the labels and the value of each sample of the
+            metric.
+        """
+        samples = []
+        for key, child in list(self.children.items()):
+            labels = dict(zip(self.label_names, key))
+            try:
+                value = child.get()
+            except Exception:  # A function of a gauge that failed.
+                continue
+            samples.append((self.name, labels, value))
+        return samples
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self,
+                 name: str,
+                 description: str,
+                 label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Initializes an instance of class *Histogram*.
+
+        :param buckets: The sorted upper bounds of the buckets.
+        """
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(buckets)
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        samples = []
+        for key, child in list(self.children.items()):
+            labels = dict(zip(self.label_names, key))
+            values = child.get()
+            for bound, count in values['buckets']:
+                bucket_labels = {**labels, 'le': format_value(bound)}
+                samples.append((f'{self.name}_bucket', bucket_labels, count))
+            samples.append((f'{self.name}_sum', labels, values['sum']))
+            samples.append((f'{self.name}_count', labels, values['count']))
+        return samples
+
+
+class Registry(object):
+    """
+    A collection of metrics. Metrics are created once, and looked up by
+    name afterwards, so modules can declare the metrics they use.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def counter(self, name: str, description: str,
+                label_names: Tuple[str, ...] = ()) -> Counter:
+        return self.__get(Counter, name, description, label_names)
+
+    def gauge(self, name: str, description: str,
+              label_names: Tuple[str, ...] = ()) -> Gauge:
+        return self.__get(Gauge, name, description, label_names)
+
+    def histogram(self, name: str, description: str,
+                  label_names: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.__get(Histogram, name, description, label_names,
+                          buckets=buckets)
+
+    def render(self) -> str:
+        """
+        :return: All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                label_str = ','.join(
+                    f'{key}="{escape_label(label_value)}"'
+                    for key, label_value in labels.items())
+                label_str = f'{{{label_str}}}' if label_str else ''
+                lines.append(f'{name}{label_str} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> dict:
+        """
+        :return: The values of all metrics, for a structured log. Histograms
+            are summarized by their count, sum and mean.
+        """
+        snapshot = {}
+        for metric in list(self.metrics.values()):
+            values = {}
+            for key, child in list(metric.children.items()):
+                name = ','.join(f'{label}={value}' for label, value
+                                in zip(metric.label_names, key)) or 'value'
+                try:
+                    value = child.get()
+                except Exception:
+                    continue
+                if isinstance(value, dict):
+                    value = {'count': value['count'],
+                             'sum': round(value['sum'], 6),
+                             'mean': (round(value['sum'] / value['count'], 6)
+                                      if value['count'] else None)}
+                values[name] = value
+            if values:
+                snapshot[metric.name] = values
+        return snapshot
+
+    def __get(self, metric_class: type, name: str, description: str,
+              label_names: Tuple[str, ...], **kwargs) -> Metric:
+        """
+        :return: The metric named ``name``, which is created if it does not
+            exist.
+        """
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, description, label_names,
+                                      **kwargs)
+                self.metrics[name] = metric
+            elif not isinstance(metric, metric_class) or \
+                    metric.label_names != tuple(label_names):
+                raise ValueError(f'{name} is already registered with other '
+                                 f'labels or another type.')
+            return metric
+
+
+def format_value(value: float) -> str:
+    """
+    :param value: A sample value.
+    :return: The value formatted for the Prometheus text format.
+    """
+    if value is None:
+        return 'NaN'
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label(value: str) -> str:
+    """
+    :param value: A label value.
+    :return: The label value escaped for the Prometheus text format.
+    """
+    return value.replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+
+REGISTRY = Registry()  # The registry of all metrics of the process.
+
+
+class MetricsServer(object):
+    """
+    A local HTTP server exposing a registry at ``/metrics``, for scraping
+    by Prometheus or reading with curl, and other read-only JSON endpoints.
+    """
+
+    def __init__(self,
+                 port: int,
+                 host: str = '127.0.0.1',
+                 registry: Registry = REGISTRY,
+                 routes: Dict[str, Callable[[Dict[str, str]], Any]] = None):
+        """
+        Initializes an instance of class *MetricsServer*, and starts serving
+        in a background thread.
+
+        :param port: The port to listen on.
+        :param host: The host to listen on.
+        :param registry: The registry to expose.
+        :param routes: A function for each additional path, which is called
+            with the query parameters of a request and returns the JSON
+            response. A ValueError is answered with status 400, and a
+            LookupError with status 404.
+        """
+        routes = routes or {}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                if url.path in ('/', '/metrics'):
+                    self.respond(200, registry.render(),
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                    return
+                if url.path not in routes:
+                    self.send_error(404)
+                    return
+                params = dict(urllib.parse.parse_qsl(url.query))
+                try:
+                    status, response = 200, routes[url.path](params)
+                except ValueError as e:
+                    status, response = 400, {'error': str(e)}
+                except LookupError as e:
+                    status, response = 404, {'error': str(e.args[0])
+                                             if e.args else str(e)}
+                self.respond(status, json.dumps(response, default=str),
+                             'application/json; charset=utf-8')
+
+            def respond(self, status: int, body: str, content_type: str):
+                body = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # Scrapes are not logged.
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='metrics-server',
+                                       daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """
+        Stops the server.
+        """
+        self.server.shutdown()
+        self.server.server_close()
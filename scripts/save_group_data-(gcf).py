@@ -3,63 +3,270 @@
 Created on Fri Jan 11 18:09:12 2019
 @author: moeen
 """
+import os
 import sys
 import json
+import time
+import requests
+import threading
 import traceback
-from typing import Tuple
+from typing import Tuple, List, Mapping
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud import firestore
-from urllib.request import urlopen
-from json.decoder import JSONDecodeError
-from urllib.error import HTTPError, URLError
-from google.api_core.exceptions import ServiceUnavailable, DeadlineExceeded
+from requests.adapters import HTTPAdapter
+from google.api_core.exceptions import GoogleAPICallError
 
 DB = firestore.Client()
+HTTP_POOL_SIZE = int(os.environ.get('http_pool_size', 10))
+HTTP_TIMEOUT = (float(os.environ.get('http_connect_timeout', 5)),
+                float(os.environ.get('http_read_timeout', 30)))
+
+
+def create_session() -> requests.Session:
+    """
+    Creates a session for calling the meetup API. The session is created
+    once per instance, so its pooled keep-alive connections are reused
+    across warm invocations.
+
+    :return: A requests session.
+    """
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                          pool_maxsize=HTTP_POOL_SIZE)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    return session
+
+
+class RateLimiter(object):
+    """
+    A thread-safe token bucket for pacing the calls to the meetup API. The
+    bucket is adjusted using the ``X-RateLimit-*`` headers of the API.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Initializes an instance of class *RateLimiter*.
+
+        :param rate: The number of tokens added to the bucket per second. If
+            it is not positive, the calls are not paced, but still wait
+            until the quota resets once it is exhausted.
+        :param capacity: The maximum number of tokens in the bucket.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.paused_until = 0  # Stores the time the API quota resets, if
+        # it was exhausted.
+        self.headers = {}  # Stores the last rate-limit headers of the API.
+        self.last_update = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token from the bucket, waiting until one is available.
+        """
+        while True:
+            with self.lock:
+                now = self.__refill()
+                if now >= self.paused_until:
+                    if self.rate <= 0:  # The calls are not paced.
+                        return
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                wait_time = self.paused_until - now
+                if self.rate > 0:
+                    wait_time = max((1 - self.tokens) / self.rate, wait_time)
+            time.sleep(wait_time)
+
+    def update(self, headers: Mapping):
+        """
+        Adjusts the bucket using the rate-limit headers of a meetup API
+        response. The bucket never holds more tokens than the remaining
+        quota, and is paused until the quota resets once it is exhausted.
+
+        :param headers: The headers of the response.
+        """
+        rate_headers = {key: value for key, value in headers.items()
+                        if key.lower().startswith('x-ratelimit-')}
+        if not rate_headers:
+            return
+        try:
+            remaining = float(headers.get('X-RateLimit-Remaining'))
+            reset = float(headers.get('X-RateLimit-Reset', 0))
+        except (TypeError, ValueError):
+            return
+        with self.lock:
+            self.headers = rate_headers
+            now = self.__refill()
+            self.tokens = min(self.tokens, remaining)
+            if remaining <= 0:
+                self.paused_until = max(self.paused_until, now + reset)
+
+    def __refill(self) -> float:
+        """
+        Adds the tokens accumulated since the last update to the bucket.
+        Should be called while holding self.lock.
+
+        :return: The current time.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.last_update) * self.rate)
+        self.last_update = now
+        return now
+
+
+SESSION = create_session()
+FIRESTORE_BATCH_LIMIT = 500  # The maximum number of writes in a batch.
+MEETUP_PAGE_SIZE = 200  # The maximum number of results in a page.
+MEETUP_CHUNK_SIZE = int(os.environ.get('meetup_chunk_size', 50))  # The
+# number of IDs in each API call. Keeps the URLs short.
+MEETUP_MAX_WORKERS = int(os.environ.get('meetup_max_workers', 4))
+RATE_LIMITER = RateLimiter(
+    rate=float(os.environ.get('meetup_rate_limit', 10)),
+    capacity=float(os.environ.get('meetup_rate_burst', 10)))
 
 
 def save_group_data(group_id: str,
                     meetup_key: str,
-                    collection_name: str) -> Tuple[str, int]:
+                    collection_name: str) -> Tuple[str, int, dict]:
     """
-    Stores ``data`` in a Firestore repository named ``rep_name``. The
-    data is stored in a folder named ``label``. ``data_id`` and the
-    current timestamp is used to name the data file.
-
-    :param member_id: The data to be stored on Firestore in JSON format.
-    :param data_id: A unique ID for this data for naming purposes.
-    :param bucket_name: The name of the GCS bucket to store the data in.
-    :param label: The name of the folder within the GCS bucket in which the
-        data is stored.
-    :return: Returns type Success, representing whether all methods were
-        successful or not.
+    Retrieves the data of the groups in ``group_id`` from the meetup API,
+    and stores it in a Firestore collection named ``collection_name``.
+
+    :param group_id: A comma-separated list of group IDs.
+    :param meetup_key: A meetup API key.
+    :param collection_name: The name of the Firestore collection.
+    :return: A Tuple with a message and status-code regarding whether the
+        data of all groups was stored. If only some of the data was stored,
+        the message is a JSON object with the IDs that failed, and the
+        status-code is 207. The last rate-limit headers of the meetup API
+        are passed back as the response headers.
+    """
+    group_ids = [i for i in group_id.split(',') if i]
+    results, failed_ids, error = fetch_group_data(group_ids, meetup_key)
+    headers = dict(RATE_LIMITER.headers)
+    if any('id' not in group_data for group_data in results):
+        return "Unexpected group data! 'id' not found...", 500, headers
+
+    save_failed_ids, save_error = save_documents(results, collection_name)
+    failed_ids += save_failed_ids
+    error = save_error or error
+    if not failed_ids:
+        return 'Success!', 200, headers
+    if len(save_failed_ids) == len(results):  # Nothing was stored.
+        return error + (headers,)
+    # Only some documents were stored. Report the IDs that failed, so that
+    # only they are retried.
+    return json.dumps({'failed_ids': failed_ids,
+                       'error': error[0]}), 207, headers
+
+
+def fetch_group_data(group_ids: List[str],
+                     meetup_key: str) -> Tuple[list, list, Tuple[str, int]]:
+    """
+    Retrieves the data of ``group_ids`` from the meetup API. The IDs are
+    split into chunks of ``MEETUP_CHUNK_SIZE``, which are retrieved
+    concurrently, while the API calls are paced by ``RATE_LIMITER``.
+
+    :param group_ids: A list of group IDs.
+    :param meetup_key: A meetup API key.
+    :return: A Tuple with the groups' data, the IDs of the chunks that
+        could not be retrieved, and the message and status-code of the last
+        failed chunk.
     """
     meetup_url = 'https://api.meetup.com/2/groups'
-    meetup_url += f'?group_id={group_id}&key={meetup_key}'
-
-    try:
-        with urlopen(meetup_url) as r:
-            data = json.loads(r.read().decode('utf-8'))
-    except (JSONDecodeError, URLError):
-        return traceback.format_exc(), 500
-    except HTTPError as e:
-        return traceback.format_exc(), int(e.code)
-
-    if 'results' not in data:
-        return f"Unexpected response: {data}", 500
-    results = data['results']
-    for group_data in results:
-        try:
+    chunks = [group_ids[i:i + MEETUP_CHUNK_SIZE]
+              for i in range(0, len(group_ids), MEETUP_CHUNK_SIZE)]
+
+    def fetch_chunk(chunk: List[str]) -> list:
+        params = {'group_id': ','.join(chunk),
+                  'key': meetup_key,
+                  'page': MEETUP_PAGE_SIZE}
+        return fetch_pages(meetup_url, params)
+
+    results = []
+    failed_ids = []
+    error = None
+    with ThreadPoolExecutor(max_workers=MEETUP_MAX_WORKERS) as executor:
+        futures = [(executor.submit(fetch_chunk, chunk), chunk)
+                   for chunk in chunks]
+        for future, chunk in futures:
+            try:
+                results.extend(future.result())
+            except requests.HTTPError as e:
+                failed_ids.extend(chunk)
+                error = traceback.format_exc(), int(e.response.status_code)
+            except (ValueError, requests.RequestException):
+                failed_ids.extend(chunk)
+                error = traceback.format_exc(), 500
+
+    return results, failed_ids, error
+
+
+def fetch_pages(url: str,
+                params: dict) -> list:
+    """
+    Calls a meetup API endpoint, and follows the ``meta.next`` link of each
+    response until all pages are retrieved.
+
+    :param url: The URL of the endpoint.
+    :param params: The URL parameters of the first page.
+    :return: The results of all pages.
+    """
+    results = []
+    while url:
+        RATE_LIMITER.acquire()
+        with SESSION.get(url, params=params, timeout=HTTP_TIMEOUT) as r:
+            RATE_LIMITER.update(r.headers)
+            r.raise_for_status()
+            data = r.json()
+        if 'results' not in data:
+            raise ValueError(f"Unexpected response: {data}")
+        results.extend(data['results'])
+        url = data.get('meta', {}).get('next')
+        params = None  # The URL of the next page contains all parameters.
+
+    return results
+
+
+def save_documents(documents: List[dict],
+                   collection_name: str) -> Tuple[list, Tuple[str, int]]:
+    """
+    Stores ``documents`` in a Firestore collection named
+    ``collection_name``, using batched writes. Each batch holds at most
+    ``FIRESTORE_BATCH_LIMIT`` documents. Each document is named using its
+    ``id``.
+
+    :param documents: The groups' data to be stored.
+    :param collection_name: The name of the Firestore collection.
+    :return: A Tuple with the IDs of the documents that were not stored,
+        as strings, and the message and status-code of the last failed
+        batch.
+    """
+    collection = DB.collection(collection_name)
+    failed_ids = []
+    error = None
+    for i in range(0, len(documents), FIRESTORE_BATCH_LIMIT):
+        chunk = documents[i:i + FIRESTORE_BATCH_LIMIT]
+        batch = DB.batch()
+        for group_data in chunk:
             doc_name = f"m{group_data['id']}"
-            DB.collection(collection_name).document(doc_name).set(group_data,
-                                                                  merge=True)
-        except (ServiceUnavailable, DeadlineExceeded) as e:
-            return traceback.format_exc(), int(e.code)
-        except KeyError:
-            return "Unexpected group data! 'id' not found...", 500
+            batch.set(collection.document(doc_name), group_data, merge=True)
+        try:
+            batch.commit()
+        except GoogleAPICallError as e:
+            failed_ids.extend(str(group_data['id']) for group_data in chunk)
+            error = traceback.format_exc(), int(e.code or 500)
+        except Exception:  # Only fail the IDs of this batch.
+            failed_ids.extend(str(group_data['id']) for group_data in chunk)
+            error = traceback.format_exc(), 500
 
-    return 'Success!', 200
+    return failed_ids, error
 
 
-def main(request) -> Tuple[str, int]:
+def main(request) -> Tuple:
     """Responds to any HTTP request.
 
     :param request: HTTP request object.
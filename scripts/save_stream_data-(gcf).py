@@ -4,9 +4,11 @@ Created on Fri Jan 11 18:09:12 2019
 @author: moeen
 """
 import sys
+import json
+import uuid
 import datetime
 import traceback
-from typing import Tuple, Union
+from typing import Tuple, Union, List
 from google.cloud import storage
 from google.api_core import exceptions
 from urllib3.exceptions import ProtocolError
@@ -14,6 +16,35 @@ from urllib3.exceptions import ProtocolError
 GS = storage.Client()
 
 
+def upload_to_gcs(content: str,
+                  filename: str,
+                  bucket_name: str,
+                  content_type: str = 'text/plain') -> Tuple[str, int]:
+    """
+    Uploads ``content`` to a file named ``filename`` inside a GCS bucket
+    named ``bucket_name``.
+
+    :param content: The content of the file.
+    :param filename: The name of the file, including its folder.
+    :param bucket_name: The name of the GCS bucket to store the file in.
+    :param content_type: The content type of the file.
+    :return: A Tuple with a message and status-code regarding whether the
+        upload was successful.
+    """
+    try:
+        gcs_bucket = GS.get_bucket(bucket_name)
+        gcs_file = gcs_bucket.blob(filename)
+        gcs_file.upload_from_string(content, content_type=content_type)
+    except exceptions.ServiceUnavailable as e:
+        return traceback.format_exc(), int(e.code)
+    except (ConnectionResetError, ConnectionError, ProtocolError):
+        return traceback.format_exc(), 500
+    except Exception:
+        return f'Unknown Exception: {traceback.format_exc()}', 599
+    else:
+        return 'Success!', 200
+
+
 def save_stream_data(data: object,
                      data_id: Union[str, int],
                      bucket_name: str,
@@ -34,18 +65,74 @@ def save_stream_data(data: object,
     current_time = datetime.datetime.now().timestamp()
     filename = f'{label}/{data_id}_{current_time}.json'
 
+    return upload_to_gcs(content=json.dumps(data),
+                         filename=filename,
+                         bucket_name=bucket_name)
+
+
+def save_stream_batch(data: List[dict],
+                      bucket_name: str,
+                      label: str = 'meetup') -> Tuple[str, int]:
+    """
+    Stores a batch of data items in a single newline-delimited JSON file
+    inside a GCS bucket named ``bucket_name``. The file is stored in a
+    folder named ``label``, and is named using the IDs of the first and
+    last items of the batch, and the current timestamp. Items without an ID
+    are stored as well, see *get_file_id*.
+
+    :param data: A list of data items to be stored in GCS.
+    :param bucket_name: The name of the GCS bucket to store the data in.
+    :param label: The name of the folder within the GCS bucket in which the
+        data is stored.
+    :return: Returns type Success, representing whether all methods were
+        successful or not.
+    """
+    first_id = get_file_id(data[0], label)
+    last_id = get_file_id(data[-1], label)
+    content = '\n'.join(json.dumps(item) for item in data)
+    current_time = datetime.datetime.now().timestamp()
+    filename = f'{label}/{first_id}-{last_id}_{current_time}.ndjson'
+
+    return upload_to_gcs(content=content,
+                         filename=filename,
+                         bucket_name=bucket_name,
+                         content_type='application/x-ndjson')
+
+
+def get_data_id(data: dict,
+                label: str) -> Union[str, int]:
+    """
+    Parses the unique ID of a data item, based on the stream it came from.
+
+    :param data: The data item.
+    :param label: The label describing the stream of the data item.
+    :return: The unique ID of the data item.
+    """
+    if label == 'rsvps':
+        return data['rsvp_id']
+    elif label == 'photos':
+        return data['photo_id']
+    return data['id']
+
+
+def get_file_id(data: object,
+                label: str) -> Union[str, int]:
+    """
+    Parses the ID used for naming the file of a data item. If the data item
+    has no unique ID, its ``mtime`` is used, or else a random ID, so that
+    the data item is stored instead of failing the whole request.
+
+    :param data: The data item.
+    :param label: The label describing the stream of the data item.
+    :return: The ID used for naming the file of the data item.
+    """
     try:
-        gcs_bucket = GS.get_bucket(bucket_name)
-        gcs_file = gcs_bucket.blob(filename)
-        gcs_file.upload_from_string(str(data))
-    except exceptions.ServiceUnavailable as e:
-        return traceback.format_exc(), int(e.code)
-    except (ConnectionResetError, ConnectionError, ProtocolError):
-        return traceback.format_exc(), 500
-    except Exception:
-        return f'Unknown Exception: {traceback.format_exc()}', 599
-    else:
-        return 'Success!', 200
+        return get_data_id(data, label)
+    except (KeyError, TypeError):
+        pass
+    if isinstance(data, dict) and data.get('mtime') is not None:
+        return data['mtime']
+    return uuid.uuid4().hex
 
 
 def main(request) -> Tuple[str, int]:
@@ -72,14 +159,12 @@ def main(request) -> Tuple[str, int]:
     if not data:
         return "No JSON data provided...", 400
 
-    # Parse data_id:
-    if label == 'rsvps':
-        data_id = data['rsvp_id']
-    elif label == 'photos':
-        data_id = data['photo_id']
-    else:
-        data_id = data['id']
+    if isinstance(data, list):  # A batch of data items.
+        return save_stream_batch(data=data,
+                                 bucket_name=bucket_name,
+                                 label=label)
 
+    data_id = get_file_id(data, label)
     response = save_stream_data(data=data,
                                 data_id=data_id,
                                 bucket_name=bucket_name,
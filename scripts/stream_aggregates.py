@@ -0,0 +1,440 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Time-windowed aggregates of the data items of the streams, per group,
+category, city and RSVP response, which show trends in real time without
+querying the stored stream data.
+
+Time is split into buckets of ``bucket_seconds``, kept in a ring of
+``num_buckets`` buckets. Each bucket counts the values of each dimension
+with a count-min sketch, tracks its most frequent values with a space-saving
+summary, and counts distinct members and values with HyperLogLogs, so the
+memory used does not grow with the number of distinct values. Sliding
+windows add up the last buckets, and tumbling windows the buckets of the
+last complete window.
+"""
+import math
+import time
+import array
+import hashlib
+import threading
+from enum import Enum
+from typing import Dict, List, Tuple
+from entity_index import ENTITY_PATHS, EntityKinds, get_path
+
+# The counters per row, and the rows, of a count-min sketch. A count is
+# overestimated by at most e / SKETCH_WIDTH of the number of values counted by
+# the sketch, with a probability of 1 - e^-SKETCH_DEPTH.
+SKETCH_WIDTH = 1024
+SKETCH_DEPTH = 4
+HLL_PRECISION = 11  # 2^11 registers, for a standard error of about 2.3%.
+
+
+class Dimensions(Enum):
+    group = 'group'
+    category = 'category'
+    city = 'city'
+    response = 'response'
+
+
+class WindowModes(Enum):
+    sliding = 'sliding'  # The last ``window`` seconds.
+    tumbling = 'tumbling'  # The last complete window of ``window`` seconds,
+    # aligned to multiples of ``window``.
+
+
+# The paths of the value of each dimension in a data item, in order of
+# preference.
+DIMENSION_PATHS = {
+    Dimensions.group.value: ENTITY_PATHS[EntityKinds.group.value],
+    Dimensions.category.value: (('group', 'category', 'shortname'),
+                                ('group', 'category', 'name')),
+    Dimensions.city.value: (('group', 'group_city'), ('group', 'city'),
+                            ('venue', 'city'), ('city',)),
+    Dimensions.response.value: (('response',),)}
+TOPICS_PATH = ('group', 'group_topics')  # The topics of the group of an
+# RSVP, which are its categories when the group has no category.
+
+# All fields of a data item read by the aggregates.
+AGGREGATED_PATHS = (TOPICS_PATH,) + \
+    ENTITY_PATHS[EntityKinds.member.value] + tuple(
+        path for paths in DIMENSION_PATHS.values() for path in paths)
+
+
+def hash_value(value: str) -> int:
+    """
+    :param value: A value of a dimension, or a member ID.
+    :return: A 64-bit hash of ``value``.
+    """
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'),
+                                          digest_size=8).digest(), 'little')
+
+
+def get_cells(hashed: int) -> List[int]:
+    """
+    :param hashed: The hash of a value.
+    :return: The index of the counter of the value in each row of a
+        *CountMinSketch*.
+    """
+    low, high = hashed & 0xffffffff, hashed >> 32 | 1
+    return [row * SKETCH_WIDTH + (low + row * high) % SKETCH_WIDTH
+            for row in range(SKETCH_DEPTH)]
+
+
+def get_dimension_values(data: dict) -> Dict[str, List[str]]:
+    """
+    :param data: A data item.
+    :return: The values of each dimension of ``data``, as strings. The
+        category of a data item may have several values (its topics).
+    """
+    values = {}
+    for dimension, paths in DIMENSION_PATHS.items():
+        for path in paths:
+            value = get_path(data, path)
+            if value is not None and not isinstance(value, (dict, list)):
+                values[dimension] = [str(value)]
+                break
+    if Dimensions.category.value not in values:
+        topics = get_path(data, TOPICS_PATH)
+        if isinstance(topics, list):
+            values[Dimensions.category.value] = [
+                str(topic.get('urlkey') or topic.get('topic_name'))
+                for topic in topics if isinstance(topic, dict)]
+    return values
+
+
+def get_member_id(data: dict) -> str:
+    """
+    :param data: A data item.
+    :return: The ID of the member of ``data``, or None.
+    """
+    for path in ENTITY_PATHS[EntityKinds.member.value]:
+        value = get_path(data, path)
+        if value is not None and not isinstance(value, dict):
+            return str(value)
+    return None
+
+
+class CountMinSketch(object):
+    """
+    Approximate counts of values, which are never underestimated. Values
+    are given by their cells, as returned by ``get_cells``.
+    """
+    __slots__ = ('counts',)
+
+    def __init__(self):
+        self.counts = array.array('I', bytes(4 * SKETCH_WIDTH * SKETCH_DEPTH))
+
+    def add(self, cells: List[int], count: int = 1):
+        counts = self.counts
+        for cell in cells:
+            counts[cell] += count
+
+    def estimate(self, cells: List[int]) -> int:
+        counts = self.counts
+        return min(counts[cell] for cell in cells)
+
+
+class SpaceSaving(object):
+    """
+    The candidates for the most frequent values, among at most ``capacity``
+    values. A new value replaces the least frequent one once the summary is
+    full, so any value more frequent than 1 / ``capacity`` of the total is
+    kept.
+    """
+    __slots__ = ('capacity', 'counts')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts = {}  # Stores the count of each candidate.
+
+    def add(self, value: str, count: int = 1):
+        if value in self.counts or len(self.counts) < self.capacity:
+            self.counts[value] = self.counts.get(value, 0) + count
+            return
+        least = min(self.counts, key=self.counts.get)
+        self.counts[value] = self.counts.pop(least) + count
+
+
+class HyperLogLog(object):
+    """
+    An approximate count of distinct values.
+    """
+    __slots__ = ('registers',)
+
+    def __init__(self, registers: bytes = None):
+        self.registers = bytearray(registers or bytes(1 << HLL_PRECISION))
+
+    def add(self, hashed: int):
+        index = hashed >> (64 - HLL_PRECISION)
+        rest = hashed & ((1 << (64 - HLL_PRECISION)) - 1)
+        rank = 64 - HLL_PRECISION - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        """
+        Adds the values counted by ``other`` to this count.
+        """
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self) -> int:
+        num_registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / num_registers)
+        estimate = alpha * num_registers ** 2 / sum(
+            2. ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * num_registers and zeros:
+            estimate = num_registers * math.log(num_registers / zeros)
+        return int(round(estimate))
+
+
+class Bucket(object):
+    """
+    The aggregates of the data items of one stream in one time bucket. The
+    sketches of a dimension are only allocated once it has a value.
+    """
+    __slots__ = ('number', 'items', 'members', 'sketches', 'summaries',
+                 'distinct')
+
+    def __init__(self, number: int):
+        self.number = number  # Stores the start of the bucket, in buckets
+        # since the epoch.
+        self.items = 0
+        self.members = HyperLogLog()
+        self.sketches = {}  # Stores the *CountMinSketch* of each dimension.
+        self.summaries = {}  # Stores the *SpaceSaving* of each dimension.
+        self.distinct = {}  # Stores the *HyperLogLog* of each dimension.
+
+
+class StreamAggregates(object):
+    """
+    Thread-safe, fixed-memory aggregates of the data items of each stream,
+    over sliding and tumbling windows of up to ``bucket_seconds *
+    num_buckets`` seconds. Data items are aggregated by their ``mtime``, so
+    that the data items streamed again after a reconnect are counted in
+    their original buckets, and data items older than the ring are dropped.
+    """
+
+    def __init__(self,
+                 bucket_seconds: float = 60,
+                 num_buckets: int = 60,
+                 top_k: int = 20):
+        """
+        Initializes an instance of class *StreamAggregates*.
+
+        :param bucket_seconds: The number of seconds of a bucket, which is
+            the resolution of the windows.
+        :param num_buckets: The number of buckets kept per stream.
+        :param top_k: The maximum number of most frequent values returned
+            per dimension. Each bucket keeps ``4 * top_k`` candidates.
+        """
+        self.bucket_seconds = bucket_seconds
+        self.num_buckets = num_buckets
+        self.top_k = top_k
+        self.rings = {}  # Stores the ring of buckets of each stream label.
+        self.num_dropped = 0  # Stores the number of data items older than
+        # the ring.
+        self.lock = threading.Lock()
+
+    def add(self, label: str, data: dict, now: float = None):
+        """
+        Aggregates a data item in the bucket of its ``mtime``. Data items
+        without an ``mtime``, or whose ``mtime`` is in the future, are
+        aggregated in the current bucket, and data items older than the ring
+        are dropped.
+
+        :param label: The label of the stream of ``data``.
+        :param data: A data item.
+        :param now: The current unix time. If None, the current time is
+            used.
+        """
+        current = self.__bucket_number(now)
+        number = current
+        mtime = data.get('mtime')
+        if isinstance(mtime, (int, float)):
+            number = min(current, self.__bucket_number(mtime / 1000))
+        if number <= current - self.num_buckets:
+            with self.lock:
+                self.num_dropped += 1
+            return
+        values = get_dimension_values(data)
+        member_id = get_member_id(data)
+        hashes = {}  # Stores the value, hash and cells of each value.
+        for dimension, dimension_values in values.items():
+            hashes[dimension] = []
+            for value in dimension_values:
+                hashed = hash_value(value)
+                hashes[dimension].append((value, hashed, get_cells(hashed)))
+        with self.lock:
+            bucket = self.__bucket(label, number)
+            bucket.items += 1
+            if member_id is not None:
+                bucket.members.add(hash_value(member_id))
+            for dimension, hashed_values in hashes.items():
+                if dimension not in bucket.sketches:
+                    bucket.sketches[dimension] = CountMinSketch()
+                    bucket.summaries[dimension] = SpaceSaving(
+                        4 * self.top_k)
+                    bucket.distinct[dimension] = HyperLogLog()
+                for value, hashed, cells in hashed_values:
+                    bucket.sketches[dimension].add(cells)
+                    bucket.summaries[dimension].add(value)
+                    bucket.distinct[dimension].add(hashed)
+
+    def query(self,
+              label: str = None,
+              window: float = None,
+              mode: str = WindowModes.sliding.value,
+              dimension: str = None,
+              value: str = None,
+              k: int = None,
+              now: float = None) -> dict:
+        """
+        :param label: The label of a stream. If None, the data items of all
+            streams are aggregated.
+        :param window: The number of seconds of the window, rounded up to
+            whole buckets. If None, all buckets are used.
+        :param mode: A value of *WindowModes*.
+        :param dimension: A value of *Dimensions*. If None, all dimensions
+            are returned.
+        :param value: A value of ``dimension``, whose approximate count is
+            returned instead of the most frequent values.
+        :param k: The number of most frequent values returned per dimension.
+            If None, self.top_k are returned.
+        :param now: The current unix time. If None, the current time is
+            used.
+        :return: A dictionary containing the start and end of the window,
+            the number of data items and the approximate number of distinct
+            members in it, and for each dimension, the approximate number
+            of distinct values and the most frequent values with their
+            approximate counts (or the approximate count of ``value``).
+        """
+        dimensions = [d.value for d in Dimensions]
+        if dimension is not None and dimension not in dimensions:
+            raise ValueError(f'Unknown dimension: {dimension}. Expected one '
+                             f'of {dimensions}.')
+        if value is not None and dimension is None:
+            raise ValueError('"value" requires a "dimension".')
+        if mode not in [m.value for m in WindowModes]:
+            raise ValueError(f'Unknown window mode: {mode}.')
+        k = min(k or self.top_k, self.top_k)
+        start, end = self.__window(window, mode, now)
+        with self.lock:
+            if label is not None and label not in self.rings:
+                raise LookupError(f'No data items of {label} were '
+                                  f'aggregated.')
+            buckets = [bucket for ring_label, ring in self.rings.items()
+                       if label in (None, ring_label)
+                       for bucket in ring
+                       if bucket is not None and
+                       start <= bucket.number < end]
+            members = HyperLogLog()
+            for bucket in buckets:
+                members.merge(bucket.members)
+            result = {'label': label,
+                      'mode': mode,
+                      'start': start * self.bucket_seconds,
+                      'end': end * self.bucket_seconds,
+                      'items': sum(bucket.items for bucket in buckets),
+                      'distinct_members': members.estimate(),
+                      'dimensions': {}}
+            for name in [dimension] if dimension else dimensions:
+                result['dimensions'][name] = self.__aggregate(
+                    buckets, name, value, k)
+        return result
+
+    def stats(self) -> dict:
+        """
+        :return: A dictionary containing the number of data items in the
+            buckets of each stream, the number of data items dropped because
+            they were older than the ring, and the window the buckets cover
+            in seconds.
+        """
+        with self.lock:
+            return {'items': {label: sum(bucket.items for bucket in ring
+                                         if bucket is not None)
+                              for label, ring in self.rings.items()},
+                    'dropped': self.num_dropped,
+                    'max_window': self.bucket_seconds * self.num_buckets}
+
+    def __aggregate(self,
+                    buckets: List[Bucket],
+                    dimension: str,
+                    value: str,
+                    k: int) -> dict:
+        """
+        :return: The approximate number of distinct values of ``dimension``
+            in ``buckets``, and the approximate count of ``value``, or the
+            ``k`` most frequent values with their approximate counts. Should
+            be called while holding self.lock.
+        """
+        buckets = [bucket for bucket in buckets
+                   if dimension in bucket.sketches]
+        distinct = HyperLogLog()
+        for bucket in buckets:
+            distinct.merge(bucket.distinct[dimension])
+
+        sketches = [bucket.sketches[dimension] for bucket in buckets]
+
+        def estimate(candidate: str) -> int:
+            cells = get_cells(hash_value(candidate))
+            return sum(sketch.estimate(cells) for sketch in sketches)
+        aggregate = {'distinct': distinct.estimate()}
+        if value is not None:
+            aggregate['value'] = value
+            aggregate['count'] = estimate(value)
+            return aggregate
+        candidates = set()
+        for bucket in buckets:
+            candidates.update(bucket.summaries[dimension].counts)
+        counts = sorted(((estimate(candidate), candidate)
+                         for candidate in candidates), reverse=True)
+        aggregate['top'] = [{'value': candidate, 'count': count}
+                            for count, candidate in counts[:k]]
+        return aggregate
+
+    def __bucket_number(self, now: float = None) -> int:
+        """
+        :return: The number of the bucket of the unix time ``now``.
+        """
+        return int((time.time() if now is None else now) //
+                   self.bucket_seconds)
+
+    def __bucket(self, label: str, number: int) -> Bucket:
+        """
+        :return: The bucket ``number`` of the stream ``label``, which
+            replaces the bucket it shares its slot with if it is new. Should
+            be called while holding self.lock.
+        """
+        ring = self.rings.get(label)
+        if ring is None:
+            ring = self.rings[label] = [None] * self.num_buckets
+        slot = number % self.num_buckets
+        bucket = ring[slot]
+        if bucket is None or bucket.number != number:
+            bucket = ring[slot] = Bucket(number)
+        return bucket
+
+    def __window(self,
+                 window: float,
+                 mode: str,
+                 now: float = None) -> Tuple[int, int]:
+        """
+        :return: The number of the first bucket of the window, and the
+            number of the bucket after its last bucket.
+        """
+        current = self.__bucket_number(now)
+        size = self.num_buckets if window is None else \
+            max(1, math.ceil(window / self.bucket_seconds))
+        if size > self.num_buckets:
+            raise ValueError(f'The window is longer than the '
+                             f'{self.bucket_seconds * self.num_buckets} '
+                             f'seconds that are kept.')
+        if mode == WindowModes.sliding.value:
+            return current + 1 - size, current + 1
+        end = current - current % size  # The current window is incomplete.
+        if end - size <= current - self.num_buckets:
+            raise ValueError('The last complete tumbling window is no '
+                             'longer kept. Use a shorter window.')
+        return end - size, end
@@ -0,0 +1,360 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+A local stand-in for the meetup streams and the GCFs, used by benchmark.py
+for measuring trigger_gcf.py offline.
+
+The simulator serves chunked newline-delimited JSON in the shape of the five
+meetup streams at a configurable rate, drops connections at random, and
+honours ``since_mtime`` when a stream is reconnected. It also serves fake
+save_stream_data, save_member_data and save_group_data endpoints with
+configurable latency and error rates, and records when each data item is
+received.
+"""
+import time
+import json
+import bisect
+import random
+import asyncio
+import concurrent.futures
+import threading
+import collections
+from aiohttp import web
+from typing import List
+
+STREAM_LABELS = ('event_comments', 'open_events', 'open_venues', 'photos',
+                 'rsvps')
+ID_FIELDS = {'rsvps': 'rsvp_id', 'photos': 'photo_id'}  # The ID field of
+# each label. The other labels use 'id'.
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    :param values: A sorted list of values.
+    :param q: A percentile, between 0 and 100.
+    :return: The ``q``-th percentile of ``values``, or None if it is empty.
+    """
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class StreamSimulator(object):
+    """
+    A local HTTP server simulating the meetup streams and the GCFs. The
+    server runs on its own event loop in a background thread.
+    """
+
+    def __init__(self,
+                 labels: List[str] = STREAM_LABELS,
+                 rate: float = 50,
+                 item_size: int = 1000,
+                 disconnect_interval: float = 0,
+                 gcf_latency: float = 0.05,
+                 gcf_error_rate: float = 0,
+                 profile_latency: float = 0.1,
+                 profile_error_rate: float = 0,
+                 num_members: int = 100000,
+                 num_groups: int = 10000,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 seed: int = None):
+        """
+        Initializes an instance of class *StreamSimulator*.
+
+        :param labels: The labels of the simulated streams.
+        :param rate: The number of data items per second of each stream.
+        :param item_size: The approximate size of a data item in bytes.
+        :param disconnect_interval: The mean number of seconds after which
+            a stream connection is dropped, in the middle of a data item.
+            0 never drops connections.
+        :param gcf_latency: The mean latency of save_stream_data, in
+            seconds. Latencies are exponentially distributed.
+        :param gcf_error_rate: The probability that save_stream_data
+            responds with status 500.
+        :param profile_latency: The mean latency of the profile GCFs, in
+            seconds.
+        :param profile_error_rate: The probability that a profile GCF
+            responds with status 500.
+        :param num_members: The number of distinct member IDs.
+        :param num_groups: The number of distinct group IDs.
+        :param host: The host the server listens on.
+        :param port: The port the server listens on. 0 picks a free port.
+        :param seed: The seed of the random generator.
+        """
+        self.labels = list(labels)
+        self.rate = rate
+        self.item_size = item_size
+        self.disconnect_interval = disconnect_interval
+        self.gcf_latency = gcf_latency
+        self.gcf_error_rate = gcf_error_rate
+        self.profile_latency = profile_latency
+        self.profile_error_rate = profile_error_rate
+        self.num_members = num_members
+        self.num_groups = num_groups
+        self.host = host
+        self.port = port
+        self.random = random.Random(seed)
+        self.history = {label: [] for label in self.labels}  # Stores the
+        # mtime and the line of each data item.
+        self.emitted = {}  # Stores when each data item was emitted.
+        self.received = {}  # Stores when each data item was first saved.
+        self.counts = collections.Counter()
+        self.producing = False
+        self.closing = False
+        self.loop = None
+        self.runner = None
+        self.producer = None
+        self.new_items = None
+        self.thread = None
+        self.started = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    @property
+    def stream_urls(self) -> List[str]:
+        """
+        :return: The URLs of the simulated streams.
+        """
+        return [f'{self.base_url}/2/{label}' for label in self.labels]
+
+    @property
+    def gcf_configs(self) -> dict:
+        """
+        :return: The configs of trigger_gcf.py for using the fake GCFs.
+        """
+        return {'stream_gcf': f'{self.base_url}/save_stream_data',
+                'member_gcf': f'{self.base_url}/save_member_data',
+                'group_gcf': f'{self.base_url}/save_group_data',
+                'stream_gcs_bucket': 'benchmark',
+                'meetup_api_key': 'benchmark',
+                'member_fs_collection': 'members',
+                'group_fs_collection': 'groups'}
+
+    def start(self):
+        """
+        Starts the server in a background thread, without producing data.
+        """
+        self.thread = threading.Thread(target=self.__run,
+                                       name='stream-simulator',
+                                       daemon=True)
+        self.thread.start()
+        self.started.wait()
+
+    def produce(self, producing: bool = True):
+        """
+        Starts or stops producing data items.
+
+        :param producing: Whether data items are produced.
+        """
+        self.producing = producing
+
+    def stop(self):
+        """
+        Stops the server.
+        """
+        if self.loop is not None:
+            shutdown = asyncio.run_coroutine_threadsafe(self.__shutdown(),
+                                                        self.loop)
+            try:
+                shutdown.result(timeout=10)
+            except concurrent.futures.TimeoutError:
+                pass  # Streams that are still open are dropped.
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+
+    def results(self) -> dict:
+        """
+        :return: A dictionary containing the number of data items emitted,
+            saved, duplicated and dropped, the number of data items saved
+            per second, the percentiles of the end-to-end latency in
+            seconds, and the counts of simulated events.
+        """
+        latencies = sorted(self.received[key] - self.emitted[key]
+                           for key in self.received if key in self.emitted)
+        delivered = len(self.received)
+        events_per_second = None
+        if self.received:
+            elapsed = max(self.received.values()) - min(self.emitted.values())
+            events_per_second = delivered / max(elapsed, 1e-9)
+        return {'emitted': len(self.emitted),
+                'delivered': delivered,
+                'events_per_second': events_per_second,
+                'duplicates': self.counts['stream_items'] - delivered,
+                'dropped': len(set(self.emitted) - set(self.received)),
+                'latency_p50': percentile(latencies, 50),
+                'latency_p95': percentile(latencies, 95),
+                'latency_p99': percentile(latencies, 99),
+                'latency_max': latencies[-1] if latencies else None,
+                'gcf_requests': self.counts['stream_requests'],
+                'gcf_errors': self.counts['stream_errors'],
+                'profiles': self.counts['profiles'],
+                'profile_errors': self.counts['profile_errors'],
+                'disconnects': self.counts['disconnects'],
+                'connections': self.counts['connections']}
+
+    def __run(self):
+        """
+        Runs the event loop of the server.
+        """
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.new_items = asyncio.Condition()
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get('/2/{label}', self.__stream)
+        app.router.add_post('/save_stream_data', self.__save_stream_data)
+        app.router.add_post('/save_member_data', self.__save_profiles)
+        app.router.add_post('/save_group_data', self.__save_profiles)
+        self.runner = web.AppRunner(app, handle_signals=False)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, self.host, self.port)
+        self.loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self.producer = self.loop.create_task(self.__produce())
+        self.started.set()
+        self.loop.run_forever()
+
+    async def __shutdown(self):
+        """
+        Closes the open streams, and stops the server.
+        """
+        self.closing = True
+        self.producer.cancel()
+        async with self.new_items:
+            self.new_items.notify_all()
+        await self.runner.cleanup()
+
+    async def __produce(self):
+        """
+        Appends ``rate`` data items per second to the history of each
+        stream, while self.producing is True.
+        """
+        tick = 0.01
+        due = collections.Counter()
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(tick)
+            now = time.monotonic()
+            elapsed, last = now - last, now
+            if not self.producing:
+                continue
+            for label in self.labels:
+                due[label] += self.rate * elapsed
+                while due[label] >= 1:
+                    due[label] -= 1
+                    self.__append_item(label)
+            async with self.new_items:
+                self.new_items.notify_all()
+
+    def __append_item(self, label: str):
+        """
+        Creates a data item of stream ``label``, and appends it to its
+        history.
+
+        :param label: The label of the stream.
+        """
+        history = self.history[label]
+        number = len(history)
+        now = time.time()
+        mtime = int(now * 1000)
+        if history and mtime <= history[-1][0]:
+            mtime = history[-1][0] + 1  # mtimes are unique per stream.
+        member_id = self.random.randrange(self.num_members)
+        group_id = self.random.randrange(self.num_groups)
+        data_item = {ID_FIELDS.get(label, 'id'): number,
+                     'mtime': mtime,
+                     'member': {'member_id': member_id,
+                                'member_name': f'member {member_id}'},
+                     'group': {'id': group_id,
+                               'group_id': group_id,
+                               'group_name': f'group {group_id}',
+                               'group_city': 'New York',
+                               'group_country': 'us'},
+                     'response': 'yes',
+                     'visibility': 'public'}
+        padding = self.item_size - len(json.dumps(data_item))
+        if padding > 0:
+            data_item['comment'] = 'x' * padding
+        line = json.dumps(data_item).encode('utf-8') + b'\n'
+        history.append((mtime, line))
+        self.emitted[(label, number)] = now
+
+    async def __stream(self, request: web.Request) -> web.StreamResponse:
+        """
+        Serves a stream, starting after ``since_mtime`` if it is given.
+        """
+        label = request.match_info['label']
+        if label not in self.history:
+            raise web.HTTPNotFound()
+        history = self.history[label]
+        since_mtime = int(request.query.get('since_mtime', 0))
+        index = bisect.bisect_left(history, (since_mtime,)) \
+            if since_mtime else len(history)
+        self.counts['connections'] += 1
+        response = web.StreamResponse()
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        disconnect_at = time.monotonic() + \
+            self.random.expovariate(1 / self.disconnect_interval) \
+            if self.disconnect_interval else None
+        while not self.closing:
+            if index == len(history):
+                async with self.new_items:
+                    await self.new_items.wait()
+                continue
+            lines = [line for _, line in history[index:]]
+            index = len(history)
+            if disconnect_at and time.monotonic() >= disconnect_at:
+                # Drop the connection in the middle of a data item.
+                data = b''.join(lines)
+                await response.write(data[:len(data) // 2 or 1])
+                self.counts['disconnects'] += 1
+                request.transport.close()
+                return response
+            await response.write(b''.join(lines))
+        return response
+
+    async def __save_stream_data(self, request: web.Request) -> web.Response:
+        """
+        The fake save_stream_data GCF.
+        """
+        label = request.query.get('label')
+        body = await request.read()
+        await self.__delay(self.gcf_latency)
+        self.counts['stream_requests'] += 1
+        if self.random.random() < self.gcf_error_rate:
+            self.counts['stream_errors'] += 1
+            return web.Response(status=500, text='Injected error')
+        data = json.loads(body)
+        now = time.time()
+        id_field = ID_FIELDS.get(label, 'id')
+        for data_item in data if isinstance(data, list) else [data]:
+            key = (label, data_item[id_field])
+            self.received.setdefault(key, now)
+            self.counts['stream_items'] += 1
+        return web.Response(text='Success!')
+
+    async def __save_profiles(self, request: web.Request) -> web.Response:
+        """
+        The fake save_member_data and save_group_data GCFs.
+        """
+        ids = request.query.get('member_id') or request.query.get('group_id')
+        await self.__delay(self.profile_latency)
+        if self.random.random() < self.profile_error_rate:
+            self.counts['profile_errors'] += 1
+            return web.Response(status=500, text='Injected error')
+        self.counts['profiles'] += len(ids.split(',')) if ids else 0
+        return web.Response(text='Success!')
+
+    async def __delay(self, mean: float):
+        """
+        Sleeps for an exponentially distributed number of seconds.
+
+        :param mean: The mean number of seconds.
+        """
+        if mean > 0:
+            await asyncio.sleep(self.random.expovariate(1 / mean))
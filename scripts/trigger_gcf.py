@@ -2,27 +2,51 @@ import os
 import sys
 import pytz
 import json
+import math
+import heapq
 import time
 import http
-import codecs
-import inspect
+import queue
+import random
+import signal
+import weakref
+import collections
+import asyncio
+import aiohttp
 import datetime
 import requests
-import traceback
+import functools
 import threading
 import subprocess
+import multiprocessing
 import numpy as np
 from enum import Enum
 import urllib.parse as urlparse
 from google.cloud import logging
+from google.cloud import storage
 from custom_typing import Logger
+from archive_writer import ArchiveWriter, ArchiveFormats
+from bq_loader import BigQueryLoader, LoadModes
+from bq_schema import LABEL_SCHEMAS
+from fast_json import json_loads, json_dumps, encode_json, decode_item, \
+    RawDataItem, LINKED_FIELDS
+from entity_index import EntityIndex, EntityKinds, INDEXED_PATHS
+from stream_aggregates import StreamAggregates, WindowModes, \
+    AGGREGATED_PATHS
+from metrics import REGISTRY, MetricsServer
+from log_shipper import LogShipper
+from exc_summary import ExceptionSummaries
 from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ChunkedEncodingError
 from google.auth.exceptions import DefaultCredentialsError
-from typing import Generator, List, Union, Tuple, Any, Callable
+from typing import Generator, List, Union, Tuple, Any, Callable, \
+    AsyncGenerator, Mapping
 
 LOGGER = None
 LOGGER_NAME = "Trigger_GCF-Logger"
+LOCAL_LOG_ENV = 'TRIGGER_GCF_LOG_FILE'  # If this environmental variable is
+# set, logs are written to the file it names instead of Stackdriver-Logging.
 URLS = ["http://stream.meetup.com/2/event_comments",
         "http://stream.meetup.com/2/open_events",
         "http://stream.meetup.com/2/open_venues?trickle",
@@ -30,19 +54,904 @@ URLS = ["http://stream.meetup.com/2/event_comments",
         "http://stream.meetup.com/2/rsvps"]
 
 
-class Queue(object):
-    def __init__(self, func_trigger: Callable, q_size: int):
+class BatchQueue(object):
+    """
+    A thread-safe queue that groups items into batches. A batch is flushed
+    once it holds ``q_size`` items, or once its oldest item is ``max_age``
+    seconds old, whichever comes first. Batches are flushed by a background
+    thread, so adding an item never waits for ``func_trigger``.
+    """
+    instances = weakref.WeakSet()  # Stores all open queues, so that they
+    # can be flushed on shutdown.
+
+    def __init__(self,
+                 func_trigger: Callable,
+                 q_size: int,
+                 max_age: float = None):
+        """
+        Initializes an instance of class *BatchQueue*.
+
+        :param func_trigger: The function called with each batch of items.
+        :param q_size: The number of items that triggers a flush.
+        :param max_age: The maximum number of seconds the oldest item may
+            wait in the queue. If None, the queue is only flushed when it
+            is full.
+        """
         self.items = []
+        self.batches = collections.deque()  # Stores the batches waiting to
+        # be flushed.
         self.trigger = func_trigger
         self.q_size = q_size
+        self.max_age = max_age
+        self.oldest = None  # Stores the time the oldest item was added.
+        self.closed = False
+        self.condition = threading.Condition()
+        self.flusher = threading.Thread(
+            target=self.__flush_batches,
+            name=f'{self.trigger.__name__}-flusher',
+            daemon=True)
+        self.flusher.start()
+        BatchQueue.instances.add(self)
 
     def add(self, item: object):
-        self.items.append(item)
-        if len(self.items) >= self.q_size:
-            self.trigger(self.items)
-            pprint(f'{self.trigger.__name__} triggered!',
-                   pformat=BColors.OKGREEN)
-            self.items.clear()
+        """
+        Adds ``item`` to the current batch. Items added after the queue is
+        closed are not flushed.
+
+        :param item: The item to add.
+        """
+        with self.condition:
+            if not self.items:
+                self.oldest = time.monotonic()
+                self.condition.notify()  # Start waiting for max_age.
+            self.items.append(item)
+            if len(self.items) >= self.q_size:
+                self.__seal_batch()
+
+    def flush(self):
+        """
+        Flushes the current batch in the background, regardless of its size
+        and age.
+        """
+        with self.condition:
+            self.__seal_batch()
+
+    def close(self, timeout: float = None):
+        """
+        Flushes all remaining items and stops the background thread.
+
+        :param timeout: The maximum number of seconds to wait for the
+            remaining batches to be flushed. If None, waits until they are
+            all flushed.
+        """
+        with self.condition:
+            self.closed = True
+            self.__seal_batch()
+            self.condition.notify()
+        self.flusher.join(timeout)
+        BatchQueue.instances.discard(self)
+
+    @classmethod
+    def close_all(cls, timeout: float = None):
+        """
+        Closes all open queues.
+
+        :param timeout: The maximum number of seconds to wait for each
+            queue to be flushed.
+        """
+        for batch_queue in list(cls.instances):
+            batch_queue.close(timeout)
+
+    @property
+    def pending(self) -> int:
+        """
+        :return: The number of items that were not flushed yet.
+        """
+        with self.condition:
+            return len(self.items) + sum(len(b) for b in self.batches)
+
+    def __seal_batch(self):
+        """
+        Moves the current items to a new batch that is waiting to be flushed.
+        Should be called while holding self.condition.
+        """
+        if self.items:
+            self.batches.append(self.items)
+            self.items = []
+            self.oldest = None
+            self.condition.notify()
+
+    def __flush_batches(self):
+        """
+        Waits for batches that are full or old enough, and calls
+        self.trigger with them, until the queue is closed.
+        """
+        while True:
+            with self.condition:
+                while not self.batches:
+                    if self.closed:
+                        return
+                    timeout = None
+                    if self.items and self.max_age is not None:
+                        timeout = \
+                            self.oldest + self.max_age - time.monotonic()
+                        if timeout <= 0:
+                            self.__seal_batch()
+                            continue
+                    self.condition.wait(timeout)
+                batch = self.batches.popleft()
+            try:
+                self.trigger(batch)
+                pprint(f'{self.trigger.__name__} triggered!',
+                       pformat=BColors.OKGREEN, verbose=True)
+            except Exception:
+                log_struct = {'desc': 'Error while flushing a batch.',
+                              'trigger': self.trigger.__name__,
+                              'batch_size': len(batch)}
+                log_struct.update(get_exc_info_struct())
+                if LOGGER:
+                    LOGGER.log_struct(log_struct, severity='ERROR')
+
+
+class SeenCache(object):
+    """
+    A thread-safe cache of the IDs that were recently seen. The cache holds
+    at most ``max_size`` IDs, and evicts the least recently used ID once it
+    is full. An ID is considered new again ``ttl`` seconds after it was
+    last added.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        """
+        Initializes an instance of class *SeenCache*.
+
+        :param max_size: The maximum number of IDs stored in the cache.
+        :param ttl: The number of seconds after which a seen ID is
+            considered new again.
+        """
+        self.items = collections.OrderedDict()  # Maps IDs to the time they
+        # were added.
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    def add(self, key: str) -> bool:
+        """
+        Adds ``key`` to the cache.
+
+        :param key: The ID to add.
+        :return: False if ``key`` was added less than ``ttl`` seconds ago,
+            True otherwise.
+        """
+        now = time.monotonic()
+        with self.lock:
+            added = self.items.get(key)
+            if added is not None and now - added < self.ttl:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return False
+            self.items[key] = now
+            self.items.move_to_end(key)
+            self.misses += 1
+            if len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+            return True
+
+    def discard(self, keys: List[str]):
+        """
+        Removes ``keys`` from the cache, so that they are considered new the
+        next time they are added.
+
+        :param keys: The IDs to remove.
+        """
+        with self.lock:
+            for key in keys:
+                self.items.pop(key, None)
+
+    def stats(self) -> dict:
+        """
+        :return: A dictionary containing the size and the hit/miss counters
+            of the cache.
+        """
+        with self.lock:
+            return {'size': len(self.items),
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+
+class RateLimiter(object):
+    """
+    A thread-safe token bucket for pacing the calls to the meetup API. The
+    bucket is adjusted using the ``X-RateLimit-*`` headers of the API, which
+    are passed back by the GCFs that call the API.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Initializes an instance of class *RateLimiter*.
+
+        :param rate: The number of tokens added to the bucket per second.
+            Must be positive.
+        :param capacity: The maximum number of tokens in the bucket.
+        """
+        if rate <= 0:
+            raise ValueError(f'The rate must be positive, got {rate}.')
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity  # Can be negative, if tokens were reserved.
+        self.paused_until = 0  # Stores the time the API quota resets, if
+        # it was exhausted.
+        self.last_update = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1) -> float:
+        """
+        Reserves ``tokens`` tokens from the bucket.
+
+        :param tokens: The number of tokens to reserve.
+        :return: The number of seconds to wait before the tokens can be
+            used.
+        """
+        with self.lock:
+            now = self.__refill()
+            self.tokens -= tokens
+            wait_time = max(0, -self.tokens / self.rate)
+            return max(wait_time, self.paused_until - now)
+
+    def acquire(self, tokens: float = 1):
+        """
+        Takes ``tokens`` tokens from the bucket, waiting until they are
+        available.
+
+        :param tokens: The number of tokens to take.
+        """
+        wait_time = self.reserve(tokens)
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    async def acquire_async(self, tokens: float = 1):
+        """
+        The asyncio equivalent of ``acquire``.
+
+        :param tokens: The number of tokens to take.
+        """
+        wait_time = self.reserve(tokens)
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+
+    def update(self, headers: Mapping):
+        """
+        Adjusts the bucket using the rate-limit headers of a meetup API
+        response. The bucket never holds more tokens than the remaining
+        quota, and is paused until the quota resets once it is exhausted.
+
+        :param headers: The headers of the response.
+        """
+        if not headers:
+            return
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is None:
+            return
+        try:
+            remaining = float(remaining)
+            reset = float(reset) if reset is not None else None
+        except ValueError:
+            return
+        with self.lock:
+            now = self.__refill()
+            self.tokens = min(self.tokens, remaining)
+            if remaining <= 0 and reset is not None:
+                self.paused_until = max(self.paused_until, now + reset)
+
+    def __refill(self) -> float:
+        """
+        Adds the tokens accumulated since the last update to the bucket.
+        Should be called while holding self.lock.
+
+        :return: The current time.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.last_update) * self.rate)
+        self.last_update = now
+        return now
+
+
+class RetryBudget(object):
+    """
+    A thread-safe retry budget, shared between all streams. Every failed
+    call takes a token from the budget, and every successful call returns
+    ``token_ratio`` tokens to it. Calls are only retried while more than
+    half of the tokens are left, so that when most calls are failing, the
+    retries do not add to the load of the struggling GCFs.
+    """
+
+    def __init__(self, max_tokens: float, token_ratio: float):
+        """
+        Initializes an instance of class *RetryBudget*.
+
+        :param max_tokens: The maximum number of tokens in the budget.
+        :param token_ratio: The number of tokens returned to the budget by
+            each successful call.
+        """
+        self.max_tokens = max_tokens
+        self.token_ratio = token_ratio
+        self.tokens = max_tokens
+        self.throttled = 0  # Stores the number of retries denied.
+        self.lock = threading.Lock()
+
+    def on_success(self):
+        """
+        Returns ``token_ratio`` tokens to the budget.
+        """
+        with self.lock:
+            self.tokens = min(self.max_tokens,
+                              self.tokens + self.token_ratio)
+
+    def on_failure(self) -> bool:
+        """
+        Takes a token from the budget.
+
+        :return: Whether the failed call may be retried.
+        """
+        with self.lock:
+            self.tokens = max(0, self.tokens - 1)
+            allowed = self.tokens > self.max_tokens / 2
+            if not allowed:
+                self.throttled += 1
+            return allowed
+
+    def stats(self) -> dict:
+        """
+        Returns the state of the budget.
+
+        :return: A dictionary containing the number of tokens left and the
+            number of retries denied.
+        """
+        return {'tokens': round(self.tokens, 2),
+                'throttled': self.throttled}
+
+
+class RetryPolicy(object):
+    """
+    Decides whether, and after how long, a failed call is retried. The
+    sleep time between attempts grows exponentially up to ``max_sleep``, and
+    a random sleep time between zero and that value is used (full jitter),
+    so that the retries of concurrent calls are spread out.
+    """
+
+    def __init__(self,
+                 num_attempts: int = 50,
+                 base_sleep: float = 1,
+                 max_sleep: float = 60,
+                 deadline: float = None,
+                 budget: RetryBudget = None):
+        """
+        Initializes an instance of class *RetryPolicy*.
+
+        :param num_attempts: The maximum number of attempts for a call.
+        :param base_sleep: The maximum sleep time after the first failed
+            attempt, in seconds.
+        :param max_sleep: The maximum sleep time between attempts, in
+            seconds.
+        :param deadline: The maximum number of seconds from the first
+            attempt of a call to its last attempt. If None, the call is
+            attempted ``num_attempts`` times.
+        :param budget: A retry budget shared between calls. If None,
+            retries are not limited by a budget.
+        """
+        self.num_attempts = num_attempts
+        self.base_sleep = base_sleep
+        self.max_sleep = max_sleep
+        self.deadline = deadline
+        self.budget = budget
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Returns the time to sleep after the failed attempt ``attempt``.
+
+        :param attempt: The number of the failed attempt, starting from 0.
+        :return: The number of seconds to sleep.
+        """
+        return random.uniform(
+            0, min(self.max_sleep, self.base_sleep * 2 ** min(attempt, 32)))
+
+    def next_sleep(self,
+                   attempt: int,
+                   started: float) -> Tuple[Union[float, None], str]:
+        """
+        Decides whether to retry a call after its failed attempt
+        ``attempt``.
+
+        :param attempt: The number of the failed attempt, starting from 0.
+        :param started: The time of the first attempt of the call, as
+            returned by ``time.monotonic``.
+        :return: A Tuple containing the number of seconds to sleep before
+            the next attempt, and the reason for giving up. If the call
+            should not be retried, the sleep time is None.
+        """
+        if self.budget and not self.budget.on_failure():
+            return None, 'retry budget exhausted'
+        if attempt + 1 >= self.num_attempts:
+            return None, 'attempts exhausted'
+        sleep_time = self.backoff(attempt)
+        if self.deadline is not None and \
+                time.monotonic() + sleep_time - started > self.deadline:
+            return None, 'deadline exceeded'
+        return sleep_time, None
+
+    def on_success(self):
+        """
+        Should be called after a successful attempt.
+        """
+        if self.budget:
+            self.budget.on_success()
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+class Spool(object):
+    """
+    A durable, append-only log of the data items and the member and group
+    IDs waiting to be saved. Entries are appended before they are
+    dispatched, and acknowledged once they are saved. The log is split
+    into segments of about ``segment_size`` bytes, and a segment is deleted
+    once all of its entries are acknowledged. The segments left by a
+    previous run are replayed on startup.
+
+    The acknowledgements of a segment are appended to a separate file with
+    the extension ``.ack``. Segments are read line by line, so only the
+    acknowledgements of one segment are held in memory while replaying.
+    """
+
+    def __init__(self, directory: str, segment_size: int):
+        """
+        Initializes an instance of class *Spool*.
+
+        :param directory: The folder of the segments.
+        :param segment_size: The number of bytes after which a new segment
+            is started.
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.recovered = self.__list_segments()  # Stores the segments left
+        # by a previous run, which are not replayed yet.
+        self.segment = max(self.recovered, default=-1)
+        self.unacked = {}  # Stores the number of unacknowledged entries of
+        # each segment written by this run.
+        self.segment_file = None
+        self.size = self.count = 0
+        self.__roll()
+
+    def append(self,
+               kind: str,
+               data: Any,
+               replays: int = 0) -> Tuple[int, int]:
+        """
+        Appends an entry to the current segment.
+
+        :param kind: The kind of the entry, e.g. 'stream' or 'member'.
+        :param data: The JSON serializable data of the entry.
+        :param replays: The number of times the entry was replayed.
+        :return: A reference to the entry, used to acknowledge it.
+        """
+        line = b'{"kind": %s, "replays": %d, "data": %s}\n' % (
+            json_dumps(kind), replays, encode_json(data))
+        with self.lock:
+            if self.size >= self.segment_size:
+                self.__roll()
+            ref = (self.segment, self.count)
+            self.segment_file.write(line)
+            self.segment_file.flush()
+            self.size += len(line)
+            self.count += 1
+            self.unacked[self.segment] += 1
+            return ref
+
+    def ack(self, refs: List[Tuple[int, int]]):
+        """
+        Acknowledges the entries with references ``refs``. Segments whose
+        entries are all acknowledged are deleted.
+
+        :param refs: The references returned by ``append``.
+        """
+        by_segment = collections.defaultdict(list)
+        for segment, index in refs:
+            by_segment[segment].append(index)
+        with self.lock:
+            for segment, indices in by_segment.items():
+                if segment not in self.unacked:
+                    continue
+                with open(self.__path(segment, 'ack'), 'a') as ack_file:
+                    ack_file.write(''.join(f'{i}\n' for i in indices))
+                self.unacked[segment] -= len(indices)
+                if self.unacked[segment] <= 0 and segment != self.segment:
+                    self.__remove(segment)
+
+    def sync(self):
+        """
+        Forces the entries appended to the current segment to be written to
+        disk.
+        """
+        with self.lock:
+            self.segment_file.flush()
+            os.fsync(self.segment_file.fileno())
+
+    def replay(self) -> Generator[Tuple[str, Any, int], None, None]:
+        """
+        Reads the unacknowledged entries of the segments left by a previous
+        run. A segment is deleted once all of its entries are read, so the
+        entries should be appended to the spool again before the next entry
+        is read.
+
+        :return: A generator of the kind, the data and the number of replays
+            of each unacknowledged entry.
+        """
+        while self.recovered:
+            segment = self.recovered[0]
+            acked = set()
+            ack_path = self.__path(segment, 'ack')
+            if os.path.exists(ack_path):
+                with open(ack_path) as ack_file:
+                    acked.update(int(line) for line in ack_file
+                                 if line.strip())
+            with open(self.__path(segment, 'log'), 'rb') as segment_file:
+                for index, line in enumerate(segment_file):
+                    if index in acked:
+                        continue
+                    try:
+                        entry = json_loads(line)
+                    except ValueError:  # The line was partially written.
+                        continue
+                    yield entry['kind'], entry['data'], entry['replays']
+            self.__remove(segment)
+            self.recovered.pop(0)
+
+    def stats(self) -> dict:
+        """
+        :return: A dictionary containing the number of segments and the
+            number of unacknowledged entries written by this run.
+        """
+        with self.lock:
+            return {'segments': len(self.unacked) + len(self.recovered),
+                    'unacked': sum(self.unacked.values())}
+
+    def __roll(self):
+        """
+        Closes the current segment and starts a new one. Should be called
+        while holding self.lock, or from the constructor.
+        """
+        if self.segment_file:
+            self.segment_file.close()
+            if not self.unacked[self.segment]:
+                self.__remove(self.segment)
+        self.segment += 1
+        self.segment_file = open(self.__path(self.segment, 'log'), 'ab')
+        self.size = self.count = 0
+        self.unacked[self.segment] = 0
+
+    def __remove(self, segment: int):
+        """
+        Deletes a segment and its acknowledgements.
+
+        :param segment: The number of the segment.
+        """
+        for extension in ('log', 'ack'):
+            try:
+                os.remove(self.__path(segment, extension))
+            except FileNotFoundError:
+                pass
+        self.unacked.pop(segment, None)
+
+    def __list_segments(self) -> List[int]:
+        """
+        :return: The sorted numbers of the segments in self.directory.
+        """
+        segments = []
+        for name in os.listdir(self.directory):
+            number, extension = os.path.splitext(name)
+            if extension == '.log' and number.isdigit():
+                segments.append(int(number))
+        return sorted(segments)
+
+    def __path(self, segment: int, extension: str) -> str:
+        """
+        :return: The path of the file of a segment.
+        """
+        return os.path.join(self.directory, f'{segment:08d}.{extension}')
+
+
+class Checkpoint(object):
+    """
+    A thread-safe checkpoint of the mtime of the last data item of a stream
+    that was durably stored. The checkpoint is written to a file at most
+    every ``interval`` seconds, by replacing the file atomically, and is
+    read back on startup so that the stream resumes where it left off.
+
+    Data items that are stored out of order, e.g. by concurrent dispatcher
+    workers, are tracked while they are in flight. The checkpoint never
+    passes the oldest data item in flight, so it only covers data items
+    that were all stored.
+    """
+    instances = weakref.WeakSet()  # Stores all checkpoints, so that they
+    # can be saved on shutdown.
+
+    def __init__(self,
+                 path: str,
+                 interval: float,
+                 sync: Callable = None):
+        """
+        Initializes an instance of class *Checkpoint*, and reads the mtime
+        saved in ``path``, if any.
+
+        :param path: The path of the checkpoint file.
+        :param interval: The minimum number of seconds between two writes
+            of the checkpoint file.
+        :param sync: A function called before the checkpoint file is
+            written, which makes the stored data items durable.
+        """
+        self.path = path
+        self.interval = interval
+        self.sync = sync
+        self.mtime = self.saved_mtime = self.__load()
+        self.stored_mtime = self.mtime  # Stores the newest mtime stored.
+        self.in_flight = collections.Counter()  # Stores the number of data
+        # items in flight of each mtime.
+        self.in_flight_heap = []  # Stores the mtimes in flight, as a heap.
+        self.last_save = time.monotonic()
+        self.lock = threading.Lock()
+        Checkpoint.instances.add(self)
+
+    def track(self, mtime: int):
+        """
+        Marks a data item as in flight, so that the checkpoint does not pass
+        it until it is stored.
+
+        :param mtime: The mtime of a data item that is not stored yet.
+        """
+        with self.lock:
+            if not self.in_flight[mtime]:
+                heapq.heappush(self.in_flight_heap, mtime)
+            self.in_flight[mtime] += 1
+
+    def advance(self, mtime: int):
+        """
+        Marks a data item as durably stored, and advances the checkpoint to
+        the newest mtime before the oldest data item still in flight. The
+        checkpoint file is only written by ``save_if_due`` or ``save``.
+
+        :param mtime: The mtime of a data item that was durably stored.
+        """
+        with self.lock:
+            if self.in_flight[mtime] > 1:
+                self.in_flight[mtime] -= 1
+            else:
+                self.in_flight.pop(mtime, None)
+            if self.stored_mtime is None or mtime > self.stored_mtime:
+                self.stored_mtime = mtime
+            while self.in_flight_heap and \
+                    self.in_flight_heap[0] not in self.in_flight:
+                heapq.heappop(self.in_flight_heap)
+            low_watermark = self.stored_mtime
+            if self.in_flight_heap:
+                low_watermark = min(low_watermark,
+                                    self.in_flight_heap[0] - 1)
+            if self.mtime is None or low_watermark > self.mtime:
+                self.mtime = low_watermark
+
+    @property
+    def due(self) -> bool:
+        """
+        :return: Whether ``interval`` seconds have passed since the
+            checkpoint file was last written.
+        """
+        return time.monotonic() - self.last_save >= self.interval
+
+    def save_if_due(self):
+        """
+        Writes the checkpoint file, if ``interval`` seconds have passed
+        since it was last written.
+        """
+        if self.due:
+            self.save()
+
+    def save(self):
+        """
+        Writes the checkpoint file, if the checkpoint has advanced since it
+        was last written.
+        """
+        with self.lock:
+            self.last_save = time.monotonic()
+            mtime = self.mtime
+            if mtime is None or mtime == self.saved_mtime:
+                return
+            if self.sync:
+                self.sync()
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as tmp_file:
+                json.dump({'mtime': mtime, 'saved_at': time.time()},
+                          tmp_file)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, self.path)
+            self.saved_mtime = mtime
+
+    @classmethod
+    def save_all(cls):
+        """
+        Writes the checkpoint files of all checkpoints.
+        """
+        for checkpoint in list(cls.instances):
+            checkpoint.save()
+
+    def __load(self) -> Union[int, None]:
+        """
+        :return: The mtime saved in the checkpoint file, or None if the file
+            does not exist or is corrupted.
+        """
+        try:
+            with open(self.path) as checkpoint_file:
+                return json.load(checkpoint_file)['mtime']
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError):
+            log_struct = {'desc': 'Checkpoint file is corrupted.',
+                          'path': self.path}
+            if LOGGER:
+                LOGGER.log_struct(log_struct, severity='WARNING')
+            return None
+
+
+def current_rss() -> int:
+    """
+    :return: The resident memory of this process in bytes. Read from
+        ``/proc`` on Linux. Elsewhere, the peak resident memory is returned
+        instead.
+    """
+    try:
+        with open('/proc/self/statm', 'rb') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemoryBudget(object):
+    """
+    A memory ceiling shared by all streams of this process. A background
+    thread samples the resident memory of the process, and the budget is
+    exceeded once it passes ``high_water`` times the ceiling. The budget is
+    released once the memory falls below ``low_water`` times the ceiling,
+    or once no data is queued anymore, since Python seldom returns freed
+    memory to the system.
+
+    While the budget is exceeded, the streams stop reading, or spill their
+    data items to disk, so that their queues drain.
+    """
+
+    def __init__(self,
+                 limit: int,
+                 high_water: float = 0.9,
+                 low_water: float = 0.75,
+                 interval: float = 1,
+                 backlog: Callable[[], int] = None,
+                 relieve: Callable[[], None] = None):
+        """
+        Initializes an instance of class *MemoryBudget*.
+
+        :param limit: The memory ceiling in bytes.
+        :param high_water: The fraction of ``limit`` above which the budget
+            is exceeded.
+        :param low_water: The fraction of ``limit`` below which the budget
+            is released.
+        :param interval: The number of seconds between two samples.
+        :param backlog: A function returning the number of items queued in
+            memory. If it returns 0, the budget is released.
+        :param relieve: A function called after every sample while the
+            budget is exceeded, e.g. for flushing queued data early.
+        """
+        self.limit = limit
+        self.high_water = high_water
+        self.low_water = low_water
+        self.interval = interval
+        self.backlog = backlog
+        self.relieve = relieve
+        self.rss = self.peak_rss = current_rss()
+        self.exceeded = False
+        self.num_pauses = 0  # Stores the number of times the budget was
+        # exceeded.
+        self.paused_seconds = 0.
+        self.exceeded_since = None
+        self.condition = threading.Condition()
+        threading.Thread(target=self.__sample,
+                         name='memory-budget',
+                         daemon=True).start()
+
+    def wait(self):
+        """
+        Waits until the budget is not exceeded.
+        """
+        with self.condition:
+            while self.exceeded:
+                self.condition.wait()
+
+    async def wait_async(self):
+        """
+        Waits until the budget is not exceeded, without blocking the event
+        loop.
+        """
+        while self.exceeded:
+            await asyncio.sleep(min(0.1, self.interval))
+
+    def stats(self) -> dict:
+        """
+        :return: A dictionary containing the current and the peak resident
+            memory, and the ceiling, in MiB, whether the budget is exceeded,
+            and how many times and for how long it was exceeded.
+        """
+        paused_seconds = self.paused_seconds
+        if self.exceeded_since is not None:
+            paused_seconds += time.monotonic() - self.exceeded_since
+        return {'rss_mib': round(self.rss / 1024 / 1024, 1),
+                'peak_rss_mib': round(self.peak_rss / 1024 / 1024, 1),
+                'limit_mib': round(self.limit / 1024 / 1024, 1),
+                'exceeded': self.exceeded,
+                'pauses': self.num_pauses,
+                'paused_seconds': round(paused_seconds, 1)}
+
+    def __sample(self):
+        """
+        Samples the resident memory every self.interval seconds, and
+        updates whether the budget is exceeded.
+        """
+        while True:
+            time.sleep(self.interval)
+            self.rss = current_rss()
+            self.peak_rss = max(self.peak_rss, self.rss)
+            if not self.exceeded and \
+                    self.rss >= self.high_water * self.limit:
+                self.__set_exceeded(True)
+            elif self.exceeded and \
+                    (self.rss < self.low_water * self.limit or
+                     (self.backlog is not None and self.backlog() == 0)):
+                self.__set_exceeded(False)
+            if self.exceeded and self.relieve is not None:
+                self.relieve()
+
+    def __set_exceeded(self, exceeded: bool):
+        """
+        Exceeds or releases the budget, and logs it.
+
+        :param exceeded: Whether the budget is exceeded.
+        """
+        now = time.monotonic()
+        with self.condition:
+            self.exceeded = exceeded
+            if exceeded:
+                self.num_pauses += 1
+                self.exceeded_since = now
+            else:
+                self.paused_seconds += now - self.exceeded_since
+                self.exceeded_since = None
+                self.condition.notify_all()
+        log_struct = {'desc': ('Memory budget exceeded! Pausing the streams.'
+                               if exceeded else
+                               'Memory budget released. Resuming the '
+                               'streams.'),
+                      'backlog': self.backlog() if self.backlog else None}
+        log_struct.update(self.stats())
+        pprint_struct(log_struct,
+                      pformat=BColors.WARNING if exceeded else BColors.OKGREEN)
+        if LOGGER:
+            LOGGER.log_struct(log_struct,
+                              severity='WARNING' if exceeded else 'INFO')
 
 
 class ReqConfigs(Enum):
@@ -55,37 +964,465 @@ class ReqConfigs(Enum):
     meetup_key = 'meetup_api_key'
 
 
+class OptConfigs(Enum):
+    stream_batch_size = 'stream_batch_size'
+    stream_batch_age = 'stream_batch_age'
+    engine = 'engine'
+    gcf_max_in_flight = 'gcf_max_in_flight'
+    dispatch_workers = 'dispatch_workers'
+    dispatch_queue_size = 'dispatch_queue_size'
+    dispatch_full_policy = 'dispatch_full_policy'
+    spill_dir = 'spill_dir'
+    dead_letter_dir = 'dead_letter_dir'
+    http_pool_size = 'http_pool_size'
+    http_connect_timeout = 'http_connect_timeout'
+    http_read_timeout = 'http_read_timeout'
+    seen_cache_size = 'seen_cache_size'
+    seen_cache_ttl = 'seen_cache_ttl'
+    profile_batch_age = 'profile_batch_age'
+    shutdown_timeout = 'shutdown_timeout'
+    meetup_rate_limit = 'meetup_rate_limit'
+    meetup_rate_burst = 'meetup_rate_burst'
+    meetup_chunk_size = 'meetup_chunk_size'
+    retry_attempts = 'retry_attempts'
+    retry_base_sleep = 'retry_base_sleep'
+    retry_max_sleep = 'retry_max_sleep'
+    stream_retry_deadline = 'stream_retry_deadline'
+    profile_retry_deadline = 'profile_retry_deadline'
+    retry_budget_size = 'retry_budget_size'
+    retry_budget_ratio = 'retry_budget_ratio'
+    spool_dir = 'spool_dir'
+    spool_segment_size = 'spool_segment_size'
+    spool_max_replays = 'spool_max_replays'
+    checkpoint_dir = 'checkpoint_dir'
+    checkpoint_interval = 'checkpoint_interval'
+    worker_processes = 'worker_processes'
+    worker_engine = 'worker_engine'
+    stats_interval = 'stats_interval'
+    stream_sink = 'stream_sink'
+    archive_dir = 'archive_dir'
+    archive_format = 'archive_format'
+    archive_bucket = 'archive_bucket'
+    archive_max_rows = 'archive_max_rows'
+    archive_grace = 'archive_grace'
+    archive_upload_deadline = 'archive_upload_deadline'
+    bq_dataset = 'bq_dataset'
+    bq_mode = 'bq_mode'
+    bq_table_prefix = 'bq_table_prefix'
+    bq_batch_rows = 'bq_batch_rows'
+    bq_batch_bytes = 'bq_batch_bytes'
+    bq_batch_age = 'bq_batch_age'
+    bq_dry_run_dir = 'bq_dry_run_dir'
+    bq_retry_deadline = 'bq_retry_deadline'
+    stream_passthrough = 'stream_passthrough'
+    stream_chunk_size = 'stream_chunk_size'
+    metrics_port = 'metrics_port'
+    metrics_host = 'metrics_host'
+    metrics_log_interval = 'metrics_log_interval'
+    log_buffer_size = 'log_buffer_size'
+    log_batch_size = 'log_batch_size'
+    log_flush_interval = 'log_flush_interval'
+    log_aggregate_window = 'log_aggregate_window'
+    console_mode = 'console_mode'
+    console_interval = 'console_interval'
+    exc_summary_window = 'exc_summary_window'
+    memory_limit_mib = 'memory_limit_mib'
+    memory_high_water = 'memory_high_water'
+    memory_low_water = 'memory_low_water'
+    entity_index = 'entity_index'
+    entity_index_dir = 'entity_index_dir'
+    entity_index_interval = 'entity_index_interval'
+    aggregates = 'aggregates'
+    aggregate_bucket_seconds = 'aggregate_bucket_seconds'
+    aggregate_buckets = 'aggregate_buckets'
+    aggregate_top_k = 'aggregate_top_k'
+
+
+class Engines(Enum):
+    threads = 'threads'
+    asyncio = 'asyncio'
+    processes = 'processes'
+
+
+class FullPolicies(Enum):
+    """
+    What the stream reader does with a data item when the work queue of the
+    dispatcher workers is full.
+    """
+    block = 'block'  # Wait for space in the queue.
+    drop_newest = 'drop_newest'  # Drop the data item.
+    drop_oldest = 'drop_oldest'  # Drop the oldest data item in the queue.
+    spill = 'spill'  # Append the data item to a spill file on disk.
+
+
+class StreamSinks(Enum):
+    """
+    Where the stream data items are saved.
+    """
+    gcf = 'gcf'  # One GCS file per data item or batch, by save_stream_data.
+    archive = 'archive'  # Hourly archive files, see *ArchiveWriter*.
+    bigquery = 'bigquery'  # BigQuery tables, see *BigQueryLoader*.
+    both = 'both'  # The GCF and the archive.
+
+
+class SpoolKinds(Enum):
+    stream = 'stream'
+    member = 'member'
+    group = 'group'
+
+
+OPT_CONFIG_DEFAULTS = {
+    OptConfigs.stream_batch_size.value: 1,  # 1 disables batching.
+    OptConfigs.stream_batch_age.value: 60,
+    OptConfigs.engine.value: Engines.threads.value,
+    OptConfigs.gcf_max_in_flight.value: 32,
+    OptConfigs.dispatch_workers.value: 0,  # 0 dispatches on the reader.
+    OptConfigs.dispatch_queue_size.value: 10000,
+    OptConfigs.dispatch_full_policy.value: FullPolicies.spill.value,
+    OptConfigs.spill_dir.value: '../spill',
+    OptConfigs.dead_letter_dir.value: '../dead_letter',
+    OptConfigs.http_pool_size.value: 10,
+    OptConfigs.http_connect_timeout.value: 10,
+    OptConfigs.http_read_timeout.value: 60,
+    OptConfigs.seen_cache_size.value: 500000,  # 0 disables the cache.
+    OptConfigs.seen_cache_ttl.value: 24 * 60 * 60,
+    OptConfigs.profile_batch_age.value: 5 * 60,
+    OptConfigs.shutdown_timeout.value: 60,
+    OptConfigs.meetup_rate_limit.value: 3,  # API calls per second.
+    OptConfigs.meetup_rate_burst.value: 30,
+    OptConfigs.meetup_chunk_size.value: 50,  # Should match the GCFs.
+    OptConfigs.retry_attempts.value: 50,
+    OptConfigs.retry_base_sleep.value: 1,
+    OptConfigs.retry_max_sleep.value: 60,
+    OptConfigs.stream_retry_deadline.value: 60 * 60,
+    OptConfigs.profile_retry_deadline.value: 15 * 60,
+    OptConfigs.retry_budget_size.value: 500,  # 0 disables the budget.
+    OptConfigs.retry_budget_ratio.value: 0.1,
+    OptConfigs.spool_dir.value: '../spool',  # An empty value disables it.
+    OptConfigs.spool_segment_size.value: 64 * 1024 * 1024,
+    OptConfigs.spool_max_replays.value: 3,
+    OptConfigs.checkpoint_dir.value: '../checkpoints',  # An empty value
+    # disables the checkpoints.
+    OptConfigs.checkpoint_interval.value: 10,
+    OptConfigs.worker_processes.value: 0,  # 0 uses one process per core.
+    OptConfigs.worker_engine.value: Engines.threads.value,
+    OptConfigs.stats_interval.value: 5 * 60,
+    OptConfigs.stream_sink.value: StreamSinks.gcf.value,
+    OptConfigs.archive_dir.value: '../archive',
+    OptConfigs.archive_format.value: ArchiveFormats.ndjson_gz.value,
+    OptConfigs.archive_bucket.value: '',  # An empty value keeps the
+    # archive files on disk.
+    OptConfigs.archive_max_rows.value: 100000,
+    OptConfigs.archive_grace.value: 10 * 60,
+    OptConfigs.archive_upload_deadline.value: 10 * 60,
+    OptConfigs.bq_dataset.value: '',
+    OptConfigs.bq_mode.value: LoadModes.load.value,
+    OptConfigs.bq_table_prefix.value: '',
+    OptConfigs.bq_batch_rows.value: 10000,
+    OptConfigs.bq_batch_bytes.value: 10 * 1024 * 1024,
+    OptConfigs.bq_batch_age.value: 5 * 60,  # Load jobs are limited to 1500
+    # per table and day.
+    OptConfigs.bq_dry_run_dir.value: '../bq_dry_run',
+    OptConfigs.bq_retry_deadline.value: 10 * 60,
+    OptConfigs.stream_passthrough.value: False,
+    OptConfigs.stream_chunk_size.value: 16 * 1024,
+    OptConfigs.metrics_port.value: 0,  # 0 disables the scrape endpoint.
+    OptConfigs.metrics_host.value: '127.0.0.1',
+    OptConfigs.metrics_log_interval.value: 0,  # 0 disables the logs.
+    OptConfigs.log_buffer_size.value: 10000,  # 0 logs synchronously.
+    OptConfigs.log_batch_size.value: 100,
+    OptConfigs.log_flush_interval.value: 1,
+    OptConfigs.log_aggregate_window.value: 60,  # 0 disables aggregation.
+    OptConfigs.console_mode.value: 'status',
+    OptConfigs.console_interval.value: 10,
+    OptConfigs.exc_summary_window.value: 10 * 60,
+    OptConfigs.memory_limit_mib.value: 0,  # 0 disables the ceiling.
+    OptConfigs.memory_high_water.value: 0.9,
+    OptConfigs.memory_low_water.value: 0.75,
+    OptConfigs.entity_index.value: False,
+    OptConfigs.entity_index_dir.value: '../entity_index',  # An empty value
+    # keeps the index in memory only.
+    OptConfigs.entity_index_interval.value: 5 * 60,
+    OptConfigs.aggregates.value: False,
+    OptConfigs.aggregate_bucket_seconds.value: 60,
+    OptConfigs.aggregate_buckets.value: 60,  # Windows of up to an hour.
+    OptConfigs.aggregate_top_k.value: 20,
+}
+JSON_HEADERS = {'Content-Type': 'application/json'}
+EXC_SUMMARIES = ExceptionSummaries()  # Stores the fingerprints of the
+# exceptions handled by this process.
+LAST_ERRORS = {}  # Stores the time and a summary of the last error of each
+# stream label, for the console status lines.
+
+STREAM_EVENTS = REGISTRY.counter(
+    'trigger_stream_events_total',
+    'Data items read from each stream.', ('stream',))
+STREAM_RECONNECTS = REGISTRY.counter(
+    'trigger_stream_reconnects_total',
+    'Reconnections of each stream, by reason.', ('stream', 'reason'))
+STREAM_LAG = REGISTRY.gauge(
+    'trigger_stream_lag_seconds',
+    'Seconds since the mtime of the last data item of each stream.',
+    ('stream',))
+QUEUE_DEPTH = REGISTRY.gauge(
+    'trigger_queue_depth',
+    'Items waiting in each queue of each stream.', ('stream', 'queue'))
+STREAM_DROPPED = REGISTRY.counter(
+    'trigger_dropped_total',
+    'Data items dropped because the work queue was full.', ('stream',))
+DEAD_LETTERS = REGISTRY.counter(
+    'trigger_dead_letters_total',
+    'Items written to the dead-letter file of each stream, by kind and '
+    'reason.', ('stream', 'kind', 'reason'))
+STREAM_SPILLED = REGISTRY.counter(
+    'trigger_spilled_total',
+    'Data items spilled to disk because the work queue was full.',
+    ('stream',))
+GCF_LATENCY = REGISTRY.histogram(
+    'trigger_gcf_request_seconds',
+    'Latency of the requests to each GCF.', ('gcf',))
+GCF_REQUESTS = REGISTRY.counter(
+    'trigger_gcf_requests_total',
+    'Requests to each GCF, by response status.', ('gcf', 'status'))
+CALL_RETRIES = REGISTRY.counter(
+    'trigger_call_retries_total',
+    'Retried attempts of each function call.', ('api_call',))
+CALL_FAILURES = REGISTRY.counter(
+    'trigger_call_failures_total',
+    'Function calls given up on, by reason.', ('api_call', 'reason'))
+MEMORY = REGISTRY.gauge(
+    'trigger_memory_bytes',
+    'Resident memory of the process, and its ceiling.', ('kind',))
+MEMORY.labels('rss').set_function(current_rss)
+ENTITIES = REGISTRY.gauge(
+    'trigger_entity_index_entities',
+    'Entities of each kind in the entity index.', ('kind',))
+LOG_SHIPPER = REGISTRY.gauge(
+    'trigger_logs', 'Logs of the log shipper, by state.', ('state',))
+BATCH_SIZE = REGISTRY.histogram(
+    'trigger_batch_size',
+    'Items per batch sent by each function.', ('api_call',),
+    buckets=(1, 2, 5, 10, 25, 50, 100, 150, 250, 500, 1000))
+
+
+def get_stream_sinks(configs: dict) -> set:
+    """
+    :param configs: The configurations of the script.
+    :return: The set of values of *StreamSinks* the ``stream_sink`` config
+        includes. The config is a value of *StreamSinks*, or a list of them.
+    """
+    sinks = configs.get(OptConfigs.stream_sink.value,
+                        OPT_CONFIG_DEFAULTS[OptConfigs.stream_sink.value])
+    if isinstance(sinks, str):
+        sinks = [sinks]
+    stream_sinks = set()
+    for sink in sinks:
+        if StreamSinks(sink) == StreamSinks.both:
+            stream_sinks.update([StreamSinks.gcf.value,
+                                 StreamSinks.archive.value])
+        else:
+            stream_sinks.add(sink)
+    return stream_sinks
+
+
+def call_after(num_calls: int, func: Callable) -> Callable:
+    """
+    :param num_calls: The number of calls after which ``func`` is called.
+    :param func: A function without parameters.
+    :return: A thread-safe function that calls ``func`` on its
+        ``num_calls``-th call.
+    """
+    lock = threading.Lock()
+    calls = [0]
+
+    def countdown():
+        with lock:
+            calls[0] += 1
+            if calls[0] != num_calls:
+                return
+        func()
+    return countdown
+
+
 class MeetupStream(object):
     """
     A class for streaming meetup data and triggering a google cloud
     function for storing the data in GCS.
     """
+    instances = weakref.WeakSet()  # Stores all streams of this process, so
+    # that their stats can be reported.
 
     def __init__(self,
                  url: str,
-                 configs: dict):
+                 configs: dict,
+                 seen_cache: SeenCache = None,
+                 rate_limiter: RateLimiter = None,
+                 retry_budget: RetryBudget = None,
+                 archive_writer: ArchiveWriter = None,
+                 bq_loader: BigQueryLoader = None,
+                 memory_budget: MemoryBudget = None,
+                 entity_index: EntityIndex = None,
+                 stream_aggregates: StreamAggregates = None):
         """
-        Initializes an instant of class *HttpStream*.
-
-        :param stream_url: The URL to stream.
-        :param http_url: The URL of the google cloud function to trigger.
-        :param bucket_name: The name of the google cloud storage bucket
-            for storing stream data.
-        :param prefix: A label for describing the type of data
-            that is being streamed.
+        Initializes an instance of class *MeetupStream*.
+
+        :param url: The URL to stream. Its last path is the label of the
+            stream.
+        :param configs: The configurations of the script. The values of
+            *ReqConfigs* are required, and the values of *OptConfigs*
+            default to OPT_CONFIG_DEFAULTS.
+        :param seen_cache: A cache of the member and group IDs that were
+            recently queued. It can be shared between streams. If None,
+            every member and group ID is queued.
+        :param rate_limiter: A rate limiter for the meetup API calls made by
+            the profile GCFs. It can be shared between streams. If None,
+            the profile GCFs are not paced.
+        :param retry_budget: A retry budget for the GCF calls. It can be
+            shared between streams. If None, retries are not limited by a
+            budget.
+        :param archive_writer: A writer of the archive files of stream data.
+            It can be shared between streams. If None, stream data is not
+            archived.
+        :param bq_loader: A loader of stream data into BigQuery. It can be
+            shared between streams. If None, stream data is not loaded into
+            BigQuery.
+        :param memory_budget: The memory ceiling of the process, shared
+            between streams. If None, memory is not bounded.
+        :param entity_index: An index of the entities linked by the data
+            items. It can be shared between streams. If None, data items
+            are not indexed.
+        :param stream_aggregates: The windowed aggregates of the data items.
+            They can be shared between streams. If None, data items are not
+            aggregated.
         """
         self._required_configs = \
             np.array([c.value for c in ReqConfigs.__members__.values()])
         self.url = url
         self.prefix = url.split('/')[-1].split('?')[0]  # Set the prefix to be
         # the last path in the URL.
-        self.configs = configs
+        self.name = self.prefix  # Stores the name of the local files of
+        # the stream.
+        self.configs = {**OPT_CONFIG_DEFAULTS, **configs}
         is_config_not_provided = np.array(
             [key not in configs for key in self._required_configs])
         if any(is_config_not_provided):
             raise KeyError('Missing one or more config parameters:'
                            f'{self._required_configs[is_config_not_provided]}.')
         self.mtime = None  # Stores the timestamp of the last data streamed.
+        self.seen_cache = seen_cache
+        self.rate_limiter = rate_limiter
+        self.retry_budget = retry_budget
+        self.archive_writer = archive_writer
+        self.bq_loader = bq_loader
+        self.memory_budget = memory_budget
+        self.entity_index = entity_index
+        self.stream_aggregates = stream_aggregates
+        self.linked_paths = LINKED_FIELDS  # Stores the paths of the fields
+        # kept by the data items of the pass-through mode.
+        if entity_index is not None:
+            self.linked_paths += INDEXED_PATHS
+        if stream_aggregates is not None:
+            self.linked_paths += AGGREGATED_PATHS
+        self.sinks = get_stream_sinks(self.configs)
+        if bq_loader is not None and self.prefix not in LABEL_SCHEMAS:
+            raise KeyError(f'There is no BigQuery schema for {self.prefix}.')
+        self.stream_retry_policy = self.create_retry_policy(
+            deadline=self.configs[OptConfigs.stream_retry_deadline.value])
+        self.profile_retry_policy = self.create_retry_policy(
+            deadline=self.configs[OptConfigs.profile_retry_deadline.value])
+        self.last_notify = datetime.datetime.now()  # Stores the time of the
+        # last Script-Monitor log.
+        self.members_queue = self.groups_queue = self.stream_queue = None
+        self.work_queue = None  # Stores the data items read from the stream,
+        # if the stream is dispatched by a pool of dispatcher workers.
+        self.dropped = self.spilled = self.dead_lettered = 0
+        self.commits_left = {}  # Stores the number of commits each spooled
+        # data item waits for, if it is saved by the GCF and other sinks.
+        self.commits_lock = threading.Lock()
+        self.spill_lock = threading.Lock()
+        self.replay_lock = threading.Lock()
+        self.replay_offset = 0  # Stores the offset of the next line of the
+        # replay file to move back into the work queue.
+        self.spill_path = os.path.join(
+            self.configs[OptConfigs.spill_dir.value],
+            f'{self.name}.spill.ndjson')
+        self.dead_letter_lock = threading.Lock()
+        self.dead_letter_path = os.path.join(
+            self.configs[OptConfigs.dead_letter_dir.value],
+            f'{self.name}.dead.ndjson')
+        self.timeout = (self.configs[OptConfigs.http_connect_timeout.value],
+                        self.configs[OptConfigs.http_read_timeout.value])
+        self.gcf_names = {  # Stores the label of each GCF in the metrics.
+            self.configs[ReqConfigs.stream_gcf.value]: 'stream',
+            self.configs[ReqConfigs.member_gcf.value]: 'member',
+            self.configs[ReqConfigs.group_gcf.value]: 'group'}
+        self.session = self.create_session()
+        self.spool = self.create_spool()
+        self.checkpoint = self.create_checkpoint()
+        if self.checkpoint and self.checkpoint.mtime is not None:
+            self.mtime = self.checkpoint.mtime  # Resume the stream.
+        MeetupStream.instances.add(self)
+
+    def create_retry_policy(self, deadline: float) -> RetryPolicy:
+        """
+        Creates a retry policy for the GCF calls of this stream.
+
+        :param deadline: The maximum number of seconds to spend on a call.
+        :return: A *RetryPolicy*.
+        """
+        return RetryPolicy(
+            num_attempts=self.configs[OptConfigs.retry_attempts.value],
+            base_sleep=self.configs[OptConfigs.retry_base_sleep.value],
+            max_sleep=self.configs[OptConfigs.retry_max_sleep.value],
+            deadline=deadline,
+            budget=self.retry_budget)
+
+    def create_spool(self) -> Union[Spool, None]:
+        """
+        Creates the spool of this stream, in a folder named after the stream
+        inside the ``spool_dir`` folder.
+
+        :return: A *Spool*, or None if the spool is disabled.
+        """
+        spool_dir = self.configs[OptConfigs.spool_dir.value]
+        if not spool_dir:
+            return None
+        return Spool(
+            directory=os.path.join(spool_dir, self.name),
+            segment_size=self.configs[OptConfigs.spool_segment_size.value])
+
+    def create_checkpoint(self) -> Union[Checkpoint, None]:
+        """
+        Creates the checkpoint of this stream, in a file named after the
+        stream inside the ``checkpoint_dir`` folder. If the spool is enabled,
+        data items are durably stored once they are spooled. Otherwise, they
+        are durably stored once the save_stream_data GCF saves them.
+
+        :return: A *Checkpoint*, or None if checkpoints are disabled.
+        """
+        checkpoint_dir = self.configs[OptConfigs.checkpoint_dir.value]
+        if not checkpoint_dir:
+            return None
+        return Checkpoint(
+            path=os.path.join(checkpoint_dir, f'{self.name}.json'),
+            interval=self.configs[OptConfigs.checkpoint_interval.value],
+            sync=self.spool.sync if self.spool else None)
+
+    def create_session(self) -> requests.Session:
+        """
+        Creates a session for all HTTP requests of this stream. The session
+        keeps its connections alive and pools them, so the GCFs can be
+        triggered without a new TCP and TLS handshake per request.
+
+        :return: A requests session.
+        """
+        pool_size = self.configs[OptConfigs.http_pool_size.value]
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
 
     def __read_stream(self) -> Generator[dict, None, None]:
         """
@@ -93,7 +1430,9 @@ class MeetupStream(object):
 
         :returns: The last data streamed from self.url.
         """
-        pprint(f"Reading {self.prefix} stream: {self.url}")
+        pprint(f"Reading {self.name} stream: {self.url}")
+        chunk_size = self.configs[OptConfigs.stream_chunk_size.value]
+        reconnects = self.reconnect_counters()
         while True:
             url = self.url
             if self.mtime:  # self.mtime is not None if the stream has been
@@ -101,15 +1440,19 @@ class MeetupStream(object):
                 new_params = {'since_mtime': self.mtime}
                 url = add_url_params(url, new_params)
             try:
-                with requests.get(url, stream=True) as r:
-                    for line in r.iter_lines():
+                with self.session.get(url, stream=True,
+                                      timeout=(self.timeout[0], None)) as r:
+                    for line in r.iter_lines(chunk_size=chunk_size):
                         if line:
                             # The data is coming in JSON format.
-                            json_data = json.loads(line.decode('utf-8'))
+                            json_data = self.decode_line(line)
                             if 'mtime' in json_data:  # Save timestamp of data.
                                 self.mtime = json_data['mtime']
                             yield json_data
+                reconnects['closed'].inc()
             except ChunkedEncodingError:
+                reconnects['chunked'].inc()
+                note_error(self.prefix, 'stream interrupted')
                 # Log exceptions to Stackdriver-Logging.
                 log_struct = {'desc': 'Chunked error while reading stream.',
                               'stream_url': url}
@@ -118,12 +1461,12 @@ class MeetupStream(object):
                 time.sleep(1)
                 continue
             except Exception:
+                reconnects['error'].inc()
+                note_error(self.prefix, 'stream error')
                 log_struct = {'desc': 'Error while reading stream.',
                               'stream_url': url}
                 log_struct.update(get_exc_info_struct())
-                pprint(f"Error while reading stream:\n"
-                       f"{json.dumps(log_struct, indent=4)}",
-                       pformat=BColors.FAIL)
+                pprint_struct(log_struct, pformat=BColors.FAIL)
                 LOGGER.log_struct(log_struct, severity='EMERGENCY')
                 time.sleep(1)
                 continue
@@ -133,101 +1476,1198 @@ class MeetupStream(object):
         Triggers the GCF with url self.http with a POST request. Each POST
         request contains the last data streamed, as well as the GCS bucket
         name.
-        """
-        notify_logger = 'projects/meetup-analysis/logs/Script-Monitor'
-        notify_interval_hours = 3
-        notify_interval = datetime.timedelta(hours=notify_interval_hours)
-        last_notify = datetime.datetime.now()
-        last_notify.replace(
-            hour=last_notify.hour//notify_interval_hours*notify_interval_hours,
-            minute=0)
 
+        If the ``dispatch_workers`` config is positive, the stream is drained
+        into a bounded work queue and the GCFs are triggered by a pool of
+        dispatcher workers, so reading the stream never waits on a GCF.
+        """
         q_size = 150
-        members_queue = Queue(func_trigger=self.trigger_save_member_data,
-                              q_size=q_size)
-        groups_queue = Queue(func_trigger=self.trigger_save_group_data,
-                             q_size=q_size)
+        profile_age = self.configs[OptConfigs.profile_batch_age.value]
+        self.members_queue = BatchQueue(
+            func_trigger=self.entries_trigger(self.trigger_save_member_data,
+                                              SpoolKinds.member.value),
+            q_size=q_size,
+            max_age=profile_age)
+        self.groups_queue = BatchQueue(
+            func_trigger=self.entries_trigger(self.trigger_save_group_data,
+                                              SpoolKinds.group.value),
+            q_size=q_size,
+            max_age=profile_age)
+        batch_size = self.configs[OptConfigs.stream_batch_size.value]
+        if batch_size > 1:  # Send stream data to the GCF in batches.
+            self.stream_queue = BatchQueue(
+                func_trigger=self.entries_trigger(
+                    self.trigger_save_stream_data, SpoolKinds.stream.value),
+                q_size=batch_size,
+                max_age=self.configs[OptConfigs.stream_batch_age.value])
+        num_workers = self.configs[OptConfigs.dispatch_workers.value]
+        if num_workers > 0:
+            self.work_queue = queue.Queue(
+                maxsize=self.configs[OptConfigs.dispatch_queue_size.value])
+            for i in range(num_workers):
+                threading.Thread(target=self.__dispatch_worker,
+                                 name=f'{self.name}-dispatcher-{i}',
+                                 daemon=True).start()
+        if self.spool and self.spool.recovered:
+            threading.Thread(target=self.replay_spool,
+                             name=f'{self.name}-replay',
+                             daemon=True).start()
+        self.register_metrics()
+        events = STREAM_EVENTS.labels(self.name)
         while True:
             stream = self.__read_stream()  # The stream generator.
             for data_item in stream:
-                attempt_func_call(
-                    self.trigger_save_stream_data, params=[data_item],
-                    ignored_exceptions=(self.FatalCloudFunctionError,),
-                    tag=self.prefix)
-                if 'member' in data_item and \
-                        'member_id' in data_item['member']:
-                    member_id = data_item['member']['member_id']
-                    members_queue.add(member_id)
-                if 'group' in data_item and \
-                        'id' in data_item['group']:
-                    group_id = data_item['group']['id']
-                    groups_queue.add(group_id)
-
-                now = datetime.datetime.now()
-                if now - last_notify > notify_interval and now.hour > 12:
-                    last_notify = now
-                    LOGGER.log_text("Good news: Saving data!",
-                                    log_name=notify_logger,
-                                    severity='INFO')
-                pprint(str(int(now.timestamp())), title=True)
+                events.inc()
+                ref = self.spool_append(SpoolKinds.stream.value, data_item)
+                if self.memory_budget is not None and \
+                        self.memory_budget.exceeded:
+                    if self.work_queue is not None:
+                        self.spill_data_item(data_item, ref)
+                        continue
+                    self.memory_budget.wait()
+                if self.work_queue is not None:
+                    self.enqueue_data_item(data_item, ref)
+                else:
+                    self.process_data_item(data_item, ref)
+                self.notify_monitor()
+                if self.checkpoint:
+                    self.checkpoint.save_if_due()
+
+    def process_data_item(self, data_item: dict, ref: tuple = None):
+        """
+        Queues the IDs of the member and group of ``data_item``, and
+        triggers the GCF for storing ``data_item``.
+
+        :param data_item: A data item streamed from self.url.
+        :param ref: The reference of ``data_item`` in the spool.
+        """
+        self.queue_linked_ids(data_item, self.members_queue, self.groups_queue)
+        self.save_data_item(data_item, ref)
+
+    def save_data_item(self, data_item: dict, ref: tuple = None):
+        """
+        Saves ``data_item`` using the ``stream_sink`` config. The data item is
+        added to the archive and BigQuery sinks, and is added to the stream
+        queue or sent to the GCF for storing it.
+
+        :param data_item: A data item streamed from self.url.
+        :param ref: The reference of ``data_item`` in the spool.
+        """
+        entry = (ref, data_item)
+        if self.sink_data_item(entry):
+            return
+        if self.stream_queue:
+            self.stream_queue.add(entry)
+        elif self.trigger_save_stream_data(data_item):
+            self.ack_entries([entry])
+        else:
+            self.fail_entries(SpoolKinds.stream.value, [entry], 'failed')
+
+    def sink_data_item(self, entry: tuple) -> bool:
+        """
+        Adds the data item of ``entry`` to the archive and BigQuery sinks
+        that are enabled. The data item is decoded once, and shared by the
+        sinks. The entry is acknowledged once all the sinks, and the GCF if
+        it is a sink, have committed it.
+
+        :param entry: A tuple of the reference and the data item.
+        :return: Whether the GCF is not a sink of the data item.
+        """
+        sinks = [sink for sink in (self.archive_writer, self.bq_loader)
+                 if sink is not None]
+        if not sinks:
+            return False
+        sinks_only = StreamSinks.gcf.value not in self.sinks
+        on_commit = None
+        if sinks_only:
+            on_commit = call_after(len(sinks), functools.partial(
+                self.ack_entries, [entry]))
+        elif entry[0] is not None:  # Each sink and the GCF acknowledge the
+            # entry, which is acknowledged in the spool by the last of them.
+            with self.commits_lock:
+                self.commits_left[entry[0]] = len(sinks) + 1
+            on_commit = functools.partial(self.ack_entries, [entry])
+        data_item = decode_item(entry[1])
+        if self.archive_writer is not None:
+            self.archive_writer.write(self.prefix, data_item,
+                                      on_commit=on_commit)
+        if self.bq_loader is not None:
+            self.bq_loader.write(self.prefix, data_item, on_commit=on_commit,
+                                 on_failure=functools.partial(
+                                     self.fail_sink, entry, 'bigquery',
+                                     on_commit))
+        return sinks_only
+
+    def fail_sink(self, entry: tuple, sink: str, on_commit: Callable = None):
+        """
+        Writes the data item of ``entry``, which ``sink`` could not save, to
+        the dead-letter file. The failure counts as a commit of the sink, so
+        that the entry is still acknowledged once its other sinks are done.
+
+        :param entry: A tuple of the reference and the data item.
+        :param sink: The name of the sink, used as the reason.
+        :param on_commit: The commit function of the data item in the sink.
+        """
+        self.dead_letter(SpoolKinds.stream.value, [entry[1]], sink)
+        if on_commit:
+            on_commit()
+
+    def enqueue_data_item(self, data_item: dict, ref: tuple = None):
+        """
+        Adds ``data_item`` to the work queue of the dispatcher workers. If the
+        queue is full, the ``dispatch_full_policy`` config decides whether to
+        wait, drop a data item, or spill ``data_item`` to disk. Dropped data
+        items are written to the dead-letter file.
+
+        :param data_item: A data item streamed from self.url.
+        :param ref: The reference of ``data_item`` in the spool.
+        """
+        entry = (ref, data_item)
+        policy = self.configs[OptConfigs.dispatch_full_policy.value]
+        if policy == FullPolicies.block.value:
+            self.work_queue.put(entry)
+            return
+        try:
+            self.work_queue.put_nowait(entry)
+            return
+        except queue.Full:
+            pass
+
+        if policy == FullPolicies.spill.value:
+            self.spill_data_item(data_item, ref)
+            return
+        if policy == FullPolicies.drop_oldest.value:
+            try:
+                oldest = self.work_queue.get_nowait()
+                self.work_queue.task_done()
+                self.dropped += 1
+                self.fail_entries(SpoolKinds.stream.value, [oldest],
+                                  'dropped')
+            except queue.Empty:
+                pass
+            try:
+                self.work_queue.put_nowait(entry)
+                return
+            except queue.Full:
+                pass
+        self.dropped += 1
+        self.fail_entries(SpoolKinds.stream.value, [entry], 'dropped')
+
+    def spill_data_item(self, data_item: dict, ref: tuple = None):
+        """
+        Appends ``data_item`` to the spill file of this stream. The
+        dispatcher workers move it back into the work queue once the queue
+        is empty.
+
+        :param data_item: A data item streamed from self.url.
+        :param ref: The reference of ``data_item`` in the spool.
+        """
+        with self.spill_lock:
+            os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+            with open(self.spill_path, 'ab') as spill_file:
+                spill_file.write(encode_json((ref, data_item)) + b'\n')
+        self.spilled += 1
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        :return: The number of data items waiting in the work queue of the
+            dispatcher workers.
+        """
+        return self.work_queue.qsize() if self.work_queue is not None else 0
+
+    def stats(self) -> dict:
+        """
+        :return: A dictionary containing statistics about this stream.
+        """
+        return {'stream': self.name,
+                'mtime': self.mtime,
+                'queue_depth': self.queue_depth,
+                'dropped': self.dropped,
+                'spilled': self.spilled,
+                'dead_lettered': self.dead_lettered,
+                'seen_cache': (self.seen_cache.stats()
+                               if self.seen_cache is not None else None),
+                'retry_budget': (self.retry_budget.stats()
+                                 if self.retry_budget is not None else None),
+                'spool': self.spool.stats() if self.spool else None,
+                'archive': (self.archive_writer.stats()
+                            if self.archive_writer is not None else None),
+                'bigquery': (self.bq_loader.stats()
+                             if self.bq_loader is not None else None),
+                'entity_index': (self.entity_index.stats()
+                                 if self.entity_index is not None else None),
+                'aggregates': (self.stream_aggregates.stats()
+                               if self.stream_aggregates is not None
+                               else None),
+                'memory': {'pid': os.getpid(),
+                           **(self.memory_budget.stats()
+                              if self.memory_budget is not None else
+                              {'rss_mib': round(current_rss() / 1024 / 1024,
+                                                1)})}}
+
+    def register_metrics(self):
+        """
+        Exposes the queue depths, the lag, and the dropped and spilled data
+        items of this stream in the metrics. Their values are read when the
+        metrics are collected, so the stream does not update them.
+        """
+        queues = {'work': lambda: self.queue_depth}
+        for name, batch_queue in (('stream', self.stream_queue),
+                                  ('members', self.members_queue),
+                                  ('groups', self.groups_queue)):
+            if batch_queue is not None:
+                queues[name] = functools.partial(
+                    getattr, batch_queue, 'pending')
+        for name, function in queues.items():
+            QUEUE_DEPTH.labels(self.name, name).set_function(function)
+        STREAM_LAG.labels(self.name).set_function(
+            lambda: time.time() - self.mtime / 1000 if self.mtime else None)
+        STREAM_DROPPED.labels(self.name).set_function(lambda: self.dropped)
+        STREAM_SPILLED.labels(self.name).set_function(lambda: self.spilled)
+
+    def reconnect_counters(self) -> dict:
+        """
+        :return: The reconnect counter of this stream for each reason: the
+            stream was closed by the server, was interrupted in the middle
+            of a chunk, or failed with another error.
+        """
+        return {reason: STREAM_RECONNECTS.labels(self.name, reason)
+                for reason in ('closed', 'chunked', 'error')}
+
+    def __dispatch_worker(self):
+        """
+        Takes data items from the work queue and processes them. Whenever the
+        queue is empty, the data items spilled to disk are processed.
+        """
+        while True:
+            try:
+                ref, data_item = self.work_queue.get(timeout=1)
+            except queue.Empty:
+                self.__replay_spill()
+                continue
+            try:
+                self.process_data_item(data_item, ref)
+            except Exception:
+                log_struct = {'desc': 'Error while dispatching data.',
+                              'stream_url': self.url}
+                log_struct.update(get_exc_info_struct())
+                LOGGER.log_struct(log_struct, severity='ERROR')
+            finally:
+                self.work_queue.task_done()
+
+    def __replay_spill(self):
+        """
+        Moves the data items spilled to disk back into the work queue, while
+        the queue has room. The spill file is renamed before it is read, so
+        that the reader can keep spilling to a new file. Once the queue is
+        full, the offset of the next line is kept and the dispatcher worker
+        goes back to consuming the queue, and the replay resumes the next
+        time the queue is empty. Only one dispatcher worker replays the
+        spilled data at a time.
+        """
+        if self.memory_budget is not None and self.memory_budget.exceeded:
+            return  # Keep the spilled data on disk.
+        if not self.replay_lock.acquire(blocking=False):
+            return
+        try:
+            replay_path = self.spill_path.replace('.spill.', '.replay.')
+            with self.spill_lock:
+                if not os.path.exists(replay_path):
+                    if not os.path.exists(self.spill_path):
+                        return
+                    os.replace(self.spill_path, replay_path)
+                    self.replay_offset = 0
+
+            if not self.replay_offset:
+                pprint(f'Replaying spilled {self.name} data...',
+                       pformat=BColors.WARNING)
+            with open(replay_path, 'rb') as replay_file:
+                replay_file.seek(self.replay_offset)
+                for line in iter(replay_file.readline, b''):
+                    if line.strip():
+                        entry = json_loads(line)
+                        if isinstance(entry, dict):  # Spilled before the
+                            # spool references were stored.
+                            entry = (None, entry)
+                        ref, data_item = entry
+                        try:
+                            self.work_queue.put_nowait(
+                                (tuple(ref) if ref else None, data_item))
+                        except queue.Full:
+                            return  # Resume from this line.
+                    self.replay_offset = replay_file.tell()
+            os.remove(replay_path)
+            self.replay_offset = 0
+        finally:
+            self.replay_lock.release()
+
+    def queue_linked_ids(self,
+                         data_item: dict,
+                         members_queue: 'BatchQueue',
+                         groups_queue: 'BatchQueue'):
+        """
+        Adds the IDs of the member and the group linked to ``data_item`` to
+        their queues, so that their profiles are saved, links the entities
+        of ``data_item`` in the entity index, and adds ``data_item`` to the
+        windowed aggregates.
+
+        :param data_item: A data item streamed from self.url.
+        :param members_queue: The queue of member IDs.
+        :param groups_queue: The queue of group IDs.
+        """
+        if self.entity_index is not None:
+            self.entity_index.add(self.prefix, data_item)
+        if self.stream_aggregates is not None:
+            self.stream_aggregates.add(self.prefix, data_item)
+        if 'member' in data_item and \
+                'member_id' in data_item['member']:
+            member_id = data_item['member']['member_id']
+            if self.seen_cache is None or \
+                    self.seen_cache.add(f'm{member_id}'):
+                ref = self.spool_append(SpoolKinds.member.value, member_id)
+                members_queue.add((ref, member_id))
+        if 'group' in data_item and \
+                'id' in data_item['group']:
+            group_id = data_item['group']['id']
+            if self.seen_cache is None or \
+                    self.seen_cache.add(f'g{group_id}'):
+                ref = self.spool_append(SpoolKinds.group.value, group_id)
+                groups_queue.add((ref, group_id))
+
+    def forget_member_ids(self, member_ids: List[int]):
+        """
+        Removes ``member_ids`` from the seen cache, so that they are queued
+        again the next time they are streamed.
+
+        :param member_ids: A list of member IDs whose data was not saved.
+        """
+        if self.seen_cache is not None:
+            self.seen_cache.discard([f'm{i}' for i in member_ids])
+
+    def forget_group_ids(self, group_ids: List[int]):
+        """
+        Removes ``group_ids`` from the seen cache, so that they are queued
+        again the next time they are streamed.
+
+        :param group_ids: A list of group IDs whose data was not saved.
+        """
+        if self.seen_cache is not None:
+            self.seen_cache.discard([f'g{i}' for i in group_ids])
+
+    def decode_line(self, line: bytes) -> dict:
+        """
+        Decodes a raw line of the stream. In pass-through mode, only the
+        fields used by the trigger are kept, along with the raw line, which
+        is forwarded to the GCF and the spool as is. If the archive or
+        BigQuery sinks are enabled, the decoded data item is also kept until
+        they take it, so that the line is only decoded once.
+
+        The line is decoded in full even in pass-through mode: with orjson,
+        this costs about as much as scanning the raw line for the fields
+        that are kept, without the risk of matching nested or escaped keys.
+
+        :param line: A raw line of the stream.
+        :return: The data item, or a *RawDataItem* in pass-through mode.
+        """
+        data_item = json_loads(line)
+        if self.configs[OptConfigs.stream_passthrough.value]:
+            return RawDataItem(line, data_item, paths=self.linked_paths,
+                               keep=(self.archive_writer is not None or
+                                     self.bq_loader is not None))
+        return data_item
+
+    def spool_append(self, kind: str, item: Any) -> Union[tuple, None]:
+        """
+        Appends ``item`` to the spool of this stream. Without the spool,
+        data items are tracked by the checkpoint until they are saved.
+
+        :param kind: A value of *SpoolKinds*.
+        :param item: A data item, or a member or group ID.
+        :return: The reference of ``item`` in the spool, or None if the
+            spool is disabled.
+        """
+        if self.spool is None:
+            if self.checkpoint and kind == SpoolKinds.stream.value and \
+                    'mtime' in item:  # The data item is only durable once
+                # it is saved.
+                self.checkpoint.track(item['mtime'])
+            return None
+        ref = self.spool.append(kind, item)
+        if self.checkpoint and kind == SpoolKinds.stream.value and \
+                'mtime' in item:
+            self.checkpoint.advance(item['mtime'])
+        return ref
+
+    def ack_entries(self, entries: List[tuple]):
+        """
+        Acknowledges spool entries whose items were saved.
+
+        :param entries: A list of (reference, item) tuples.
+        """
+        if self.spool is not None:
+            self.spool.ack([ref for ref, _ in entries
+                            if ref is not None and self.__committed(ref)])
+        elif self.checkpoint:  # Without the spool, data items are only
+            # durable once they are saved.
+            for _, item in entries:
+                if isinstance(item, dict) and 'mtime' in item:
+                    self.checkpoint.advance(item['mtime'])
+
+    def fail_entries(self,
+                     kind: str,
+                     entries: List[tuple],
+                     reason: str,
+                     failed: list = None):
+        """
+        Writes the items of ``entries`` that will never be saved, because
+        their GCF call failed for good or they were dropped, to the
+        dead-letter file, and acknowledges all of ``entries``. Otherwise,
+        their spool segment would never be deleted, and the checkpoint would
+        never pass them.
+
+        :param kind: A value of *SpoolKinds*.
+        :param entries: A list of (reference, item) tuples.
+        :param reason: Why the items were not saved, e.g. 'failed' or
+            'dropped'.
+        :param failed: The items of ``entries`` that were not saved, if the
+            others were. If None, none of the items were saved.
+        """
+        dead = entries
+        if failed is not None:
+            failed = {str(item) for item in failed}
+            dead = [entry for entry in entries if str(entry[1]) in failed]
+        self.dead_letter(kind, [item for _, item in dead], reason)
+        self.ack_entries(entries)
+
+    def dead_letter(self, kind: str, items: list, reason: str):
+        """
+        Appends ``items`` to the dead-letter file of this stream, so that
+        they can be inspected, and saved again by hand.
+
+        :param kind: A value of *SpoolKinds*.
+        :param items: Data items, or member or group IDs.
+        :param reason: Why the items were not saved.
+        """
+        if not items:
+            return
+        header = b'{"kind": %s, "reason": %s, "time": %d, "item": ' % (
+            json_dumps(kind), json_dumps(reason), int(time.time()))
+        lines = b''.join(header + encode_json(item) + b'}\n'
+                         for item in items)
+        with self.dead_letter_lock:
+            os.makedirs(os.path.dirname(self.dead_letter_path) or '.',
+                        exist_ok=True)
+            with open(self.dead_letter_path, 'ab') as dead_letter_file:
+                dead_letter_file.write(lines)
+            self.dead_lettered += len(items)
+        DEAD_LETTERS.labels(self.name, kind, reason).inc(len(items))
+        if LOGGER:
+            LOGGER.log_struct({'desc': 'Wrote items that were not saved to '
+                                       'the dead-letter file.',
+                               'stream': self.name,
+                               'kind': kind,
+                               'reason': reason,
+                               'items': len(items),
+                               'path': self.dead_letter_path},
+                              severity='ERROR')
+
+    def __committed(self, ref: tuple) -> bool:
+        """
+        Counts a commit of the spooled data item with reference ``ref``.
+
+        :param ref: The reference of a data item in the spool.
+        :return: Whether the data item was committed by all of its sinks.
+        """
+        with self.commits_lock:
+            commits_left = self.commits_left.get(ref)
+            if commits_left is None:
+                return True
+            if commits_left > 1:
+                self.commits_left[ref] = commits_left - 1
+                return False
+            del self.commits_left[ref]
+            return True
+
+    def entries_trigger(self, api_call: Callable, kind: str) -> Callable:
+        """
+        Returns a function that can be used as the trigger of a
+        *BatchQueue* of spool entries. The function calls ``api_call`` with
+        the items of the entries, and acknowledges the entries if the call
+        succeeds. If it fails, the items that were not saved are written to
+        the dead-letter file.
+
+        :param api_call: A function that saves a list of items, and returns
+            whether it was successful. It may narrow the list down to the
+            items that were not saved.
+        :param kind: The value of *SpoolKinds* of the items.
+        :return: A trigger for a *BatchQueue*.
+        """
+        batch_size = BATCH_SIZE.labels(api_call.__name__)
+
+        @functools.wraps(api_call)
+        def trigger(entries: list):
+            batch_size.observe(len(entries))
+            items = [item for _, item in entries]
+            if api_call(items):
+                self.ack_entries(entries)
+            else:
+                self.fail_entries(kind, entries, 'failed', failed=(
+                    items if kind != SpoolKinds.stream.value else None))
+        return trigger
+
+    def spool_queue(self, kind: str) -> Union[BatchQueue, None]:
+        """
+        :param kind: A value of *SpoolKinds*.
+        :return: The queue of the items of kind ``kind``, or None if the
+            items are not queued.
+        """
+        return {SpoolKinds.stream.value: self.stream_queue,
+                SpoolKinds.member.value: self.members_queue,
+                SpoolKinds.group.value: self.groups_queue}[kind]
+
+    def replayed_entries(self) -> Generator[Tuple[str, Any, tuple],
+                                            None, None]:
+        """
+        Reads the entries left in the spool by a previous run, and appends
+        them to the spool again. Entries that were replayed
+        ``spool_max_replays`` times are written to the dead-letter file.
+
+        :return: A generator of the kind, the item and the new reference of
+            each entry.
+        """
+        pprint(f'Replaying spooled {self.name} data...',
+               pformat=BColors.WARNING)
+        max_replays = self.configs[OptConfigs.spool_max_replays.value]
+        for kind, item, replays in self.spool.replay():
+            if replays >= max_replays:
+                log_struct = {'desc': 'Dropped a spooled entry that was '
+                                      'replayed too many times.',
+                              'kind': kind,
+                              'item': (item if kind != SpoolKinds.stream.value
+                                       else None),
+                              'replays': replays,
+                              'stream_url': self.url}
+                LOGGER.log_struct(log_struct, severity='ALERT')
+                self.dead_letter(kind, [item], 'replays')
+                continue
+            yield kind, item, self.spool.append(kind, item, replays + 1)
+
+    def replay_spool(self):
+        """
+        Saves the entries left in the spool by a previous run. Waits while
+        the queue of the entries is full, so that the entries are read from
+        disk only as fast as they are saved.
+        """
+        try:
+            for kind, item, ref in self.replayed_entries():
+                batch_queue = self.spool_queue(kind)
+                if batch_queue is not None:
+                    while batch_queue.pending >= batch_queue.q_size:
+                        time.sleep(0.1)
+                if kind == SpoolKinds.stream.value:
+                    self.save_data_item(item, ref)
+                else:
+                    batch_queue.add((ref, item))
+        except Exception:
+            log_struct = {'desc': 'Error while replaying spooled data.',
+                          'stream_url': self.url}
+            log_struct.update(get_exc_info_struct())
+            LOGGER.log_struct(log_struct, severity='ERROR')
+
+    def notify_monitor(self):
+        """
+        Sends a log to the Script-Monitor logger every few hours, to notify
+        that the script is running, and updates the terminal title.
+        """
+        notify_logger = 'projects/meetup-analysis/logs/Script-Monitor'
+        notify_interval_hours = 3
+        notify_interval = datetime.timedelta(hours=notify_interval_hours)
+        now = datetime.datetime.now()
+        if now - self.last_notify > notify_interval and now.hour > 12:
+            self.last_notify = now
+            log_struct = {'desc': "Good news: Saving data!"}
+            log_struct.update(self.stats())
+            LOGGER.log_struct(log_struct,
+                              log_name=notify_logger,
+                              severity='INFO')
+        pprint(str(int(now.timestamp())), title=True, verbose=True)
 
     def trigger_http_gcf(self,
                          url: str,
                          data: dict = None,
-                         params: dict = None):
+                         params: dict = None) -> Mapping:
+        gcf = self.gcf_names.get(url, 'other')
         if params:
             url = add_url_params(url, params)
-        with requests.post(url, json=data) as r:
-            if r.status_code == http.HTTPStatus.TOO_MANY_REQUESTS or \
-                    r.status_code >= 500:
-                raise self.RetriableCloudFunctionError(r.status_code, r.text)
-            elif r.status_code != http.HTTPStatus.OK:
-                raise self.FatalCloudFunctionError(r.status_code, r.text)
-
-    def trigger_save_stream_data(self, data):
+        body = encode_json(data) if data is not None else None
+        status = 'error'  # Stores the status of the response, if any.
+        started = time.monotonic()
+        try:
+            with self.session.post(url, data=body, timeout=self.timeout,
+                                   headers=JSON_HEADERS if body else None
+                                   ) as r:
+                status = r.status_code
+                self.raise_for_gcf_status(r.status_code, r.text, r.headers)
+                return r.headers
+        finally:
+            self.observe_gcf_request(gcf, status, time.monotonic() - started)
+
+    def observe_gcf_request(self, gcf: str, status: Any, seconds: float):
+        """
+        Records a GCF request in the metrics.
+
+        :param gcf: The label of the GCF.
+        :param status: The status code of the response, or 'error' if there
+            was no response.
+        :param seconds: The latency of the request.
+        """
+        GCF_LATENCY.labels(gcf).observe(seconds)
+        GCF_REQUESTS.labels(gcf, status).inc()
+
+    def raise_for_gcf_status(self,
+                             status_code: int,
+                             response: str,
+                             headers: Mapping = None):
+        """
+        Raises a *CloudFunctionError* if a GCF did not respond successfully.
+
+        :param status_code: The status code of the GCF response.
+        :param response: The text of the GCF response.
+        :param headers: The headers of the GCF response.
+        """
+        if status_code == http.HTTPStatus.MULTI_STATUS:
+            raise self.PartialCloudFunctionError(status_code, response,
+                                                 headers)
+        elif status_code == http.HTTPStatus.TOO_MANY_REQUESTS or \
+                status_code >= 500:
+            raise self.RetriableCloudFunctionError(status_code, response,
+                                                   headers)
+        elif status_code != http.HTTPStatus.OK:
+            raise self.FatalCloudFunctionError(status_code, response,
+                                               headers)
+
+    def trigger_save_stream_data(self,
+                                 data: Union[dict, List[dict]]) -> bool:
+        """
+        Triggers the save_stream_data GCF. If ``data`` is a list, the GCF
+        stores all of its items in a single newline-delimited JSON file.
+
+        :param data: A data item, or a batch of data items, to be stored.
+        :return: Whether the data was stored.
+        """
+        url, params = self.stream_gcf_request()
+        _, success = attempt_func_call(
+            self.trigger_http_gcf, params=[url, data, params],
+            policy=self.stream_retry_policy,
+            ignored_exceptions=(self.FatalCloudFunctionError,),
+            tag=self.prefix)
+        return success
+
+    def trigger_save_member_data(self, member_id: list) -> bool:
+        _, success = attempt_func_call(
+            self.trigger_profile_gcf,
+            params=[self.member_gcf_request, member_id],
+            policy=self.profile_retry_policy,
+            ignored_exceptions=(self.FatalCloudFunctionError,),
+            tag=self.prefix)
+        if not success:
+            self.forget_member_ids(member_id)
+        return success
+
+    def trigger_save_group_data(self, group_id: list) -> bool:
+        _, success = attempt_func_call(
+            self.trigger_profile_gcf,
+            params=[self.group_gcf_request, group_id],
+            policy=self.profile_retry_policy,
+            ignored_exceptions=(self.FatalCloudFunctionError,),
+            tag=self.prefix)
+        if not success:
+            self.forget_group_ids(group_id)
+        return success
+
+    def trigger_profile_gcf(self,
+                            gcf_request: Callable,
+                            ids: list):
+        """
+        Triggers a GCF that saves the profiles of ``ids``. If the GCF only
+        saves some of the profiles, ``ids`` is narrowed down to the IDs that
+        failed before the error is raised, so that a retry only saves those.
+
+        :param gcf_request: A function that returns the URL and the URL
+            parameters of the GCF request, given a list of IDs.
+        :param ids: A list of member or group IDs.
+        """
+        url, params = gcf_request(ids)
+        if self.rate_limiter:
+            self.rate_limiter.acquire(self.api_calls(ids))
+        try:
+            headers = self.trigger_http_gcf(url, None, params)
+        except self.CloudFunctionError as e:
+            if self.rate_limiter:
+                self.rate_limiter.update(e.headers)
+            if isinstance(e, self.PartialCloudFunctionError) and \
+                    e.failed_ids:
+                ids[:] = e.failed_ids
+            raise
+        if self.rate_limiter:
+            self.rate_limiter.update(headers)
+
+    def api_calls(self, ids: list) -> int:
+        """
+        :param ids: A list of member or group IDs.
+        :return: The number of meetup API calls a profile GCF makes for
+            retrieving the profiles of ``ids``.
+        """
+        chunk_size = self.configs[OptConfigs.meetup_chunk_size.value]
+        return max(1, math.ceil(len(ids) / chunk_size))
+
+    def stream_gcf_request(self) -> Tuple[str, dict]:
+        """
+        :return: The URL and the URL parameters of a save_stream_data
+            request.
+        """
         params = {
             "label": self.prefix,
             "bucket_name": self.configs[ReqConfigs.gcs_bucket.value]}
         url = self.configs[ReqConfigs.stream_gcf.value]
-        attempt_func_call(
-            self.trigger_http_gcf, params=[url, data, params],
-            ignored_exceptions=(self.FatalCloudFunctionError,),
-            tag=self.prefix)
+        return url, params
 
-    def trigger_save_member_data(self, member_id):
+    def member_gcf_request(self, member_id) -> Tuple[str, dict]:
+        """
+        :param member_id: A member ID, or a list of member IDs.
+        :return: The URL and the URL parameters of a save_member_data
+            request.
+        """
+        member_ids = member_id if isinstance(member_id, list) else [member_id]
         params = {
-            "member_id": str(member_id).strip('[]').replace(' ', ''),
+            "member_id": ','.join(str(i) for i in member_ids),
             "meetup_key": self.configs[ReqConfigs.meetup_key.value],
             "collection": self.configs[ReqConfigs.member_collection.value]
         }
         url = self.configs[ReqConfigs.member_gcf.value]
-        attempt_func_call(
-            self.trigger_http_gcf, params=[url, None, params],
-            ignored_exceptions=(self.FatalCloudFunctionError,),
-            tag=self.prefix)
+        return url, params
 
-    def trigger_save_group_data(self, group_id):
+    def group_gcf_request(self, group_id) -> Tuple[str, dict]:
+        """
+        :param group_id: A group ID, or a list of group IDs.
+        :return: The URL and the URL parameters of a save_group_data
+            request.
+        """
+        group_ids = group_id if isinstance(group_id, list) else [group_id]
         params = {
-            "group_id": str(group_id).strip('[]').replace(' ', ''),
+            "group_id": ','.join(str(i) for i in group_ids),
             "meetup_key": self.configs[ReqConfigs.meetup_key.value],
             "collection": self.configs[ReqConfigs.group_collection.value]
         }
         url = self.configs[ReqConfigs.group_gcf.value]
-        attempt_func_call(
-            self.trigger_http_gcf, params=[url, None, params],
-            ignored_exceptions=(self.FatalCloudFunctionError,),
-            tag=self.prefix)
+        return url, params
+
+    class CloudFunctionError(Exception):
+        def __init__(self, status_code, response, headers=None):
+            self.code = status_code,
+            self.response = response
+            self.headers = headers
+
+    class FatalCloudFunctionError(CloudFunctionError):
+        pass
+
+    class RetriableCloudFunctionError(CloudFunctionError):
+        pass
+
+    class PartialCloudFunctionError(RetriableCloudFunctionError):
+        """
+        Raised when a GCF only processed some of the IDs it received. The
+        GCF responds with the IDs that failed. If the response can not be
+        parsed, ``failed_ids`` is None, and all of the IDs are retried.
+        """
+        def __init__(self, status_code, response, headers=None):
+            super().__init__(status_code, response, headers)
+            try:
+                self.failed_ids = list(json.loads(response)['failed_ids'])
+            except (ValueError, KeyError, TypeError):
+                self.failed_ids = None
+
+
+class AsyncMeetupStream(MeetupStream):
+    """
+    A class for streaming meetup data and triggering google cloud functions
+    using asyncio. GCF requests are sent concurrently, while the number of
+    in-flight requests of each stream is bounded. Once the bound is reached,
+    reading the stream is paused until a request completes.
+    """
+
+    def __init__(self,
+                 url: str,
+                 configs: dict,
+                 session: aiohttp.ClientSession,
+                 seen_cache: SeenCache = None,
+                 rate_limiter: RateLimiter = None,
+                 retry_budget: RetryBudget = None,
+                 archive_writer: ArchiveWriter = None,
+                 bq_loader: BigQueryLoader = None,
+                 memory_budget: MemoryBudget = None,
+                 entity_index: EntityIndex = None,
+                 stream_aggregates: StreamAggregates = None):
+        """
+        Initializes an instance of class *AsyncMeetupStream*.
+
+        :param url: The URL to stream.
+        :param configs: The configurations of the script.
+        :param session: The aiohttp session used for all HTTP requests.
+        :param seen_cache: A cache of the member and group IDs that were
+            recently queued.
+        :param rate_limiter: A rate limiter for the meetup API calls made by
+            the profile GCFs.
+        :param retry_budget: A retry budget for the GCF calls.
+        :param archive_writer: A writer of the archive files of stream data.
+        :param bq_loader: A loader of stream data into BigQuery.
+        :param memory_budget: The memory ceiling of the process.
+        :param entity_index: An index of the entities linked by the data
+            items.
+        :param stream_aggregates: The windowed aggregates of the data items.
+        """
+        super().__init__(url=url, configs=configs, seen_cache=seen_cache,
+                         rate_limiter=rate_limiter, retry_budget=retry_budget,
+                         archive_writer=archive_writer,
+                         bq_loader=bq_loader, memory_budget=memory_budget,
+                         entity_index=entity_index,
+                         stream_aggregates=stream_aggregates)
+        self.session = session
+        self.timeout = aiohttp.ClientTimeout(
+            connect=self.configs[OptConfigs.http_connect_timeout.value],
+            sock_read=self.configs[OptConfigs.http_read_timeout.value])
+        self.in_flight = asyncio.Semaphore(
+            self.configs[OptConfigs.gcf_max_in_flight.value])
+        self.profile_in_flight = asyncio.Semaphore(
+            self.configs[OptConfigs.gcf_max_in_flight.value])  # The profile
+        # GCF calls wait for the rate limiter, so they have their own slots,
+        # and never hold the slots of the stream data.
+        self.tasks = set()  # Stores the dispatched tasks that are not done.
+        self.scheduled = set()  # Stores the calls scheduled by the batch
+        # queues, that are not dispatched yet.
+        self.loop = None  # Stores the event loop running this stream.
+        self.replay_task = None  # Stores the task replaying the spool.
+
+    def create_session(self) -> None:
+        """
+        The aiohttp session is shared between all streams, and is passed to
+        the constructor instead.
+        """
+        return None
+
+    def register_metrics(self):
+        """
+        Also exposes the number of in-flight GCF requests of this stream.
+        """
+        super().register_metrics()
+        QUEUE_DEPTH.labels(self.name, 'in_flight').set_function(
+            lambda: len(self.tasks))
+
+    async def __read_stream(self) -> AsyncGenerator[dict, None]:
+        """
+        Reads the stream with URL self.url, without blocking the event loop.
+
+        :returns: The last data streamed from self.url.
+        """
+        pprint(f"Reading {self.name} stream: {self.url}")
+        timeout = aiohttp.ClientTimeout(connect=self.timeout.connect)
+        reconnects = self.reconnect_counters()
+        while True:
+            url = self.url
+            if self.mtime:  # self.mtime is not None if the stream has been
+                # interrupted by an exception, after starting.
+                new_params = {'since_mtime': self.mtime}
+                url = add_url_params(url, new_params)
+            try:
+                async with self.session.get(url, timeout=timeout) as r:
+                    buffer = b''
+                    async for chunk in r.content.iter_any():
+                        buffer += chunk
+                        *lines, buffer = buffer.split(b'\n')
+                        for line in lines:
+                            line = line.strip()
+                            if line:
+                                # The data is coming in JSON format.
+                                json_data = self.decode_line(line)
+                                if 'mtime' in json_data:
+                                    self.mtime = json_data['mtime']
+                                yield json_data
+                reconnects['closed'].inc()
+            except (aiohttp.ClientPayloadError,
+                    aiohttp.ServerDisconnectedError):
+                reconnects['chunked'].inc()
+                note_error(self.prefix, 'stream interrupted')
+                log_struct = {'desc': 'Chunked error while reading stream.',
+                              'stream_url': url}
+                log_struct.update(get_exc_info_struct())
+                LOGGER.log_struct(log_struct, severity='NOTICE')
+                await asyncio.sleep(1)
+                continue
+            except Exception:
+                reconnects['error'].inc()
+                note_error(self.prefix, 'stream error')
+                log_struct = {'desc': 'Error while reading stream.',
+                              'stream_url': url}
+                log_struct.update(get_exc_info_struct())
+                pprint_struct(log_struct, pformat=BColors.FAIL)
+                LOGGER.log_struct(log_struct, severity='EMERGENCY')
+                await asyncio.sleep(1)
+                continue
 
-    class CloudFunctionError(Exception):
-        def __init__(self, status_code, response):
-            self.code = status_code,
-            self.response = response
+    async def trigger_cloud_functions(self):
+        """
+        Reads the stream and triggers the GCFs for storing the data streamed,
+        as well as the members' and groups' data.
+        """
+        q_size = 150
+        self.loop = asyncio.get_event_loop()
+        profile_age = self.configs[OptConfigs.profile_batch_age.value]
+        self.members_queue = BatchQueue(
+            func_trigger=self.queue_trigger(self.trigger_save_member_data,
+                                            SpoolKinds.member.value,
+                                            self.forget_member_ids,
+                                            self.profile_retry_policy,
+                                            self.profile_in_flight),
+            q_size=q_size,
+            max_age=profile_age)
+        self.groups_queue = BatchQueue(
+            func_trigger=self.queue_trigger(self.trigger_save_group_data,
+                                            SpoolKinds.group.value,
+                                            self.forget_group_ids,
+                                            self.profile_retry_policy,
+                                            self.profile_in_flight),
+            q_size=q_size,
+            max_age=profile_age)
+        batch_size = self.configs[OptConfigs.stream_batch_size.value]
+        if batch_size > 1:  # Send stream data to the GCF in batches.
+            self.stream_queue = BatchQueue(
+                func_trigger=self.queue_trigger(
+                    self.trigger_save_stream_data,
+                    SpoolKinds.stream.value,
+                    policy=self.stream_retry_policy),
+                q_size=batch_size,
+                max_age=self.configs[OptConfigs.stream_batch_age.value])
+        if self.spool and self.spool.recovered:
+            self.replay_task = asyncio.ensure_future(self.replay_spool())
+        self.register_metrics()
+        events = STREAM_EVENTS.labels(self.name)
+        while True:
+            stream = self.__read_stream()  # The stream generator.
+            async for data_item in stream:
+                events.inc()
+                ref = self.spool_append(SpoolKinds.stream.value, data_item)
+                if self.memory_budget is not None and \
+                        self.memory_budget.exceeded:
+                    await self.memory_budget.wait_async()
+                self.queue_linked_ids(data_item, self.members_queue,
+                                      self.groups_queue)
+                await self.save_data_item(data_item, ref)
+                self.notify_monitor()
+                if self.checkpoint and self.checkpoint.due:
+                    # Saving syncs the spool and the checkpoint file to
+                    # disk, which must not block the event loop.
+                    await self.loop.run_in_executor(None,
+                                                    self.checkpoint.save)
+
+    async def save_data_item(self, data_item: dict, ref: tuple = None):
+        """
+        The asyncio equivalent of ``MeetupStream.save_data_item``. The GCF
+        for storing ``data_item`` is dispatched, if stream data is not
+        batched.
 
-    class FatalCloudFunctionError(CloudFunctionError):
-        pass
+        :param data_item: A data item streamed from self.url.
+        :param ref: The reference of ``data_item`` in the spool.
+        """
+        entry = (ref, data_item)
+        if self.sink_data_item(entry):
+            return
+        if self.stream_queue:
+            self.stream_queue.add(entry)
+        else:
+            await self.dispatch(
+                self.trigger_save_stream_data, data_item,
+                on_failure=lambda _: self.fail_entries(
+                    SpoolKinds.stream.value, [entry], 'failed'),
+                on_success=functools.partial(self.ack_entries, [entry]),
+                policy=self.stream_retry_policy)
+
+    async def replay_spool(self):
+        """
+        The asyncio equivalent of ``MeetupStream.replay_spool``.
+        """
+        try:
+            for kind, item, ref in self.replayed_entries():
+                batch_queue = self.spool_queue(kind)
+                if batch_queue is not None:
+                    while batch_queue.pending >= batch_queue.q_size:
+                        await asyncio.sleep(0.1)
+                if kind == SpoolKinds.stream.value:
+                    await self.save_data_item(item, ref)
+                else:
+                    batch_queue.add((ref, item))
+        except Exception:
+            log_struct = {'desc': 'Error while replaying spooled data.',
+                          'stream_url': self.url}
+            log_struct.update(get_exc_info_struct())
+            LOGGER.log_struct(log_struct, severity='ERROR')
+
+    async def dispatch(self,
+                       api_call: Callable,
+                       *params,
+                       on_failure: Callable = None,
+                       on_success: Callable = None,
+                       policy: RetryPolicy = None,
+                       in_flight: asyncio.Semaphore = None):
+        """
+        Schedules ``api_call`` to be called with ``params``. If the number of
+        in-flight calls of this stream has reached its limit, waits until a
+        call is completed before scheduling.
+
+        :param api_call: A coroutine function to call.
+        :param params: The parameters of ``api_call``.
+        :param on_failure: A function called with ``params`` if all attempts
+            of calling ``api_call`` fail.
+        :param on_success: A function called without parameters if
+            ``api_call`` succeeds.
+        :param policy: The retry policy of ``api_call``.
+        :param in_flight: The semaphore bounding the in-flight calls of
+            ``api_call``. If None, self.in_flight is used.
+        """
+        in_flight = in_flight or self.in_flight
+        await in_flight.acquire()
+        task = asyncio.ensure_future(self.__run_dispatched(
+            api_call, params, on_failure, on_success, policy, in_flight))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def __run_dispatched(self,
+                               api_call: Callable,
+                               params: tuple,
+                               on_failure: Callable = None,
+                               on_success: Callable = None,
+                               policy: RetryPolicy = None,
+                               in_flight: asyncio.Semaphore = None):
+        try:
+            _, success = await async_attempt_func_call(
+                api_call, params=list(params), policy=policy,
+                ignored_exceptions=(self.FatalCloudFunctionError,),
+                tag=self.prefix)
+            if success and on_success:
+                on_success()
+            elif not success and on_failure:
+                on_failure(*params)
+        finally:
+            (in_flight or self.in_flight).release()
+
+    def queue_trigger(self,
+                      api_call: Callable,
+                      kind: str,
+                      on_failure: Callable = None,
+                      policy: RetryPolicy = None,
+                      in_flight: asyncio.Semaphore = None) -> Callable:
+        """
+        Returns a function that can be used as the trigger of a
+        *BatchQueue* of spool entries. The function is called by the
+        background thread of the queue, and dispatches ``api_call`` with the
+        items of the entries on the event loop of this stream. The entries
+        are acknowledged if the call succeeds. If it fails, the items that
+        were not saved are written to the dead-letter file.
+
+        :param api_call: A coroutine function to call with the queued items.
+        :param kind: The value of *SpoolKinds* of the items.
+        :param on_failure: A function called with the queued items if all
+            attempts of calling ``api_call`` fail.
+        :param policy: The retry policy of ``api_call``.
+        :param in_flight: The semaphore bounding the in-flight calls of
+            ``api_call``. If None, self.in_flight is used.
+        :return: A trigger for a *BatchQueue*.
+        """
+        batch_size = BATCH_SIZE.labels(api_call.__name__)
+
+        @functools.wraps(api_call)
+        def trigger(entries: list):
+            batch_size.observe(len(entries))
+            items = [item for _, item in entries]
+
+            def failed(failed_items: list):
+                if on_failure:
+                    on_failure(failed_items)
+                self.fail_entries(kind, entries, 'failed', failed=(
+                    failed_items if kind != SpoolKinds.stream.value
+                    else None))
+            future = asyncio.run_coroutine_threadsafe(
+                self.dispatch(
+                    api_call, items, on_failure=failed,
+                    on_success=functools.partial(self.ack_entries, entries),
+                    policy=policy, in_flight=in_flight),
+                self.loop)
+            self.scheduled.add(future)
+            future.add_done_callback(self.scheduled.discard)
+        return trigger
+
+    async def drain(self, timeout: float = None):
+        """
+        Waits for the calls scheduled by the batch queues, and the
+        dispatched calls of this stream, to complete.
 
-    class RetriableCloudFunctionError(CloudFunctionError):
-        pass
+        :param timeout: The maximum number of seconds to wait for each.
+        """
+        await asyncio.sleep(0)  # Let the scheduled calls start.
+        scheduled = [asyncio.wrap_future(f) for f in list(self.scheduled)]
+        if scheduled:
+            await asyncio.wait(scheduled, timeout=timeout)
+        if self.tasks:
+            await asyncio.wait(list(self.tasks), timeout=timeout)
+
+    async def trigger_http_gcf(self,
+                               url: str,
+                               data: dict = None,
+                               params: dict = None) -> Mapping:
+        gcf = self.gcf_names.get(url, 'other')
+        if params:
+            url = add_url_params(url, params)
+        body = encode_json(data) if data is not None else None
+        status = 'error'
+        started = time.monotonic()
+        try:
+            async with self.session.post(
+                    url, data=body, timeout=self.timeout,
+                    headers=JSON_HEADERS if body else None) as r:
+                status = r.status
+                self.raise_for_gcf_status(r.status, await r.text(),
+                                          r.headers)
+                return r.headers
+        finally:
+            self.observe_gcf_request(gcf, status, time.monotonic() - started)
+
+    async def trigger_save_stream_data(self, data: Union[dict, List[dict]]):
+        url, params = self.stream_gcf_request()
+        await self.trigger_http_gcf(url, data, params)
+
+    async def trigger_save_member_data(self, member_id: list):
+        await self.trigger_profile_gcf(self.member_gcf_request, member_id)
+
+    async def trigger_save_group_data(self, group_id: list):
+        await self.trigger_profile_gcf(self.group_gcf_request, group_id)
+
+    async def trigger_profile_gcf(self,
+                                  gcf_request: Callable,
+                                  ids: list):
+        url, params = gcf_request(ids)
+        if self.rate_limiter:
+            await self.rate_limiter.acquire_async(self.api_calls(ids))
+        try:
+            headers = await self.trigger_http_gcf(url, None, params)
+        except self.CloudFunctionError as e:
+            if self.rate_limiter:
+                self.rate_limiter.update(e.headers)
+            if isinstance(e, self.PartialCloudFunctionError) and \
+                    e.failed_ids:
+                ids[:] = e.failed_ids
+            raise
+        if self.rate_limiter:
+            self.rate_limiter.update(headers)
 
 
 class BColors(Enum):
@@ -247,44 +2687,117 @@ class BColors(Enum):
     UNDERLINE = '\033[4m'
 
 
+class ConsoleModes(Enum):
+    """
+    What the script prints to the console.
+    """
+    status = 'status'  # Messages, and a periodic status line per stream.
+    verbose = 'verbose'  # Also a message per batch, and a per-event title.
+    quiet = 'quiet'  # Nothing.
+
+
+CONSOLE_MODE = ConsoleModes.status.value  # Stores the console mode of this
+# process, which is set by ``configure_console``.
+EASTERN = pytz.timezone('US/Eastern')
+
+
 def pprint(text: str,
            pformat: Union[BColors, List[BColors], str] = BColors.OKWHITE,
            title: bool = False,
            timestamp: bool = True,
-           timezone: pytz.tzfile = pytz.timezone('US/Eastern')) -> None:
+           timezone: pytz.tzfile = EASTERN,
+           verbose: bool = False) -> None:
     """
-    Pretty prints the text in the specified format.
+    Pretty prints the text in the specified format. Nothing is formatted if
+    the text is not printed in the current console mode.
 
     :param text: the text to be printed.
     :param pformat: the format of the text.
     :param timestamp: Whether to add a timestamp to the beginning of text.
     :param timezone: The timezone of timestamp, if timestamp is True.
+    :param verbose: Whether the text is only printed in verbose mode.
     """
+    if CONSOLE_MODE == ConsoleModes.quiet.value or \
+            (verbose and CONSOLE_MODE != ConsoleModes.verbose.value):
+        return
     if not title:
-        style = output = ""
-        if isinstance(pformat, str):
-            style = getattr(BColors, pformat.upper())
-        elif isinstance(pformat, list):
-            for fmt in pformat:
-                style += fmt.value
-        else:
-            style = pformat.value
-
-        if timestamp:
-            ref_now = pytz.utc.localize(datetime.datetime.utcnow())
-            local_now = ref_now.astimezone(timezone)
-            now_str = local_now.strftime('%b %d, %H:%M:%S')
-            timestamp_style = BColors.UNDERLINE.value + \
-                              BColors.BOLD.value + \
-                              BColors.HEADER.value
-            output += timestamp_style + now_str + BColors.ENDC.value + " — "
-        output += style + text + BColors.ENDC.value
+        if isinstance(pformat, list):
+            pformat = tuple(pformat)
+        output = format_timestamp(int(time.time()), timezone) \
+            if timestamp else ""
+        output += get_style(pformat) + text + BColors.ENDC.value
         print(output, flush=True)
     else:
         output = f'\033]2;{text}\007'
         print(output, end='', flush=True)
 
 
+@functools.lru_cache(maxsize=64)
+def get_style(pformat: Union[BColors, Tuple[BColors, ...], str]) -> str:
+    """
+    :param pformat: A *BColors*, a tuple of them, or the name of one.
+    :return: The escape codes of ``pformat``.
+    """
+    if isinstance(pformat, str):
+        return getattr(BColors, pformat.upper()).value
+    if isinstance(pformat, tuple):
+        return ''.join(fmt.value for fmt in pformat)
+    return pformat.value
+
+
+@functools.lru_cache(maxsize=8)
+def format_timestamp(second: int, timezone: pytz.tzfile) -> str:
+    """
+    :param second: A UNIX timestamp in seconds.
+    :param timezone: The timezone of the timestamp.
+    :return: The formatted timestamp of ``pprint``. The timestamps of the
+        last few seconds are cached.
+    """
+    local_now = datetime.datetime.fromtimestamp(second, timezone)
+    timestamp_style = BColors.UNDERLINE.value + \
+        BColors.BOLD.value + \
+        BColors.HEADER.value
+    return timestamp_style + local_now.strftime('%b %d, %H:%M:%S') + \
+        BColors.ENDC.value + " — "
+
+
+class LocalLogger(object):
+    """
+    A logger with the interface of a Stackdriver Logger, which appends the
+    logs to a local file as JSON lines. Used for running the script offline,
+    e.g. by benchmark.py.
+    """
+
+    def __init__(self, path: str, logger_name: str = LOGGER_NAME):
+        """
+        Initializes an instance of class *LocalLogger*.
+
+        :param path: The path of the log file.
+        :param logger_name: The name of the logger.
+        """
+        self.path = path
+        self.name = logger_name
+        self.lock = threading.Lock()
+
+    def log_struct(self, info: dict, severity: str = None, **kwargs):
+        self.__write({'struct': info, 'severity': severity, **kwargs})
+
+    def log_text(self, text: str, severity: str = None, **kwargs):
+        self.__write({'text': text, 'severity': severity, **kwargs})
+
+    def __write(self, entry: dict):
+        """
+        Appends ``entry`` to the log file.
+
+        :param entry: A log entry.
+        """
+        entry = {'time': time.time(), 'logger': self.name, **entry}
+        line = json.dumps(entry, default=str) + '\n'
+        with self.lock:
+            with open(self.path, 'a') as log_file:
+                log_file.write(line)
+
+
 def __connect_gcl(logger_name: str) -> Logger:
     """
     Sets the ``GOOGLE_APPLICATION_CREDENTIALS`` environmental variable for
@@ -295,9 +2808,13 @@ def __connect_gcl(logger_name: str) -> Logger:
     :return: A Stackdriver Logger.
 
     .. note:: A google credentials file should exist in the current
-    directory with the name ``meetup-analysis.json``.
+    directory with the name ``meetup-analysis.json``. If the environmental
+    variable ``TRIGGER_GCF_LOG_FILE`` is set, a *LocalLogger* writing to
+    that file is returned instead.
     """
     pprint(f"Initiating {logger_name}...")
+    if os.environ.get(LOCAL_LOG_ENV):
+        return LocalLogger(os.environ[LOCAL_LOG_ENV], logger_name)
 
     try:
         logging_client = logging.Client()
@@ -319,26 +2836,48 @@ def __connect_gcl(logger_name: str) -> Logger:
     return logger
 
 
+def create_log_shipper(logger: Logger,
+                       configs: dict) -> Union[LogShipper, Logger]:
+    """
+    Wraps ``logger`` in a *LogShipper*, so that logs are written in the
+    background, in batches, and repeated logs are aggregated.
+
+    :param logger: A Stackdriver Logger or a *LocalLogger*.
+    :param configs: The configurations of the script.
+    :return: A *LogShipper*, or ``logger`` if the shipper is disabled.
+    """
+    configs = {**OPT_CONFIG_DEFAULTS, **configs}
+    buffer_size = configs[OptConfigs.log_buffer_size.value]
+    if buffer_size <= 0:
+        return logger
+    shipper = LogShipper(
+        logger=logger,
+        buffer_size=buffer_size,
+        batch_size=configs[OptConfigs.log_batch_size.value],
+        flush_interval=configs[OptConfigs.log_flush_interval.value],
+        aggregate_window=configs[OptConfigs.log_aggregate_window.value])
+    for state in shipper.stats():
+        LOG_SHIPPER.labels(state).set_function(
+            lambda state=state: shipper.stats()[state])
+    return shipper
+
+
 def attempt_func_call(api_call: Callable,
                       params: list = None,
-                      num_attempts: int = 50,
-                      base_sleep_time: float = 1,
-                      added_sleep_time: float = 1,
-                      max_sleep: float = 10,
+                      policy: RetryPolicy = None,
                       ignored_exceptions: tuple = (),
                       tag: str = None
                       ) -> Tuple[Any, bool]:
     """
     Attempts to call the *Callable* object ``api_call``. If the call fails,
-    the function sleeps for ``sleep_time`` milliseconds before attempting to
-    call ``api_call`` again. The function attempts to call ``api_call``
-    ``num_attempts`` times. If ``api_call`` fails because of an exception
-    included in ``ignored_exceptions``, ``api_call`` is not attempted again.
+    ``policy`` decides whether, and after how long, ``api_call`` is called
+    again. If ``api_call`` fails because of an exception included in
+    ``ignored_exceptions``, ``api_call`` is not attempted again.
 
     :param api_call: A Callable object to call.
-    :param num_attempts: The number of attempts for calling api_call.
-    :param sleep_time: The number of seconds to wait before each
-        reattempt.
+    :param params: The parameters of api_call.
+    :param policy: The retry policy of the call. If None,
+        ``DEFAULT_RETRY_POLICY`` is used.
     :param ignored_exceptions: A tuple of Exceptions. If these
         exceptions are thrown, api_call is not reattempted.
     :return: A Tuple containing the return value of api_call and
@@ -350,63 +2889,184 @@ def attempt_func_call(api_call: Callable,
         func_str = f'{api_call.__name__}({func_params})'
     except Exception:
         func_str = str(api_call)
+    metric_name = getattr(api_call, '__name__', 'other')
+    policy = policy or DEFAULT_RETRY_POLICY
+    started = time.monotonic()
 
-    for attempt in range(num_attempts):
+    attempt = 0
+    while True:
         try:
             obj = api_call(*params)
+            policy.on_success()
             if attempt:
-                log_struct = {
-                    'desc': f'Successfully called the function.',
-                    'attempts': attempt + 1,
-                    'api_call': func_str,
-                    'tag': tag or str(params)}
-                pprint(f'{log_struct["desc"]}\n%s' % pretty_json(log_struct),
-                       pformat=BColors.OKGREEN)
-                if LOGGER:
-                    LOGGER.log_struct(log_struct, severity='INFO')
+                log_retry_success(func_str, attempt, tag or str(params))
             return obj, True
         except ignored_exceptions:
-            log_struct = {
-                'desc': f'Function call failed and was ignored!',
-                'api_call': func_str,
-                'tag': tag or str(params)}
-            log_struct.update(get_exc_info_struct())
-            pprint(f'{log_struct["desc"]}\n%s' % pretty_json(log_struct),
-                   pformat=BColors.FAIL)
-            if LOGGER:  # Log exceptions to Stackdriver-Logging.
-                LOGGER.log_struct(log_struct, severity='WARNING')
+            CALL_FAILURES.labels(metric_name, 'ignored').inc()
+            log_ignored_failure(func_str, tag or str(params))
             return None, False
         except Exception:
             if not attempt:
-                log_struct = {
-                    'desc': f'API method call attempt was unsuccessful!',
-                    'api_call': func_str,
-                    'tag': tag or 'N/A'}
-                log_struct.update(get_exc_info_struct())
-                pprint(f'{log_struct["desc"]}\n%s' % pretty_json(log_struct),
-                       pformat=BColors.WARNING)
-                if LOGGER:
-                    LOGGER.log_struct(log_struct, severity='WARNING')
-                time.sleep(min(base_sleep_time + added_sleep_time * attempt,
-                               max_sleep))
-            continue
+                log_attempt_failure(func_str, tag)
+            sleep_time, reason = policy.next_sleep(attempt, started)
+            if sleep_time is None:
+                break
+            time.sleep(sleep_time)
+            attempt += 1
+            CALL_RETRIES.labels(metric_name).inc()
+
+    CALL_FAILURES.labels(metric_name, reason).inc()
+    log_call_failure(func_str, attempt, reason, tag or str(params))
+    return None, False
+
+
+async def async_attempt_func_call(api_call: Callable,
+                                  params: list = None,
+                                  policy: RetryPolicy = None,
+                                  ignored_exceptions: tuple = (),
+                                  tag: str = None
+                                  ) -> Tuple[Any, bool]:
+    """
+    The asyncio equivalent of ``attempt_func_call``. ``api_call`` should be
+    a coroutine function. The event loop is not blocked while sleeping
+    between attempts.
+
+    :param api_call: A coroutine function to call.
+    :param params: The parameters of api_call.
+    :param policy: The retry policy of the call. If None,
+        ``DEFAULT_RETRY_POLICY`` is used.
+    :param ignored_exceptions: A tuple of Exceptions. If these
+        exceptions are thrown, api_call is not reattempted.
+    :return: A Tuple containing the return value of api_call and
+        whether the call was successful. If the call was not successful,
+        None is returned as the return value of api_call.
+    """
+    func_str = getattr(api_call, '__name__', str(api_call))
+    metric_name = getattr(api_call, '__name__', 'other')
+    policy = policy or DEFAULT_RETRY_POLICY
+    started = time.monotonic()
+
+    attempt = 0
+    while True:
+        try:
+            obj = await api_call(*params)
+            policy.on_success()
+            if attempt:
+                log_retry_success(func_str, attempt, tag or str(params))
+            return obj, True
+        except ignored_exceptions:
+            CALL_FAILURES.labels(metric_name, 'ignored').inc()
+            log_ignored_failure(func_str, tag or str(params))
+            return None, False
+        except Exception:
+            if not attempt:
+                log_attempt_failure(func_str, tag)
+            sleep_time, reason = policy.next_sleep(attempt, started)
+            if sleep_time is None:
+                break
+            await asyncio.sleep(sleep_time)
+            attempt += 1
+            CALL_RETRIES.labels(metric_name).inc()
+
+    CALL_FAILURES.labels(metric_name, reason).inc()
+    log_call_failure(func_str, attempt, reason, tag or str(params))
+    return None, False
+
+
+def log_retry_success(func_str: str, attempt: int, tag: str):
+    """
+    Logs that a function call succeeded after failed attempts.
+
+    :param func_str: A description of the function called.
+    :param attempt: The number of the successful attempt, starting from 0.
+    :param tag: A tag for the log.
+    """
+    log_struct = {
+        'desc': f'Successfully called the function.',
+        'attempts': attempt + 1,
+        'api_call': func_str,
+        'tag': tag}
+    pprint_struct(log_struct, pformat=BColors.OKGREEN)
+    if LOGGER:
+        LOGGER.log_struct(log_struct, severity='INFO')
+
+
+def log_ignored_failure(func_str: str, tag: str):
+    """
+    Logs a function call that failed with an ignored exception. Should be
+    called while the exception is being handled.
+
+    :param func_str: A description of the function called.
+    :param tag: A tag for the log.
+    """
+    log_struct = {
+        'desc': f'Function call failed and was ignored!',
+        'api_call': func_str,
+        'tag': tag}
+    log_struct.update(get_exc_info_struct())
+    note_error(tag, f'{func_str} failed: {sys.exc_info()[0].__name__}')
+    pprint_struct(log_struct, pformat=BColors.FAIL)
+    if LOGGER:  # Log exceptions to Stackdriver-Logging.
+        LOGGER.log_struct(log_struct, severity='WARNING')
+
+
+def log_attempt_failure(func_str: str, tag: str):
+    """
+    Logs the first failed attempt of a function call. Should be called
+    while the exception is being handled.
+
+    :param func_str: A description of the function called.
+    :param tag: A tag for the log.
+    """
+    log_struct = {
+        'desc': f'API method call attempt was unsuccessful!',
+        'api_call': func_str,
+        'tag': tag or 'N/A'}
+    log_struct.update(get_exc_info_struct())
+    note_error(tag, f'{func_str} failed: {sys.exc_info()[0].__name__}')
+    pprint_struct(log_struct, pformat=BColors.WARNING)
+    if LOGGER:
+        LOGGER.log_struct(log_struct, severity='WARNING')
+
+
+def log_call_failure(func_str: str, attempt: int, reason: str, tag: str):
+    """
+    Logs a function call that was given up on.
 
+    :param func_str: A description of the function called.
+    :param attempt: The number of the last failed attempt, starting from 0.
+    :param reason: The reason for not retrying the call again.
+    :param tag: A tag for the log.
+    """
     log_struct = {
         'desc': f'Failed to call API method!',
-        'attempts': num_attempts,
+        'attempts': attempt + 1,
+        'reason': reason,
         'api_call': func_str,
-        'tag': tag or str(params)}
+        'tag': tag}
+    note_error(tag, f'{func_str} given up: {reason}')
     if LOGGER:
         LOGGER.log_struct(log_struct, severity='ALERT')
-    pprint(f'{log_struct["desc"]}\n%s' % pretty_json(log_struct),
-           pformat=BColors.FAIL)
-    return None, False
+    pprint_struct(log_struct, pformat=BColors.FAIL)
+
+
+def note_error(tag: str, summary: str):
+    """
+    Remembers the last error of a stream, for its console status line.
+
+    :param tag: The label of the stream.
+    :param summary: A short description of the error.
+    """
+    LAST_ERRORS[tag] = (time.time(), summary)
 
 
 def get_exc_info_struct() -> dict:
     """
     Returns a dictionary containing information about the exception that is
-    currently being handled.
+    currently being handled. Exceptions are fingerprinted by their type and
+    traceback, and the traceback is only included the first time a
+    fingerprint occurs in each ``exc_summary_window``. Afterwards, the
+    number of occurrences in the window is included instead.
 
     :return: A dictionary containing information about the exception that is
         currently being handled.
@@ -414,10 +3074,11 @@ def get_exc_info_struct() -> dict:
     try:
         exc_type, exc_obj, tb = sys.exc_info()
         args = exc_obj.args
-        params = inspect.signature(exc_obj.__init__).parameters
-        trace = traceback.format_exc()
+        params = EXC_SUMMARIES.parameter_names(exc_obj)
+        summary = EXC_SUMMARIES.summarize(exc_type, exc_obj, tb)
 
         exc_struct = {
+            'fingerprint': summary['fingerprint'],
             'exc_info': {
                 'exc_type': str(exc_type),
                 'exc_args': {
@@ -432,9 +3093,12 @@ def get_exc_info_struct() -> dict:
                         )
                     for i, key in enumerate(params)
                 },
-                'traceback': f'{{\n{trace}\n}}'
+                'occurrences': summary['occurrences']
             }
         }
+        if 'traceback' in summary:
+            exc_struct['exc_info']['traceback'] = \
+                f'{{\n{summary["traceback"]}\n}}'
     except Exception as e:
         pprint(f'Error while getting exception info: {str(e)}',
                pformat=BColors.WARNING)
@@ -446,11 +3110,24 @@ def get_exc_info_struct() -> dict:
     return exc_struct
 
 
+def pprint_struct(log_struct: dict, **kwargs):
+    """
+    Pretty prints the description of ``log_struct`` followed by its JSON.
+    The JSON is only formatted if it is printed in the current console mode.
+
+    :param log_struct: A structured log with a 'desc' field.
+    :param kwargs: The other parameters of ``pprint``.
+    """
+    if CONSOLE_MODE == ConsoleModes.quiet.value or \
+            (kwargs.get('verbose') and
+             CONSOLE_MODE != ConsoleModes.verbose.value):
+        return
+    pprint(f'{log_struct["desc"]}\n%s' % pretty_json(log_struct), **kwargs)
+
+
 def pretty_json(json_dict):
-    pj = codecs.decode(json.dumps(json_dict, indent=4), 'unicode_escape')
-    # for key in
-    #     return pretty_j
-    return pj
+    return json.dumps(json_dict, indent=4, ensure_ascii=False,
+                      default=str).replace('\\n', '\n').replace('\\"', '"')
 
 
 def add_url_params(url: str,
@@ -482,29 +3159,466 @@ def add_url_params(url: str,
             'url': url,
             'params': params}
         log_struct.update(get_exc_info_struct())
-        pprint("Error while adding URL params.\n%s" %
-               json.dumps(log_struct, indent=4).replace('\\n', '\n'),
-               pformat=BColors.WARNING)
+        pprint_struct(log_struct, pformat=BColors.WARNING)
         LOGGER.log_struct(log_struct, severity='ERROR')
 
     return new_url
 
 
+def create_seen_cache(configs: dict) -> Union[SeenCache, None]:
+    """
+    Creates the cache of recently queued member and group IDs, which is
+    shared between all streams.
+
+    :param configs: The configurations of the script.
+    :return: A *SeenCache*, or None if the cache is disabled.
+    """
+    configs = {**OPT_CONFIG_DEFAULTS, **configs}
+    max_size = configs[OptConfigs.seen_cache_size.value]
+    if max_size <= 0:
+        return None
+    return SeenCache(max_size=max_size,
+                     ttl=configs[OptConfigs.seen_cache_ttl.value])
+
+
+def create_rate_limiter(configs: dict) -> Union[RateLimiter, None]:
+    """
+    Creates the rate limiter of the meetup API calls, which is shared
+    between all streams.
+
+    :param configs: The configurations of the script.
+    :return: A *RateLimiter*, or None if the ``meetup_rate_limit`` config
+        is not positive.
+    """
+    configs = {**OPT_CONFIG_DEFAULTS, **configs}
+    if configs[OptConfigs.meetup_rate_limit.value] <= 0:
+        return None
+    return RateLimiter(rate=configs[OptConfigs.meetup_rate_limit.value],
+                       capacity=configs[OptConfigs.meetup_rate_burst.value])
+
+
+def create_retry_budget(configs: dict) -> Union[RetryBudget, None]:
+    """
+    Creates the retry budget of the GCF calls, which is shared between all
+    streams.
+
+    :param configs: The configurations of the script.
+    :return: A *RetryBudget*, or None if the budget is disabled.
+    """
+    configs = {**OPT_CONFIG_DEFAULTS, **configs}
+    max_tokens = configs[OptConfigs.retry_budget_size.value]
+    if max_tokens <= 0:
+        return None
+    token_ratio = configs[OptConfigs.retry_budget_ratio.value]
+    return RetryBudget(max_tokens=max_tokens, token_ratio=token_ratio)
+
+
+def create_archive_writer(configs: dict) -> Union[ArchiveWriter, None]:
+    """
+    Creates the writer of the archive files of stream data, which is shared
+    between all streams. If the ``archive_bucket`` config is set, the
+    archive files are uploaded to it once they are closed. An upload is
+    retried for at most ``archive_upload_deadline`` seconds, after which the
+    file is kept on disk and uploaded on the next startup.
+
+    :param configs: The configurations of the script.
+    :return: An *ArchiveWriter*, or None if the ``stream_sink`` config does
+        not include the archive.
+    """
+    configs = {**OPT_CONFIG_DEFAULTS, **configs}
+    if StreamSinks.archive.value not in get_stream_sinks(configs):
+        return None
+    uploader = None
+    bucket_name = configs[OptConfigs.archive_bucket.value]
+    if bucket_name:
+        bucket = storage.Client().bucket(bucket_name)
+        policy = RetryPolicy(
+            num_attempts=configs[OptConfigs.retry_attempts.value],
+            base_sleep=configs[OptConfigs.retry_base_sleep.value],
+            max_sleep=configs[OptConfigs.retry_max_sleep.value],
+            deadline=configs[OptConfigs.archive_upload_deadline.value])
+
+        def uploader(path: str, name: str) -> bool:
+            _, success = attempt_func_call(upload_archive_file,
+                                           params=[bucket, path, name],
+                                           policy=policy,
+                                           tag='archive')
+            return success
+    return ArchiveWriter(
+        directory=configs[OptConfigs.archive_dir.value],
+        file_format=configs[OptConfigs.archive_format.value],
+        max_rows=configs[OptConfigs.archive_max_rows.value],
+        grace=configs[OptConfigs.archive_grace.value],
+        uploader=uploader,
+        logger=LOGGER,
+        discard_uncommitted=bool(configs[OptConfigs.spool_dir.value]))
+
+
+def create_bq_loader(configs: dict) -> Union[BigQueryLoader, None]:
+    """
+    Creates the loader of stream data into BigQuery, which is shared between
+    all streams.
+
+    :param configs: The configurations of the script.
+    :return: A *BigQueryLoader*, or None if the ``stream_sink`` config does
+        not include BigQuery.
+    """
+    configs = {**OPT_CONFIG_DEFAULTS, **configs}
+    if StreamSinks.bigquery.value not in get_stream_sinks(configs):
+        return None
+    mode = configs[OptConfigs.bq_mode.value]
+    if not configs[OptConfigs.bq_dataset.value] and \
+            mode != LoadModes.dry_run.value:
+        raise ValueError(f'{OptConfigs.bq_dataset.value} is required for '
+                         f'loading stream data into BigQuery.')
+
+    policy = RetryPolicy(
+        num_attempts=configs[OptConfigs.retry_attempts.value],
+        base_sleep=configs[OptConfigs.retry_base_sleep.value],
+        max_sleep=configs[OptConfigs.retry_max_sleep.value],
+        deadline=configs[OptConfigs.bq_retry_deadline.value])
+
+    def attempt(func: Callable, params: list) -> bool:
+        _, success = attempt_func_call(func, params=params, policy=policy,
+                                       tag='bigquery')
+        return success
+    return BigQueryLoader(
+        dataset=configs[OptConfigs.bq_dataset.value] or 'dry_run',
+        mode=mode,
+        max_rows=configs[OptConfigs.bq_batch_rows.value],
+        max_bytes=configs[OptConfigs.bq_batch_bytes.value],
+        max_age=configs[OptConfigs.bq_batch_age.value],
+        table_prefix=configs[OptConfigs.bq_table_prefix.value],
+        dry_run_dir=configs[OptConfigs.bq_dry_run_dir.value],
+        attempt=attempt,
+        logger=LOGGER)
+
+
+def create_memory_budget(configs: dict) -> Union[MemoryBudget, None]:
+    """
+    Creates the memory ceiling shared by all streams of this process. The
+    backlog of the budget is the number of data items and IDs queued, or in
+    flight, in all streams of the process. While the budget is exceeded,
+    the batch queues are flushed without waiting for full batches.
+
+    :param configs: The configurations of the script.
+    :return: A *MemoryBudget*, or None if the ceiling is disabled.
+    """
+    configs = {**OPT_CONFIG_DEFAULTS, **configs}
+    limit = configs[OptConfigs.memory_limit_mib.value]
+    if not limit:
+        return None
+
+    def backlog() -> int:
+        total = 0
+        for stream in list(MeetupStream.instances):
+            total += stream.queue_depth + len(getattr(stream, 'tasks', ()))
+            total += sum(batch_queue.pending for batch_queue in (
+                stream.stream_queue, stream.members_queue,
+                stream.groups_queue) if batch_queue is not None)
+        return total
+
+    memory_budget = MemoryBudget(
+        limit=int(limit * 1024 * 1024),
+        high_water=configs[OptConfigs.memory_high_water.value],
+        low_water=configs[OptConfigs.memory_low_water.value],
+        backlog=backlog,
+        relieve=lambda: [batch_queue.flush()
+                         for batch_queue in list(BatchQueue.instances)])
+    MEMORY.labels('limit').set(memory_budget.limit)
+    MEMORY.labels('exceeded').set_function(
+        lambda: int(memory_budget.exceeded))
+    return memory_budget
+
+
+def create_entity_index(configs: dict) -> Union[EntityIndex, None]:
+    """
+    Creates the index of the entities linked by the data items of all
+    streams of this process. The index is saved to a snapshot file inside
+    the ``entity_index_dir`` folder, and loaded from it on startup.
+
+    :param configs: The configurations of the script.
+    :return: An *EntityIndex*, or None if the index is disabled.
+    """
+    configs = {**OPT_CONFIG_DEFAULTS, **configs}
+    if not configs[OptConfigs.entity_index.value]:
+        return None
+    directory = configs[OptConfigs.entity_index_dir.value]
+    entity_index = EntityIndex(
+        path=(os.path.join(directory, 'entity_index.json.gz')
+              if directory else None),
+        interval=configs[OptConfigs.entity_index_interval.value],
+        logger=LOGGER)
+    for kind in EntityKinds:
+        ENTITIES.labels(kind.value).set_function(functools.partial(
+            lambda k: len(entity_index.tables[k]), kind.value))
+    return entity_index
+
+
+def create_stream_aggregates(configs: dict) \
+        -> Union[StreamAggregates, None]:
+    """
+    Creates the windowed aggregates of the data items of all streams of
+    this process.
+
+    :param configs: The configurations of the script.
+    :return: A *StreamAggregates*, or None if the aggregates are disabled.
+    """
+    configs = {**OPT_CONFIG_DEFAULTS, **configs}
+    if not configs[OptConfigs.aggregates.value]:
+        return None
+    return StreamAggregates(
+        bucket_seconds=configs[OptConfigs.aggregate_bucket_seconds.value],
+        num_buckets=configs[OptConfigs.aggregate_buckets.value],
+        top_k=configs[OptConfigs.aggregate_top_k.value])
+
+
+def upload_archive_file(bucket: storage.Bucket,
+                        path: str,
+                        name: str):
+    """
+    Uploads an archive file to a GCS bucket.
+
+    :param bucket: The GCS bucket to upload the file to.
+    :param path: The local path of the file.
+    :param name: The name of the file inside the bucket.
+    """
+    content_type = 'application/gzip' \
+        if name.endswith(ArchiveFormats.ndjson_gz.value) \
+        else 'application/octet-stream'
+    bucket.blob(name).upload_from_filename(path, content_type=content_type)
+
+
+def start_metrics(configs: dict,
+                  routes: Mapping[str, Callable] = None) \
+        -> Union[MetricsServer, None]:
+    """
+    Starts the scrape endpoint of the metrics of this process, and the
+    thread that periodically logs them, if they are enabled.
+
+    :param configs: The configurations of the script.
+    :param routes: The JSON endpoints served along with the metrics, as
+        returned by ``get_api_routes``.
+    :return: The server of the scrape endpoint, or None if it is disabled
+        or could not be started.
+    """
+    configs = {**OPT_CONFIG_DEFAULTS, **configs}
+    interval = configs[OptConfigs.metrics_log_interval.value]
+    if interval > 0:
+        threading.Thread(target=log_metrics, args=(interval,),
+                         name='metrics-logger', daemon=True).start()
+    port = configs[OptConfigs.metrics_port.value]
+    if not port:
+        return None
+    try:
+        server = MetricsServer(port=port,
+                               host=configs[OptConfigs.metrics_host.value],
+                               routes=dict(routes or {}))
+    except OSError:
+        log_struct = {'desc': 'Failed to start the metrics endpoint.',
+                      'port': port}
+        log_struct.update(get_exc_info_struct())
+        pprint_struct(log_struct, pformat=BColors.WARNING)
+        LOGGER.log_struct(log_struct, severity='WARNING')
+        return None
+    pprint(f"Serving metrics on http://{server.server.server_address[0]}:"
+           f"{server.port}/metrics")
+    return server
+
+
+def get_api_routes(entity_index: EntityIndex = None,
+                   stream_aggregates: StreamAggregates = None) \
+        -> Mapping[str, Callable]:
+    """
+    :param entity_index: The entity index of this process.
+    :param stream_aggregates: The windowed aggregates of this process.
+    :return: The JSON endpoints served along with the metrics:
+        ``/entities?kind=member&id=1&related=group`` lists the entities of
+        kind ``related`` linked to an entity (optionally ``via`` another
+        kind, and at most ``limit`` of them), ``/entities?kind=member&id=1``
+        counts the entities linked to it, and ``/entities/stats`` returns
+        the stats of the index. ``/trends?label=rsvps&window=600`` returns
+        the aggregates of the last ``window`` seconds (optionally of a
+        ``mode``, ``dimension`` and ``value``, with ``k`` values per
+        dimension).
+    """
+    routes = {}
+    if stream_aggregates is not None:
+
+        def query_trends(params: Mapping[str, str]) -> dict:
+            try:
+                window = float(params['window']) \
+                    if 'window' in params else None
+                k = int(params['k']) if 'k' in params else None
+            except ValueError:
+                raise ValueError('"window" and "k" should be numbers.')
+            return stream_aggregates.query(
+                label=params.get('label'),
+                window=window,
+                mode=params.get('mode', WindowModes.sliding.value),
+                dimension=params.get('dimension'),
+                value=params.get('value'),
+                k=k)
+        routes['/trends'] = query_trends
+    if entity_index is None:
+        return routes
+
+    def query_entities(params: Mapping[str, str]) -> dict:
+        kind, entity_id = params.get('kind'), params.get('id')
+        if not kind or not entity_id:
+            raise ValueError('"kind" and "id" are required.')
+        response = {'kind': kind, 'id': entity_id}
+        related_kind = params.get('related')
+        if not related_kind:
+            response['degrees'] = entity_index.degrees(kind, entity_id)
+            return response
+        try:
+            limit = int(params.get('limit', 100))
+        except ValueError:
+            raise ValueError('"limit" should be an integer.')
+        related = entity_index.related(kind, entity_id, related_kind,
+                                       via=params.get('via'), limit=limit)
+        response['related'] = [{'id': related_id, 'count': count}
+                               for related_id, count in related]
+        return response
+    return {**routes,
+            '/entities': query_entities,
+            '/entities/stats': lambda params: entity_index.stats()}
+
+
+def log_metrics(interval: float):
+    """
+    Logs the metrics of this process every ``interval`` seconds.
+
+    :param interval: The number of seconds between two logs.
+    """
+    while True:
+        time.sleep(interval)
+        log_struct = {'desc': 'Metrics.', 'pid': os.getpid()}
+        log_struct.update(REGISTRY.snapshot())
+        LOGGER.log_struct(log_struct, severity='INFO')
+
+
+def configure_console(configs: dict):
+    """
+    Sets the console mode of this process, using the ``console_mode``
+    config.
+
+    :param configs: The configurations of the script.
+    """
+    global CONSOLE_MODE
+    CONSOLE_MODE = ConsoleModes(configs.get(
+        OptConfigs.console_mode.value,
+        OPT_CONFIG_DEFAULTS[OptConfigs.console_mode.value])).value
+
+
+def configure_exc_summaries(configs: dict):
+    """
+    Sets the window of the exception summaries of this process, using the
+    ``exc_summary_window`` config.
+
+    :param configs: The configurations of the script.
+    """
+    EXC_SUMMARIES.window = configs.get(
+        OptConfigs.exc_summary_window.value,
+        OPT_CONFIG_DEFAULTS[OptConfigs.exc_summary_window.value])
+
+
+def start_console_reporter(configs: dict):
+    """
+    Starts the thread printing the status lines of the streams of this
+    process, if the console mode is 'status'.
+
+    :param configs: The configurations of the script.
+    """
+    interval = configs.get(
+        OptConfigs.console_interval.value,
+        OPT_CONFIG_DEFAULTS[OptConfigs.console_interval.value])
+    if CONSOLE_MODE == ConsoleModes.status.value and interval > 0:
+        threading.Thread(target=report_console, args=(interval,),
+                         name='console-reporter', daemon=True).start()
+
+
+def report_console(interval: float):
+    """
+    Prints a status line for each stream of this process every
+    ``interval`` seconds, with its rate of events, the number of items
+    waiting in its queues, its lag, and its last error. The terminal title
+    is updated with the time of the report.
+
+    :param interval: The number of seconds between two reports.
+    """
+    last_counts = {}
+    last_report = time.monotonic()
+    while True:
+        time.sleep(interval)
+        now = time.monotonic()
+        elapsed, last_report = now - last_report, now
+        for stream in sorted(MeetupStream.instances, key=lambda s: s.name):
+            count = STREAM_EVENTS.labels(stream.name).get()
+            rate = (count - last_counts.get(stream.name, 0)) / elapsed
+            last_counts[stream.name] = count
+            queued = stream.queue_depth + (
+                stream.stream_queue.pending if stream.stream_queue else 0)
+            queued_ids = sum(batch_queue.pending for batch_queue in (
+                stream.members_queue, stream.groups_queue)
+                if batch_queue is not None)
+            line = f'{stream.name}: {rate:.1f} events/s, {queued} queued, ' \
+                   f'{queued_ids} IDs queued'
+            if stream.mtime:
+                line += f', lag {time.time() - stream.mtime / 1000:.1f}s'
+            error_time, error = LAST_ERRORS.get(stream.prefix, (0, None))
+            recent = time.time() - error_time < interval
+            if error:
+                error_str = datetime.datetime.fromtimestamp(
+                    error_time, EASTERN).strftime('%H:%M:%S')
+                line += f', last error at {error_str}: {error}'
+            pprint(line, pformat=BColors.WARNING if recent else BColors.OKBLUE)
+        pprint(str(int(time.time())), title=True)
+
+
 def write_stream(stream_url: str,
-                 configs: dict):
+                 configs: dict,
+                 seen_cache: SeenCache = None,
+                 rate_limiter: RateLimiter = None,
+                 retry_budget: RetryBudget = None,
+                 archive_writer: ArchiveWriter = None,
+                 bq_loader: BigQueryLoader = None,
+                 memory_budget: MemoryBudget = None,
+                 entity_index: EntityIndex = None,
+                 stream_aggregates: StreamAggregates = None):
     """
-    Creates an instance of *HttpStream* and triggers its GCF.
+    Creates an instance of *MeetupStream* and triggers its GCFs.
 
     :param stream_url: The URL to stream.
-    :param http_url: The URL of the google cloud function to
-        trigger.
-    :param bucket_name: The name of the google cloud storage
-        bucket for storing stream data.
-    :param prefix: A label for describing the type of data
-        that is being streamed.
+    :param configs: The configurations of the script.
+    :param seen_cache: A cache of the member and group IDs that were
+        recently queued, shared between streams.
+    :param rate_limiter: A rate limiter for the meetup API calls, shared
+        between streams.
+    :param retry_budget: A retry budget for the GCF calls, shared between
+        streams.
+    :param archive_writer: A writer of the archive files of stream data,
+        shared between streams.
+    :param bq_loader: A loader of stream data into BigQuery, shared between
+        streams.
+    :param memory_budget: The memory ceiling of the process, shared between
+        streams.
+    :param entity_index: The index of the entities linked by the data
+        items, shared between streams.
+    :param stream_aggregates: The windowed aggregates of the data items,
+        shared between streams.
     """
     meetup_stream = MeetupStream(url=stream_url,
-                                 configs=configs)
+                                 configs=configs,
+                                 seen_cache=seen_cache,
+                                 rate_limiter=rate_limiter,
+                                 retry_budget=retry_budget,
+                                 archive_writer=archive_writer,
+                                 bq_loader=bq_loader,
+                                 memory_budget=memory_budget,
+                                 entity_index=entity_index,
+                                 stream_aggregates=stream_aggregates)
     meetup_stream.trigger_cloud_functions()
 
 
@@ -512,41 +3626,373 @@ def save_data(stream_urls: List[str],
               configs: dict) -> None:
     """
     Creates a thread for each url in **stream_urls** and calls the
-    ``write_stream`` function to save stream data in a GCS bucket named
-    **bucket_name**, by triggering an http-triggered GCF with url
-    **http_url**. The function waits for all threads to finish before
-    exiting.
+    ``write_stream`` function to save stream data, using the sinks of the
+    ``stream_sink`` config. The function waits for all threads to finish
+    before exiting.
 
     :param stream_urls: The URLs to stream.
-    :param http_url: The URL of the google cloud function to
-        trigger.
-    :param bucket_name: The name of the google cloud storage
-        bucket for storing stream data.
+    :param configs: The configurations of the script.
     """
     pprint("Connecting to data streams...")
+    seen_cache = create_seen_cache(configs)
+    rate_limiter = create_rate_limiter(configs)
+    retry_budget = create_retry_budget(configs)
+    archive_writer = create_archive_writer(configs)
+    bq_loader = create_bq_loader(configs)
+    memory_budget = create_memory_budget(configs)
+    entity_index = create_entity_index(configs)
+    stream_aggregates = create_stream_aggregates(configs)
+    start_metrics(configs, routes=get_api_routes(entity_index,
+                                                 stream_aggregates))
+    start_console_reporter(configs)
     threads = []
     for url in stream_urls:
-        threads.append(threading.Thread(target=write_stream,
-                                        args=(url, configs)))
+        threads.append(threading.Thread(
+            target=write_stream,
+            args=(url, configs, seen_cache, rate_limiter, retry_budget,
+                  archive_writer, bq_loader, memory_budget, entity_index,
+                  stream_aggregates),
+            daemon=True))
     for t in threads:
         t.start()
-    for t in threads:
-        t.join()
+    try:
+        for t in threads:
+            t.join()
+    finally:
+        flush_on_shutdown(configs)
 
 
-def main():
-    pprint("——— Starting ———",
-           pformat=[BColors.TITLE, BColors.BOLD], timestamp=False)
+async def save_data_async(stream_urls: List[str],
+                          configs: dict) -> None:
+    """
+    Reads all streams in **stream_urls** concurrently on a single asyncio
+    event loop, and triggers the GCFs for storing their data. A slow stream
+    or GCF does not stall the other streams.
+
+    :param stream_urls: The URLs to stream.
+    :param configs: The configurations of the script.
+    """
+    pprint("Connecting to data streams...")
+    pool_size = configs.get(
+        OptConfigs.http_pool_size.value,
+        OPT_CONFIG_DEFAULTS[OptConfigs.http_pool_size.value])
+    # The GCFs share a host, so the pool is sized for all streams.
+    connector = aiohttp.TCPConnector(
+        limit=0, limit_per_host=pool_size * len(stream_urls))
+    seen_cache = create_seen_cache(configs)
+    rate_limiter = create_rate_limiter(configs)
+    retry_budget = create_retry_budget(configs)
+    archive_writer = create_archive_writer(configs)
+    bq_loader = create_bq_loader(configs)
+    memory_budget = create_memory_budget(configs)
+    entity_index = create_entity_index(configs)
+    stream_aggregates = create_stream_aggregates(configs)
+    start_metrics(configs, routes=get_api_routes(entity_index,
+                                                 stream_aggregates))
+    start_console_reporter(configs)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        streams = [AsyncMeetupStream(url=url, configs=configs,
+                                     session=session, seen_cache=seen_cache,
+                                     rate_limiter=rate_limiter,
+                                     retry_budget=retry_budget,
+                                         archive_writer=archive_writer,
+                                     bq_loader=bq_loader,
+                                     memory_budget=memory_budget,
+                                     entity_index=entity_index,
+                                     stream_aggregates=stream_aggregates)
+                   for url in stream_urls]
+        try:
+            await asyncio.gather(*[stream.trigger_cloud_functions()
+                                   for stream in streams])
+        finally:
+            flush_on_shutdown(configs)
+            await asyncio.gather(*[stream.drain(timeout=configs.get(
+                OptConfigs.shutdown_timeout.value,
+                OPT_CONFIG_DEFAULTS[OptConfigs.shutdown_timeout.value]))
+                for stream in streams])
+            ArchiveWriter.close_all()
+            BigQueryLoader.close_all()
+            Checkpoint.save_all()
+            EntityIndex.close_all()
+
+
+def run_worker(stream_urls: List[str],
+               configs: dict,
+               stats_queue: multiprocessing.Queue):
+    """
+    The entry point of a worker process. Processes ``stream_urls`` using the
+    ``worker_engine`` config, and periodically puts the stats of its
+    streams in ``stats_queue``.
 
+    :param stream_urls: The URLs of the streams processed by the worker.
+    :param configs: The configurations of the worker.
+    :param stats_queue: The queue of the stats read by the supervisor.
+    """
     global LOGGER
-    LOGGER = __connect_gcl(LOGGER_NAME)
-    with open('../config.json') as json_configs_file:
+    configure_console(configs)
+    configure_exc_summaries(configs)
+    LOGGER = create_log_shipper(__connect_gcl(LOGGER_NAME), configs)
+    # The supervisor stops its workers with SIGTERM, even on ctrl-c.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    threading.Thread(
+        target=report_stats,
+        args=(stats_queue, configs[OptConfigs.stats_interval.value] / 2),
+        daemon=True).start()
+    try:
+        if configs[OptConfigs.worker_engine.value] == Engines.asyncio.value:
+            asyncio.run(save_data_async(stream_urls=stream_urls,
+                                        configs=configs))
+        else:
+            save_data(stream_urls=stream_urls,
+                      configs=configs)
+    finally:
+        LogShipper.close_all(
+            timeout=configs[OptConfigs.shutdown_timeout.value])
+
+
+def report_stats(stats_queue: multiprocessing.Queue, interval: float):
+    """
+    Puts the stats of all streams of this process in ``stats_queue`` every
+    ``interval`` seconds.
+
+    :param stats_queue: The queue of the stats read by the supervisor.
+    :param interval: The number of seconds between two reports.
+    """
+    while True:
+        time.sleep(interval)
+        for stream in list(MeetupStream.instances):
+            stats_queue.put(stream.stats())
+
+
+def run_supervisor(stream_urls: List[str],
+                   configs: dict) -> None:
+    """
+    Shards the streams across ``worker_processes`` worker processes, so
+    that the streams are not limited to a single CPU core. Workers that
+    exit are restarted, and the stats of their streams are aggregated and
+    logged every ``stats_interval`` seconds.
+
+    The meetup API rate limit and the memory ceiling are split evenly
+    between the workers. If the metrics endpoint is enabled, worker ``i``
+    serves its metrics on port ``metrics_port + i``. Each worker indexes the
+    entities of its own streams, in the ``worker-{i}`` subfolder of
+    ``entity_index_dir``, and writes its archive files in the ``worker-{i}``
+    subfolder of ``archive_dir``, so that it only recovers its own files.
+
+    :param stream_urls: The URLs to stream.
+    :param configs: The configurations of the script.
+    """
+    configs = {**OPT_CONFIG_DEFAULTS, **configs}
+    num_workers = configs[OptConfigs.worker_processes.value] or \
+        os.cpu_count() or 1
+    num_workers = min(num_workers, len(stream_urls))
+    worker_streams = [stream_urls[i::num_workers]
+                      for i in range(num_workers)]
+    rate = configs[OptConfigs.meetup_rate_limit.value]
+    burst = configs[OptConfigs.meetup_rate_burst.value]
+    worker_configs = {**configs,
+                      OptConfigs.meetup_rate_limit.value: rate / num_workers,
+                      OptConfigs.meetup_rate_burst.value:
+                          max(1, burst / num_workers),
+                      OptConfigs.memory_limit_mib.value:
+                          configs[OptConfigs.memory_limit_mib.value] /
+                          num_workers}
+    pprint(f"Starting {num_workers} worker processes for "
+           f"{len(stream_urls)} streams...")
+
+    context = multiprocessing.get_context('spawn')
+    stats_queue = context.Queue()
+    workers = [None] * num_workers
+    started_at = [0.] * num_workers
+    restart_at = [0.] * num_workers  # Stores the earliest time each exited
+    # worker may be restarted.
+    restart_delay = [1.] * num_workers
+    restarts = 0
+    stream_stats = {}  # Stores the last stats of each stream.
+    interval = configs[OptConfigs.stats_interval.value]
+    last_report = time.monotonic()
+
+    metrics_port = configs[OptConfigs.metrics_port.value]
+    entity_index_dir = configs[OptConfigs.entity_index_dir.value]
+    archive_dir = configs[OptConfigs.archive_dir.value]
+
+    def start_worker(i: int):
+        workers[i] = context.Process(
+            target=run_worker,
+            args=(worker_streams[i],
+                  {**worker_configs,
+                   OptConfigs.metrics_port.value:
+                       metrics_port + i if metrics_port else 0,
+                   OptConfigs.entity_index_dir.value:
+                       os.path.join(entity_index_dir, f'worker-{i}')
+                       if entity_index_dir else '',
+                   OptConfigs.archive_dir.value:
+                       os.path.join(archive_dir, f'worker-{i}')},
+                  stats_queue),
+            name=f'trigger-worker-{i}')
+        workers[i].start()
+        started_at[i] = time.monotonic()
+
+    for i in range(num_workers):
+        start_worker(i)
+    try:
+        while True:
+            try:
+                stats = stats_queue.get(timeout=1)
+                stream_stats[stats['stream']] = stats
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            for i, worker in enumerate(workers):
+                if worker.is_alive():
+                    continue
+                if not restart_at[i]:  # The worker has just exited.
+                    # Workers that keep crashing are restarted less often.
+                    restart_delay[i] = 1 if now - started_at[i] > 60 \
+                        else min(60, restart_delay[i] * 2)
+                    restart_at[i] = now + restart_delay[i]
+                    log_struct = {
+                        'desc': 'Worker process exited! Restarting it.',
+                        'worker': worker.name,
+                        'exitcode': worker.exitcode,
+                        'streams': worker_streams[i],
+                        'restart_delay': restart_delay[i]}
+                    pprint_struct(log_struct, pformat=BColors.FAIL)
+                    LOGGER.log_struct(log_struct, severity='ALERT')
+                elif now >= restart_at[i]:
+                    restart_at[i] = 0
+                    restarts += 1
+                    start_worker(i)
+            if now - last_report >= interval:
+                last_report = now
+                log_struct = aggregate_stats(list(stream_stats.values()))
+                log_struct.update({
+                    'workers': sum(w.is_alive() for w in workers),
+                    'restarts': restarts})
+                pprint_struct(log_struct)
+                LOGGER.log_struct(log_struct, severity='INFO')
+    finally:
+        stop_workers(workers, timeout=configs[
+            OptConfigs.shutdown_timeout.value])
+
+
+def aggregate_stats(stream_stats: List[dict]) -> dict:
+    """
+    Aggregates the stats reported by the streams of all workers.
+
+    :param stream_stats: The last stats of each stream.
+    :return: A dictionary containing the totals of the counters of all
+        streams, the total resident memory of the workers, the total number
+        of entities indexed by the workers, and the mtime of each stream.
+    """
+    totals = {'desc': 'Worker stats.',
+              'streams': len(stream_stats),
+              'queue_depth': 0,
+              'dropped': 0,
+              'spilled': 0,
+              'dead_lettered': 0,
+              'mtimes': {}}
+    worker_rss = {}  # Stores the last resident memory of each worker.
+    worker_entities = {}  # Stores the last entity counts of each worker.
+    for stats in stream_stats:
+        for key in ('queue_depth', 'dropped', 'spilled', 'dead_lettered'):
+            totals[key] += stats.get(key) or 0
+        totals['mtimes'][stats['stream']] = stats.get('mtime')
+        memory = stats.get('memory') or {}
+        worker_rss[memory.get('pid')] = memory.get('rss_mib') or 0
+        if stats.get('entity_index'):
+            worker_entities[memory.get('pid')] = \
+                stats['entity_index']['entities']
+    totals['rss_mib'] = round(sum(worker_rss.values()), 1)
+    if worker_entities:
+        totals['entities'] = dict(sum(
+            (collections.Counter(entities)
+             for entities in worker_entities.values()),
+            collections.Counter()))
+    return totals
+
+
+def stop_workers(workers: List[multiprocessing.Process], timeout: float):
+    """
+    Stops the worker processes with SIGTERM, so that they flush their
+    queued data, and kills the workers that do not exit in time.
+
+    :param workers: The worker processes.
+    :param timeout: The number of seconds the workers have to flush their
+        queued data.
+    """
+    pprint("Stopping worker processes...", pformat=BColors.WARNING)
+    for worker in workers:
+        if worker is not None and worker.is_alive():
+            worker.terminate()
+    deadline = time.monotonic() + timeout + 5
+    for worker in workers:
+        if worker is None:
+            continue
+        worker.join(max(0, deadline - time.monotonic()))
+        if worker.is_alive():
+            worker.kill()
+
+
+def flush_on_shutdown(configs: dict):
+    """
+    Flushes the items of all batch queues, commits the open archive files,
+    loads the pending BigQuery rows, and saves the checkpoints of all
+    streams and the entity index, before the script exits.
+
+    :param configs: The configurations of the script.
+    """
+    pprint("Flushing queued data...", pformat=BColors.WARNING)
+    BatchQueue.close_all(timeout=configs.get(
+        OptConfigs.shutdown_timeout.value,
+        OPT_CONFIG_DEFAULTS[OptConfigs.shutdown_timeout.value]))
+    ArchiveWriter.close_all()
+    BigQueryLoader.close_all()
+    Checkpoint.save_all()
+    EntityIndex.close_all()
+
+
+def main(stream_urls: List[str] = None,
+         config_path: str = '../config.json'):
+    """
+    Reads the configurations, and saves the data of the streams using the
+    ``engine`` config.
+
+    :param stream_urls: The URLs of the streams. If None, URLS is used.
+    :param config_path: The path of the configuration file.
+    """
+    stream_urls = stream_urls or URLS
+    with open(config_path) as json_configs_file:
         configs = json.load(json_configs_file)
-    save_data(stream_urls=URLS,
-              configs=configs)
+    configure_console(configs)
+    configure_exc_summaries(configs)
+    pprint("——— Starting ———",
+           pformat=[BColors.TITLE, BColors.BOLD], timestamp=False)
 
-    pprint("trigger_gcf.py is exiting!!!", pformat=BColors.WARNING)
-    LOGGER.log_text("trigger_gcf.py is exiting!!!", severity='EMERGENCY')
+    global LOGGER
+    LOGGER = create_log_shipper(__connect_gcl(LOGGER_NAME), configs)
+    # Exit gracefully on SIGTERM, so queued data is flushed.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    engine = configs.get(OptConfigs.engine.value,
+                         OPT_CONFIG_DEFAULTS[OptConfigs.engine.value])
+    try:
+        if engine == Engines.processes.value:
+            run_supervisor(stream_urls=stream_urls,
+                           configs=configs)
+        elif engine == Engines.asyncio.value:
+            asyncio.run(save_data_async(stream_urls=stream_urls,
+                                        configs=configs))
+        else:
+            save_data(stream_urls=stream_urls,
+                      configs=configs)
+
+        pprint("trigger_gcf.py is exiting!!!", pformat=BColors.WARNING)
+        LOGGER.log_text("trigger_gcf.py is exiting!!!", severity='EMERGENCY')
+    finally:
+        LogShipper.close_all(timeout=configs.get(
+            OptConfigs.shutdown_timeout.value,
+            OPT_CONFIG_DEFAULTS[OptConfigs.shutdown_timeout.value]))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,11 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Makes the modules of ``scripts`` importable by the tests, as they are when
+the scripts are run from their folder.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'scripts'))
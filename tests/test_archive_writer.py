@@ -0,0 +1,103 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Tests of the rotation, upload and recovery of archive files.
+"""
+import os
+import gzip
+import json
+import threading
+from archive_writer import ArchiveWriter, ArchiveFile, get_archive_path
+
+MTIME = 1577934000000  # 2020-01-02 03:00 UTC
+
+
+def read_rows(path: str) -> list:
+    with gzip.open(path, 'rb') as archive_file:
+        return [json.loads(line) for line in archive_file]
+
+
+def list_files(directory: str, suffix: str = '.ndjson.gz') -> list:
+    return sorted(os.path.join(folder, name)
+                  for folder, _, names in os.walk(directory)
+                  for name in names if name.endswith(suffix))
+
+
+def test_full_files_are_rotated_and_committed(tmp_path):
+    writer = ArchiveWriter(str(tmp_path), max_rows=2)
+    commits = []
+    for i in range(5):
+        writer.write('test', {'id': i, 'mtime': MTIME},
+                     on_commit=lambda i=i: commits.append(i))
+    writer.close()
+    files = list_files(str(tmp_path))
+    assert len(files) == 3
+    assert all('dt=2020-01-02' in path and 'hour=03' in path
+               for path in files)
+    rows = sorted(row['id'] for path in files for row in read_rows(path))
+    assert rows == list(range(5))
+    assert sorted(commits) == list(range(5))
+
+
+def test_full_files_are_uploaded_by_the_background_thread(tmp_path):
+    started, release = threading.Event(), threading.Event()
+    uploads = []
+
+    def uploader(path: str, name: str) -> bool:
+        started.set()
+        release.wait(5)
+        uploads.append((threading.current_thread().name, name))
+        return True
+    writer = ArchiveWriter(str(tmp_path), max_rows=1, uploader=uploader)
+    for i in range(3):
+        writer.write('test', {'id': i, 'mtime': MTIME})
+    assert started.wait(5)
+    assert not uploads  # write() did not wait for the blocked upload.
+    release.set()
+    writer.close()
+    assert len(uploads) == 3
+    assert all(name.startswith('test/dt=2020-01-02/hour=03/test-2020010203-')
+               for _, name in uploads)
+    assert uploads[0][0] == 'archive-closer'
+    assert not list_files(str(tmp_path))  # Uploaded files are deleted.
+
+
+def test_failed_uploads_are_not_committed(tmp_path):
+    commits = []
+    writer = ArchiveWriter(str(tmp_path), uploader=lambda path, name: False)
+    writer.write('test', {'id': 1, 'mtime': MTIME},
+                 on_commit=lambda: commits.append(1))
+    writer.close()
+    assert not commits
+    assert len(list_files(str(tmp_path))) == 1  # Kept for the next startup.
+
+
+def test_unclosed_files_are_recovered_up_to_the_last_complete_row(tmp_path):
+    path = get_archive_path(str(tmp_path), 'test', '2020010203', 'abc',
+                            'ndjson.gz')
+    archive_file = ArchiveFile(path, 'ndjson.gz')
+    for i in range(1000):
+        archive_file.write({'id': i})  # Flushed after the 1000th row.
+    archive_file.gzip_file.write(b'{"id": 1000')  # A partial row.
+    archive_file.gzip_file.flush()
+    # The file is not closed, as if the previous run crashed.
+    uploads = []
+    writer = ArchiveWriter(
+        str(tmp_path),
+        uploader=lambda path, name: uploads.append(read_rows(path)) or True)
+    writer.close()
+    assert not os.path.exists(f'{path}.part')
+    assert len(uploads) == 1
+    assert [row['id'] for row in uploads[0]] == list(range(1000))
+
+
+def test_uncommitted_files_are_discarded_when_they_are_replayed(tmp_path):
+    path = get_archive_path(str(tmp_path), 'test', '2020010203', 'abc',
+                            'ndjson.gz')
+    archive_file = ArchiveFile(path, 'ndjson.gz')
+    archive_file.write({'id': 1})
+    archive_file.gzip_file.flush()
+    writer = ArchiveWriter(str(tmp_path), discard_uncommitted=True)
+    writer.close()
+    assert not os.path.exists(f'{path}.part')
+    assert not list_files(str(tmp_path), suffix='.part')
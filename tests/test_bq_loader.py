@@ -0,0 +1,106 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Tests of the validation, batching and retries of the BigQuery loader.
+"""
+import os
+import json
+import pytest
+import bq_loader
+from bq_loader import BigQueryLoader, LoadModes
+
+
+class InsertClient(object):
+    """
+    A BigQuery client whose streaming inserts fail the rows at the indexes
+    of ``self.failures``, one list of indexes per call.
+    """
+    failures = []
+
+    def __init__(self):
+        self.inserts = []
+
+    def insert_rows_json(self, table_id, rows, row_ids):
+        self.inserts.append([row['rsvp_id'] for row in rows])
+        failed = self.failures[len(self.inserts) - 1] \
+            if len(self.inserts) <= len(self.failures) else []
+        return [{'index': index, 'errors': ['Injected error']}
+                for index in failed]
+
+
+class FakeBigQuery(object):
+    Client = InsertClient
+
+
+def attempt_twice(func, params) -> bool:
+    for _ in range(2):
+        try:
+            func(*params)
+            return True
+        except RuntimeError:
+            pass
+    return False
+
+
+@pytest.fixture
+def make_loader(monkeypatch):
+    monkeypatch.setattr(bq_loader, 'bigquery', FakeBigQuery)
+
+    def make_loader(failures: list) -> BigQueryLoader:
+        monkeypatch.setattr(InsertClient, 'failures', failures)
+        return BigQueryLoader('dataset', mode=LoadModes.insert.value,
+                              max_rows=4, attempt=attempt_twice)
+    return make_loader
+
+
+def write_rsvps(loader: BigQueryLoader, count: int) -> dict:
+    outcomes = {}
+    for rsvp_id in range(count):
+        loader.write('rsvps', {'rsvp_id': rsvp_id, 'mtime': rsvp_id},
+                     on_commit=lambda i=rsvp_id: outcomes.update({i: True}),
+                     on_failure=lambda i=rsvp_id: outcomes.update({i: False}))
+    return outcomes
+
+
+def test_failed_inserts_only_retry_the_failed_rows(make_loader):
+    loader = make_loader(failures=[[1, 3]])
+    outcomes = write_rsvps(loader, 4)
+    loader.close()
+    assert loader.client.inserts == [[0, 1, 2, 3], [1, 3]]
+    assert outcomes == {0: True, 1: True, 2: True, 3: True}
+    assert loader.stats()['loaded'] == 4
+
+
+def test_rows_that_are_never_inserted_fail_alone(make_loader):
+    loader = make_loader(failures=[[1, 3], [0]])
+    outcomes = write_rsvps(loader, 4)
+    loader.close()
+    assert loader.client.inserts == [[0, 1, 2, 3], [1, 3]]
+    assert outcomes == {0: True, 1: False, 2: True, 3: True}
+    assert loader.stats()['loaded'] == 3
+    assert loader.stats()['failed'] == 1
+
+
+def test_dry_run_conforms_rows_to_the_schema(tmp_path):
+    loader = BigQueryLoader('dataset', mode=LoadModes.dry_run.value,
+                            max_rows=2, dry_run_dir=str(tmp_path))
+    loader.write('rsvps', {'rsvp_id': '7', 'mtime': 1, 'extra': 'dropped',
+                           'member': {'member_id': 3}})
+    loader.write('rsvps', {'rsvp_id': 'not a number'})
+    loader.close()
+    with open(os.path.join(str(tmp_path), 'dataset.rsvps.ndjson')) as f:
+        rows = [json.loads(line) for line in f]
+    assert rows[0]['rsvp_id'] == 7
+    assert 'extra' not in rows[0]
+    assert rows[0]['member'][0]['member_id'] == 3
+    assert rows[1]['rsvp_id'] is None
+    assert loader.stats() == {'pending': 0, 'loaded': 2, 'failed': 0,
+                              'invalid': 1}
+
+
+def test_unknown_labels_are_rejected(tmp_path):
+    loader = BigQueryLoader('dataset', mode=LoadModes.dry_run.value,
+                            dry_run_dir=str(tmp_path))
+    with pytest.raises(ValueError):
+        loader.write('unknown', {})
+    loader.close()
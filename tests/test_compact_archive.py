@@ -0,0 +1,119 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Tests of the staging, deduplication and resumption of the compaction.
+"""
+import os
+import gzip
+import json
+import pytest
+from compact_archive import Compaction, LocalSource
+
+MTIME = 1577934000000  # 2020-01-02 03:00 UTC
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptedSource(LocalSource):
+    """
+    A local source whose listing is interrupted after ``pages`` pages, and
+    whose objects in ``unreadable`` can not be read.
+    """
+
+    def __init__(self, directory: str, pages: int = None,
+                 unreadable: tuple = ()):
+        super().__init__(directory)
+        self.pages = pages
+        self.unreadable = set(unreadable)
+        self.reads = []
+
+    def list_pages(self, prefix, page_token=None, page_size=1000):
+        for number, page in enumerate(super().list_pages(
+                prefix, page_token, page_size)):
+            if self.pages is not None and number == self.pages:
+                raise Interrupted()
+            yield page
+
+    def read(self, name):
+        self.reads.append(name)
+        if name in self.unreadable:
+            raise IOError('Injected error')
+        return super().read(name)
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    """
+    A folder of rsvps objects, in the formats written by save_stream_data
+    over time. The last object duplicates the first data item.
+    """
+    folder = tmp_path / 'source' / 'rsvps'
+    folder.mkdir(parents=True)
+    for rsvp_id in range(6):
+        data_item = {'rsvp_id': rsvp_id, 'mtime': MTIME + 10 - rsvp_id}
+        content = repr(data_item) if rsvp_id % 2 else json.dumps(data_item)
+        (folder / f'{rsvp_id}_1577934000.0.json').write_text(content)
+    (folder / '6-7_1577934000.0.ndjson').write_text('\n'.join(
+        json.dumps({'rsvp_id': rsvp_id, 'mtime': MTIME + 10 - rsvp_id})
+        for rsvp_id in (6, 0)))
+    return str(tmp_path / 'source')
+
+
+def compact(source, tmp_path) -> Compaction:
+    compaction = Compaction(source=source, label='rsvps',
+                            dest_dir=str(tmp_path / 'dest'),
+                            work_dir=str(tmp_path / 'work'),
+                            workers=2, page_size=3)
+    compaction.run()
+    return compaction
+
+
+def read_archive(tmp_path) -> dict:
+    archive = {}
+    for folder, _, names in os.walk(str(tmp_path / 'dest')):
+        for name in names:
+            with gzip.open(os.path.join(folder, name), 'rb') as f:
+                archive[name] = [json.loads(line)['rsvp_id'] for line in f]
+    return archive
+
+
+def test_objects_are_deduplicated_and_sorted_by_mtime(source_dir, tmp_path):
+    compaction = compact(LocalSource(source_dir), tmp_path)
+    assert read_archive(tmp_path) == {
+        'rsvps-2020010203-compacted-000.ndjson.gz': [6, 5, 4, 3, 2, 1, 0]}
+    counts = compaction.manifest['counts']
+    assert (counts['objects'], counts['data_items'], counts['duplicates'],
+            counts['rows']) == (7, 8, 1, 7)
+
+
+def test_interrupted_compaction_resumes_after_the_last_page(source_dir,
+                                                            tmp_path):
+    source = InterruptedSource(source_dir, pages=1)
+    with pytest.raises(Interrupted):
+        compact(source, tmp_path)
+    assert len(source.reads) == 3
+
+    source = InterruptedSource(source_dir)
+    compaction = compact(source, tmp_path)
+    assert len(source.reads) == 4  # The first page is not read again.
+    assert read_archive(tmp_path) == {
+        'rsvps-2020010203-compacted-000.ndjson.gz': [6, 5, 4, 3, 2, 1, 0]}
+    assert compaction.manifest['counts']['objects'] == 7
+
+
+def test_unreadable_objects_are_read_by_the_next_run(source_dir, tmp_path):
+    unreadable = 'rsvps/5_1577934000.0.json'
+    compaction = compact(InterruptedSource(source_dir,
+                                           unreadable=[unreadable]),
+                         tmp_path)
+    assert compaction.manifest['failed'] == [unreadable]
+
+    source = InterruptedSource(source_dir)
+    compaction = compact(source, tmp_path)
+    assert source.reads == [unreadable]
+    assert compaction.manifest['failed'] == []
+    assert read_archive(tmp_path) == {
+        'rsvps-2020010203-compacted-000.ndjson.gz': [6, 4, 3, 2, 1, 0],
+        'rsvps-2020010203-compacted-001.ndjson.gz': [5]}
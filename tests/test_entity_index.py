@@ -0,0 +1,82 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Tests of the links, queries and snapshots of the entity index.
+"""
+import gzip
+import pytest
+from entity_index import EntityIndex, get_entity_ids
+
+
+def rsvp(member_id, event_id, group_id=1, venue_id=None, response='yes'):
+    data_item = {'member': {'member_id': member_id},
+                 'event': {'event_id': str(event_id)},
+                 'group': {'group_id': group_id},
+                 'response': response}
+    if venue_id is not None:
+        data_item['venue'] = {'venue_id': venue_id}
+    return data_item
+
+
+@pytest.fixture
+def entity_index():
+    entity_index = EntityIndex(interval=0)
+    for member_id, event_id, venue_id in ((1, 'a', 10), (2, 'a', 10),
+                                          (2, 'b', 11), (3, 'b', 11)):
+        entity_index.add('rsvps', rsvp(member_id, event_id,
+                                       venue_id=venue_id))
+    return entity_index
+
+
+def test_entity_ids_are_read_from_every_stream_layout():
+    assert get_entity_ids('rsvps', rsvp(1, 'a', venue_id=10)) == \
+        {'member': '1', 'group': '1', 'event': 'a', 'venue': '10'}
+    assert get_entity_ids('open_events', {'id': 'e', 'group': {'id': 5}}) \
+        == {'event': 'e', 'group': '5'}
+    assert get_entity_ids('photos', {
+        'photo_album': {'group': {'id': 5}, 'event': {'id': 'e'}}}) == \
+        {'group': '5', 'event': 'e'}
+
+
+def test_related_entities(entity_index):
+    assert entity_index.related('event', 'a', 'member') == \
+        [('1', 1), ('2', 1)]
+    assert entity_index.related('member', '1', 'member', via='event') == \
+        [('2', 1)]
+    assert entity_index.related('member', '2', 'venue') == \
+        [('10', 1), ('11', 1)]
+    assert entity_index.degrees('group', '1') == \
+        {'member': 3, 'event': 2}
+    with pytest.raises(LookupError):
+        entity_index.related('member', '9', 'event')
+
+
+def test_declined_rsvps_unlink_the_member_from_the_event(entity_index):
+    entity_index.add('rsvps', rsvp(1, 'a', response='no'))
+    assert entity_index.related('event', 'a', 'member') == [('2', 1)]
+    assert entity_index.related('group', '1', 'member') == \
+        [('1', 1), ('2', 1), ('3', 1)]
+
+
+def test_snapshots_round_trip(entity_index, tmp_path):
+    path = str(tmp_path / 'index' / 'entities.json.gz')
+    entity_index.path = path
+    entity_index.close()
+    with gzip.open(path, 'rt') as snapshot_file:
+        assert snapshot_file.read(1) == '{'
+
+    loaded = EntityIndex(path=path, interval=0)
+    for kind, entity_id, related_kind in (('event', 'a', 'member'),
+                                          ('member', '2', 'venue'),
+                                          ('venue', '11', 'member'),
+                                          ('group', '1', 'event')):
+        assert loaded.related(kind, entity_id, related_kind) == \
+            entity_index.related(kind, entity_id, related_kind)
+    stats, loaded_stats = entity_index.stats(), loaded.stats()
+    for key in ('items', 'entities', 'links'):
+        assert loaded_stats[key] == stats[key]
+
+    loaded.add('rsvps', rsvp(4, 'a'))  # The loaded index keeps growing.
+    assert loaded.related('event', 'a', 'member') == \
+        [('1', 1), ('2', 1), ('4', 1)]
+    loaded.close()
@@ -0,0 +1,60 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Tests of the fingerprints and summaries of the handled exceptions.
+"""
+import sys
+from exc_summary import ExceptionSummaries
+
+
+def fail(message: str = 'Injected error'):
+    raise ValueError(message)
+
+
+def fail_elsewhere():
+    raise ValueError('Injected error')
+
+
+def summarize(summaries: ExceptionSummaries, func, *params) -> dict:
+    try:
+        func(*params)
+    except ValueError:
+        return summaries.summarize(*sys.exc_info())
+
+
+def test_repeated_exceptions_are_counted_not_formatted():
+    summaries = ExceptionSummaries()
+    first = summarize(summaries, fail)
+    assert 'ValueError: Injected error' in first['traceback']
+    second = summarize(summaries, fail, 'Another message')
+    assert second == {'fingerprint': first['fingerprint'], 'occurrences': 2}
+    other = summarize(summaries, fail_elsewhere)
+    assert other['fingerprint'] != first['fingerprint']
+    assert other['occurrences'] == 1
+
+
+def test_tracebacks_are_included_again_in_each_window():
+    summaries = ExceptionSummaries(window=0)
+    for _ in range(2):
+        summary = summarize(summaries, fail)
+        assert summary['occurrences'] == 1
+        assert 'traceback' in summary
+
+
+def test_least_recently_seen_fingerprints_are_forgotten():
+    summaries = ExceptionSummaries(max_size=1)
+    summarize(summaries, fail)
+    summarize(summaries, fail_elsewhere)
+    assert summarize(summaries, fail)['occurrences'] == 1
+    assert len(summaries.fingerprints) == 1
+
+
+def test_parameter_names():
+    class MeetupError(Exception):
+        def __init__(self, status_code, message):
+            super().__init__(status_code, message)
+
+    summaries = ExceptionSummaries()
+    assert summaries.parameter_names(MeetupError(500, 'error')) == \
+        ['status_code', 'message']
+    assert MeetupError in summaries.parameters
@@ -0,0 +1,84 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Tests of the buffering and aggregation of the logs of the LogShipper.
+"""
+from log_shipper import LogShipper
+
+
+class RecordingLogger(object):
+    """
+    A logger that keeps the logs written to it.
+    """
+
+    def __init__(self):
+        self.logs = []
+
+    def log_struct(self, info: dict, severity: str = None, **kwargs):
+        self.logs.append((info, severity))
+
+    def log_text(self, text: str, severity: str = None, **kwargs):
+        self.logs.append((text, severity))
+
+
+def test_repeats_are_aggregated():
+    logger = RecordingLogger()
+    shipper = LogShipper(logger, flush_interval=0.05, aggregate_window=60)
+    for attempt in range(5):
+        shipper.log_struct({'desc': 'Error while reading stream.',
+                            'stream_url': 'rsvps',
+                            'attempt': attempt}, severity='ERROR')
+    shipper.close()
+    assert logger.logs[0] == ({'desc': 'Error while reading stream.',
+                               'stream_url': 'rsvps',
+                               'attempt': 0}, 'ERROR')
+    last, severity = logger.logs[1]
+    assert (last['attempt'], last['repeats'], severity) == (4, 4, 'ERROR')
+    assert len(logger.logs) == 2
+    assert shipper.stats()['aggregated'] == 4
+
+
+def test_severities_are_not_aggregated_together():
+    logger = RecordingLogger()
+    shipper = LogShipper(logger, flush_interval=0.05, aggregate_window=60)
+    shipper.log_struct({'desc': 'Retrying.'}, severity='NOTICE')
+    shipper.log_struct({'desc': 'Retrying.'}, severity='ERROR')
+    shipper.close()
+    assert [severity for _, severity in logger.logs] == ['NOTICE', 'ERROR']
+
+
+def test_heartbeats_of_different_streams_are_not_merged():
+    """
+    The Script-Monitor heartbeats only differ by their stream, and were
+    merged into the heartbeat of the first stream.
+    """
+    logger = RecordingLogger()
+    shipper = LogShipper(logger, flush_interval=0.05, aggregate_window=60)
+    for stream in ('rsvps', 'open_events', 'photos'):
+        shipper.log_struct({'desc': 'Script-Monitor', 'stream': stream},
+                           severity='INFO')
+    shipper.close()
+    assert [info['stream'] for info, _ in logger.logs] == \
+        ['rsvps', 'open_events', 'photos']
+
+
+def test_zero_window_writes_every_log():
+    logger = RecordingLogger()
+    shipper = LogShipper(logger, flush_interval=0.05, aggregate_window=0)
+    for _ in range(3):
+        shipper.log_text('Stream closed.', severity='NOTICE')
+    shipper.close()
+    assert len(logger.logs) == 3
+
+
+def test_full_buffer_drops_logs():
+    logger = RecordingLogger()
+    shipper = LogShipper(logger, buffer_size=2, batch_size=100,
+                         flush_interval=60, aggregate_window=0)
+    for number in range(5):
+        shipper.log_struct({'desc': f'log {number}'})
+    assert shipper.stats()['dropped'] == 3
+    shipper.close()
+    assert [info['desc'] for info, _ in logger.logs[:2]] == ['log 0', 'log 1']
+    report, severity = logger.logs[2]
+    assert (report['dropped'], severity) == (3, 'WARNING')
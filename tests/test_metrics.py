@@ -0,0 +1,75 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Tests of the metrics registry and its HTTP endpoint.
+"""
+import json
+import urllib.error
+import urllib.request
+import pytest
+from metrics import Registry, MetricsServer
+
+
+@pytest.fixture
+def registry():
+    registry = Registry()
+    events = registry.counter('events_total', 'Events read.', ('stream',))
+    events.labels('rsvps').inc()
+    events.labels('rsvps').inc(2)
+    events.labels('photos').inc()
+    registry.gauge('queue_depth', 'Queued items.').labels().set_function(
+        lambda: 7)
+    latency = registry.histogram('latency_seconds', 'Latency.',
+                                 buckets=(0.1, 1))
+    for seconds in (0.05, 0.5, 5):
+        latency.observe(seconds)
+    return registry
+
+
+def test_render_uses_the_prometheus_text_format(registry):
+    lines = registry.render().splitlines()
+    assert '# TYPE events_total counter' in lines
+    assert 'events_total{stream="rsvps"} 3' in lines
+    assert 'events_total{stream="photos"} 1' in lines
+    assert 'queue_depth 7' in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'latency_seconds_count 3' in lines
+
+
+def test_snapshot_summarizes_histograms(registry):
+    snapshot = registry.snapshot()
+    assert snapshot['events_total'] == {'stream=rsvps': 3, 'stream=photos': 1}
+    assert snapshot['queue_depth'] == {'value': 7}
+    assert snapshot['latency_seconds']['value'] == \
+        {'count': 3, 'sum': 5.55, 'mean': 1.85}
+
+
+def test_metrics_are_registered_once(registry):
+    assert registry.counter('events_total', 'Events read.', ('stream',)) is \
+        registry.metrics['events_total']
+    with pytest.raises(ValueError):
+        registry.gauge('events_total', 'Events read.', ('stream',))
+    with pytest.raises(ValueError):
+        registry.metrics['events_total'].labels('rsvps', 'extra')
+
+
+def test_server_exposes_the_metrics_and_the_routes(registry):
+    def lookup(params):
+        if params.get('id') != '1':
+            raise LookupError('Not found.')
+        return {'id': 1}
+    server = MetricsServer(port=0, registry=registry,
+                           routes={'/lookup': lookup})
+    base_url = f'http://127.0.0.1:{server.port}'
+    try:
+        with urllib.request.urlopen(f'{base_url}/metrics') as response:
+            assert 'queue_depth 7' in response.read().decode('utf-8')
+        with urllib.request.urlopen(f'{base_url}/lookup?id=1') as response:
+            assert json.loads(response.read()) == {'id': 1}
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(f'{base_url}/lookup?id=2')
+        assert e.value.code == 404
+    finally:
+        server.close()
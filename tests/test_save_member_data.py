@@ -0,0 +1,171 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Tests of the chunked meetup API calls and the batched Firestore writes of
+the save_member_data GCF.
+"""
+import os
+import json
+import importlib.util
+import pytest
+import requests
+from google.cloud import firestore
+
+SCRIPT = os.path.join(os.path.dirname(__file__), os.pardir, 'scripts',
+                      'save_member_data-(gcf).py')
+
+
+class RecordingClient(object):
+    """
+    A Firestore client that records the committed documents, and fails the
+    batches holding a document of ``self.failing``.
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.failing = set()
+
+    def collection(self, name):
+        return self
+
+    def document(self, name):
+        return name
+
+    def batch(self):
+        client = self
+
+        class Batch(object):
+            def __init__(self):
+                self.writes = {}
+
+            def set(self, name, data, merge=False):
+                self.writes[name] = data
+
+            def commit(self):
+                if client.failing & set(self.writes):
+                    raise RuntimeError('Injected error')
+                client.documents.update(self.writes)
+        return Batch()
+
+
+class Response(object):
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.headers = {'X-RateLimit-Remaining': '100',
+                        'X-RateLimit-Reset': '10'}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(response=self)
+
+    def json(self):
+        return self.data
+
+
+class MeetupApi(object):
+    """
+    A session answering the members endpoint of the meetup API with one
+    page per two members. The members in ``self.failing`` fail their
+    request.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.failing = set()
+
+    def get(self, url, params=None, timeout=None):
+        if params is None:  # The link to a next page.
+            url, ids = url.split('?member_id=')
+            ids = ids.split(',')
+        else:
+            ids = params['member_id'].split(',')
+        self.requests.append(','.join(ids))
+        if self.failing & set(ids):
+            return Response({}, status_code=500)
+        page = {'results': [{'id': int(i)} for i in ids[:2]]}
+        if len(ids) > 2:
+            page['meta'] = {'next': f'{url}?member_id={",".join(ids[2:])}'}
+        return Response(page)
+
+
+@pytest.fixture
+def load_gcf(monkeypatch):
+    monkeypatch.setattr(firestore, 'Client', RecordingClient)
+    spec = importlib.util.spec_from_file_location('save_member_data', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    monkeypatch.setattr(module, 'SESSION', MeetupApi())
+    return module
+
+
+@pytest.fixture
+def gcf(load_gcf, monkeypatch):
+    monkeypatch.setattr(load_gcf, 'fetch_member_data', lambda ids, key: (
+        [{'id': int(i), 'name': f'member {i}'} for i in ids], [], None))
+    return load_gcf
+
+
+def test_members_are_fetched_in_paginated_chunks(load_gcf, monkeypatch):
+    monkeypatch.setattr(load_gcf, 'MEETUP_CHUNK_SIZE', 3)
+    results, failed_ids, error = load_gcf.fetch_member_data(
+        [str(i) for i in range(1, 8)], 'key')
+    assert sorted(member['id'] for member in results) == list(range(1, 8))
+    assert (failed_ids, error) == ([], None)
+    assert sorted(load_gcf.SESSION.requests) == \
+        ['1,2,3', '3', '4,5,6', '6', '7']
+
+
+def test_failed_chunks_only_fail_their_ids(load_gcf, monkeypatch):
+    monkeypatch.setattr(load_gcf, 'MEETUP_CHUNK_SIZE', 2)
+    load_gcf.SESSION.failing = {'3'}
+    results, failed_ids, error = load_gcf.fetch_member_data(
+        ['1', '2', '3', '4', '5'], 'key')
+    assert sorted(member['id'] for member in results) == [1, 2, 5]
+    assert failed_ids == ['3', '4']
+    assert error[1] == 500
+
+
+def test_members_are_saved_in_batches(gcf, monkeypatch):
+    monkeypatch.setattr(gcf, 'FIRESTORE_BATCH_LIMIT', 2)
+    message, status, _ = gcf.save_member_data('1,2,3', 'key', 'members')
+    assert (message, status) == ('Success!', 200)
+    assert sorted(gcf.DB.documents) == ['m1', 'm2', 'm3']
+
+
+def test_failed_batches_only_fail_their_ids(gcf, monkeypatch):
+    monkeypatch.setattr(gcf, 'FIRESTORE_BATCH_LIMIT', 2)
+    gcf.DB.failing = {'m3'}
+    message, status, _ = gcf.save_member_data('1,2,3,4', 'key', 'members')
+    assert status == 207
+    assert json.loads(message)['failed_ids'] == ['3', '4']
+    assert sorted(gcf.DB.documents) == ['m1', 'm2']
+
+
+def test_nothing_saved_is_not_a_partial_success(gcf):
+    gcf.DB.failing = {'m1'}
+    _, status, _ = gcf.save_member_data('1,2', 'key', 'members')
+    assert status == 500
+
+
+def test_meetup_api_calls_reuse_one_session(load_gcf, monkeypatch):
+    session = load_gcf.SESSION
+    timeouts = []
+    get = session.get
+    monkeypatch.setattr(session, 'get', lambda url, params=None, timeout=None:
+                        timeouts.append(timeout) or get(url, params, timeout))
+    for member_ids in (['1'], ['2', '3']):
+        load_gcf.fetch_member_data(member_ids, 'key')
+    assert session.requests == ['1', '2,3']
+    assert timeouts == [load_gcf.HTTP_TIMEOUT] * 2
+
+
+def test_meetup_api_session_pools_its_connections(load_gcf):
+    adapter = load_gcf.create_session().get_adapter('https://api.meetup.com')
+    assert adapter._pool_maxsize == load_gcf.HTTP_POOL_SIZE
@@ -0,0 +1,74 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Tests of the naming of the files stored by the save_stream_data GCF.
+"""
+import os
+import json
+import importlib.util
+import pytest
+from google.cloud import storage
+
+SCRIPT = os.path.join(os.path.dirname(__file__), os.pardir, 'scripts',
+                      'save_stream_data-(gcf).py')
+
+
+class RecordingClient(object):
+    """
+    A GCS client that records the uploaded files instead of uploading them.
+    """
+
+    def __init__(self):
+        self.uploads = {}
+
+    def get_bucket(self, bucket_name):
+        return self
+
+    def blob(self, filename):
+        client = self
+
+        class Blob(object):
+            def upload_from_string(self, content, content_type=None):
+                client.uploads[filename] = content
+        return Blob()
+
+
+class Request(object):
+    def __init__(self, data, label):
+        self.args = {'bucket_name': 'bucket', 'label': label}
+        self.data = data
+
+    def get_json(self):
+        return self.data
+
+
+@pytest.fixture
+def gcf(monkeypatch):
+    monkeypatch.setattr(storage, 'Client', RecordingClient)
+    spec = importlib.util.spec_from_file_location('save_stream_data', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_batches_are_named_by_the_ids_of_their_items(gcf):
+    data = [{'rsvp_id': 1}, {'rsvp_id': 2}, {'rsvp_id': 3}]
+    assert gcf.main(Request(data, 'rsvps')) == ('Success!', 200)
+    [(filename, content)] = gcf.GS.uploads.items()
+    assert filename.startswith('rsvps/1-3_')
+    assert [json.loads(line) for line in content.split('\n')] == data
+
+
+def test_batches_with_items_without_ids_are_stored(gcf):
+    data = [{'mtime': 1577934000000}, {'rsvp_id': 2}, 'not a dict']
+    assert gcf.main(Request(data, 'rsvps')) == ('Success!', 200)
+    [(filename, content)] = gcf.GS.uploads.items()
+    assert filename.startswith('rsvps/1577934000000-')
+    assert len(content.split('\n')) == 3
+
+
+def test_items_without_ids_are_stored(gcf):
+    assert gcf.main(Request({'name': 'event'}, 'events')) == \
+        ('Success!', 200)
+    [filename] = gcf.GS.uploads
+    assert filename.startswith('events/')
@@ -0,0 +1,99 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Tests of the sketches and windows of the stream aggregates.
+"""
+import random
+import pytest
+from stream_aggregates import CountMinSketch, HyperLogLog, SpaceSaving, \
+    StreamAggregates, WindowModes, get_cells, hash_value
+
+NOW = 1_600_000_000.
+
+
+def rsvp(number: int, response: str = 'yes', mtime: float = NOW) -> dict:
+    return {'rsvp_id': number,
+            'mtime': int(mtime * 1000),
+            'response': response,
+            'member': {'member_id': number},
+            'group': {'group_id': number % 3, 'group_city': 'Berlin'}}
+
+
+def test_count_min_sketch_never_underestimates():
+    sketch = CountMinSketch()
+    rng = random.Random(0)
+    counts = {}
+    for _ in range(20000):
+        value = f'group-{int(rng.paretovariate(1))}'
+        counts[value] = counts.get(value, 0) + 1
+        sketch.add(get_cells(hash_value(value)))
+    total = sum(counts.values())
+    for value, count in counts.items():
+        estimate = sketch.estimate(get_cells(hash_value(value)))
+        assert count <= estimate <= count + 0.01 * total
+
+
+def test_hyperloglog_estimate():
+    hll = HyperLogLog()
+    for member_id in range(50000):
+        hll.add(hash_value(str(member_id)))
+    assert hll.estimate() == pytest.approx(50000, rel=0.07)
+
+
+def test_hyperloglog_small_counts_and_merge():
+    first, second = HyperLogLog(), HyperLogLog()
+    for member_id in range(100):
+        first.add(hash_value(str(member_id)))
+    for member_id in range(50, 150):
+        second.add(hash_value(str(member_id)))
+    first.merge(second)
+    assert first.estimate() == pytest.approx(150, rel=0.05)
+
+
+def test_space_saving_keeps_frequent_values():
+    summary = SpaceSaving(capacity=4)
+    for number in range(100):
+        summary.add('frequent')
+        summary.add(f'rare-{number}')
+    assert summary.counts['frequent'] >= 100
+
+
+def test_sliding_window():
+    aggregates = StreamAggregates(bucket_seconds=60, num_buckets=10)
+    for number in range(30):
+        aggregates.add('rsvps', rsvp(number, 'no' if number % 3 else 'yes'),
+                       now=NOW)
+    aggregates.add('rsvps', rsvp(99, mtime=NOW - 300), now=NOW)
+    result = aggregates.query('rsvps', window=60, dimension='response',
+                              now=NOW)
+    assert result['items'] == 30
+    assert result['distinct_members'] == pytest.approx(30, abs=2)
+    top = result['dimensions']['response']['top']
+    assert [entry['value'] for entry in top] == ['no', 'yes']
+    assert top[0]['count'] >= 20
+    assert aggregates.query('rsvps', window=600, now=NOW)['items'] == 31
+
+
+def test_data_items_are_bucketed_by_mtime():
+    aggregates = StreamAggregates(bucket_seconds=60, num_buckets=10)
+    aggregates.add('rsvps', rsvp(1, mtime=NOW - 120), now=NOW)
+    aggregates.add('rsvps', rsvp(2, mtime=NOW - 3600), now=NOW)
+    assert aggregates.query('rsvps', window=60, now=NOW)['items'] == 0
+    assert aggregates.query('rsvps', window=180, now=NOW)['items'] == 1
+    assert aggregates.stats()['dropped'] == 1
+
+
+def test_tumbling_window():
+    aggregates = StreamAggregates(bucket_seconds=60, num_buckets=10)
+    now = NOW - NOW % 120 + 30  # 30 seconds into a window of 2 buckets.
+    aggregates.add('rsvps', rsvp(1, mtime=now - 60), now=now)
+    aggregates.add('rsvps', rsvp(2, mtime=now), now=now)
+    result = aggregates.query('rsvps', window=120,
+                              mode=WindowModes.tumbling.value, now=now)
+    assert result['items'] == 1
+    assert result['end'] == now - 30
+
+
+def test_query_of_an_unknown_stream():
+    with pytest.raises(LookupError):
+        StreamAggregates().query('photos')
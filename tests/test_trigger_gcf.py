@@ -0,0 +1,564 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Tests of the queues, caches, retries and durable state of trigger_gcf.
+"""
+import os
+import json
+import time
+import queue
+import asyncio
+import threading
+import aiohttp
+import pytest
+import trigger_gcf
+from trigger_gcf import BatchQueue, SeenCache, RateLimiter, RetryBudget, \
+    RetryPolicy, Spool, Checkpoint, MemoryBudget, MeetupStream, \
+    AsyncMeetupStream, ReqConfigs, OptConfigs, SpoolKinds, FullPolicies
+from stream_simulator import StreamSimulator
+
+
+def wait_for(predicate, timeout: float = 5) -> bool:
+    """
+    :return: Whether ``predicate`` became true within ``timeout`` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_batch_queue_flushes_full_batches():
+    batches = []
+
+    def trigger(batch):
+        batches.append(batch)
+    batch_queue = BatchQueue(trigger, q_size=3)
+    for item in range(7):
+        batch_queue.add(item)
+    assert wait_for(lambda: len(batches) == 2)
+    assert batches == [[0, 1, 2], [3, 4, 5]]
+    assert batch_queue.pending == 1
+    batch_queue.close()
+    assert batches[-1] == [6]
+    assert batch_queue.pending == 0
+
+
+def test_batch_queue_flushes_old_batches():
+    batches = []
+
+    def trigger(batch):
+        batches.append((time.monotonic(), batch))
+    batch_queue = BatchQueue(trigger, q_size=100, max_age=0.2)
+    added = time.monotonic()
+    batch_queue.add('item')
+    assert wait_for(lambda: batches)
+    flushed, batch = batches[0]
+    assert batch == ['item']
+    assert 0.2 <= flushed - added < 2
+    batch_queue.close()
+
+
+def test_batch_queue_without_max_age_waits_until_full():
+    batches = []
+    batch_queue = BatchQueue(batches.append, q_size=2)
+    batch_queue.add('item')
+    time.sleep(0.2)
+    assert batches == []
+    batch_queue.close()
+    assert batches == [['item']]
+
+
+def test_seen_cache_ttl():
+    cache = SeenCache(max_size=10, ttl=0.2)
+    assert cache.add('m1')
+    assert not cache.add('m1')
+    time.sleep(0.25)
+    assert cache.add('m1')
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 2}
+
+
+def test_seen_cache_evicts_least_recently_used():
+    cache = SeenCache(max_size=2, ttl=60)
+    cache.add('a')
+    cache.add('b')
+    cache.add('a')  # 'b' is now the least recently used.
+    cache.add('c')
+    assert not cache.add('a')
+    assert cache.add('b')
+    cache.discard(['b'])
+    assert cache.add('b')
+
+
+
+def test_rate_limiter_paces_calls_after_a_burst():
+    limiter = RateLimiter(rate=10, capacity=2)
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == 0
+    assert 0.05 < limiter.reserve() <= 0.1
+    assert 0.15 < limiter.reserve() <= 0.2  # Reservations queue up.
+
+
+def test_rate_limiter_honours_the_quota_headers():
+    limiter = RateLimiter(rate=10, capacity=5)
+    limiter.update({'X-RateLimit-Remaining': '1',
+                    'X-RateLimit-Reset': '10'})
+    assert limiter.reserve() == 0
+    assert limiter.reserve() > 0  # Only one call was left in the quota.
+    limiter.update({'X-RateLimit-Remaining': '0',
+                    'X-RateLimit-Reset': '30'})
+    assert 29 < limiter.reserve() <= 30  # Paused until the quota resets.
+
+
+def test_rate_limiter_ignores_missing_quota_headers():
+    limiter = RateLimiter(rate=10, capacity=5)
+    for headers in (None, {}, {'X-RateLimit-Remaining': 'unknown'},
+                    {'X-RateLimit-Reset': '30'}):
+        limiter.update(headers)
+    assert limiter.reserve(5) == 0
+
+
+def test_profile_calls_take_one_token_per_api_call(make_stream):
+    stream = make_stream(meetup_chunk_size=50)
+    assert stream.api_calls(['1']) == 1
+    assert stream.api_calls([str(i) for i in range(101)]) == 3
+
+def test_retry_budget_denies_retries_below_half():
+    budget = RetryBudget(max_tokens=4, token_ratio=0.5)
+    assert budget.on_failure()  # 3 tokens left.
+    assert not budget.on_failure()  # 2 tokens left.
+    assert budget.stats() == {'tokens': 2, 'throttled': 1}
+    for _ in range(4):
+        budget.on_success()
+    assert budget.on_failure()  # 4 tokens were returned, 3 are left.
+
+
+def test_retry_policy_gives_up_after_attempts():
+    policy = RetryPolicy(num_attempts=3, base_sleep=1, max_sleep=2)
+    started = time.monotonic()
+    for attempt in range(2):
+        sleep_time, reason = policy.next_sleep(attempt, started)
+        assert 0 <= sleep_time <= 2
+        assert reason is None
+    assert policy.next_sleep(2, started) == (None, 'attempts exhausted')
+
+
+def test_retry_policy_backoff_is_capped():
+    policy = RetryPolicy(base_sleep=1, max_sleep=5)
+    assert all(0 <= policy.backoff(attempt) <= 5 for attempt in range(100))
+
+
+def test_retry_policy_deadline():
+    policy = RetryPolicy(num_attempts=100, base_sleep=0.01, max_sleep=0.01,
+                         deadline=10)
+    assert policy.next_sleep(0, time.monotonic())[1] is None
+    assert policy.next_sleep(0, time.monotonic() - 20) == \
+        (None, 'deadline exceeded')
+
+
+def test_retry_policy_budget():
+    budget = RetryBudget(max_tokens=2, token_ratio=1)
+    policy = RetryPolicy(num_attempts=100, budget=budget)
+    assert policy.next_sleep(0, time.monotonic()) == \
+        (None, 'retry budget exhausted')
+    policy.on_success()
+    assert budget.tokens == 2
+
+
+def test_spool_removes_acknowledged_segments(tmp_path):
+    spool = Spool(str(tmp_path), segment_size=100)
+    refs = [spool.append('stream', {'mtime': i, 'pad': 'x' * 40})
+            for i in range(6)]
+    assert len({segment for segment, _ in refs}) > 1
+    first = refs[0][0]
+    spool.ack([ref for ref in refs if ref[0] == first])
+    assert not os.path.exists(tmp_path / f'{first:08d}.log')
+    assert spool.stats()['unacked'] == \
+        len([ref for ref in refs if ref[0] != first])
+
+
+def test_spool_replays_unacknowledged_entries(tmp_path):
+    spool = Spool(str(tmp_path), segment_size=1024)
+    refs = [spool.append('member', member_id) for member_id in range(5)]
+    spool.ack([refs[1], refs[3]])
+    spool.sync()
+
+    recovered = Spool(str(tmp_path), segment_size=1024)
+    assert recovered.recovered
+    entries = list(recovered.replay())
+    assert entries == [('member', 0, 0), ('member', 2, 0), ('member', 4, 0)]
+    assert not recovered.recovered
+    assert not os.path.exists(tmp_path / f'{refs[0][0]:08d}.log')
+
+
+def test_spool_skips_partially_written_entries(tmp_path):
+    spool = Spool(str(tmp_path), segment_size=1024)
+    spool.append('group', 1)
+    spool.sync()
+    with open(tmp_path / '00000000.log', 'ab') as segment_file:
+        segment_file.write(b'{"kind": "group", "repl')
+    assert list(Spool(str(tmp_path), segment_size=1024).replay()) == \
+        [('group', 1, 0)]
+
+
+def test_checkpoint_saves_and_loads(tmp_path):
+    path = str(tmp_path / 'rsvps.checkpoint.json')
+    checkpoint = Checkpoint(path, interval=60)
+    assert checkpoint.mtime is None
+    checkpoint.advance(100)
+    checkpoint.save()
+    with open(path) as checkpoint_file:
+        assert json.load(checkpoint_file)['mtime'] == 100
+    assert Checkpoint(path, interval=60).mtime == 100
+
+
+def test_checkpoint_does_not_pass_items_in_flight(tmp_path):
+    """
+    A data item stored by one dispatcher worker must not advance the
+    checkpoint past an older data item that another worker still holds.
+    """
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'), interval=60)
+    for mtime in (1, 2, 3):
+        checkpoint.track(mtime)
+    checkpoint.advance(3)
+    assert checkpoint.mtime == 0
+    checkpoint.advance(1)
+    assert checkpoint.mtime == 1
+    checkpoint.advance(2)
+    assert checkpoint.mtime == 3
+
+
+def test_checkpoint_tracks_repeated_mtimes(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'), interval=60)
+    checkpoint.track(5)
+    checkpoint.track(5)
+    checkpoint.advance(5)
+    assert checkpoint.mtime == 4
+    checkpoint.advance(5)
+    assert checkpoint.mtime == 5
+
+
+@pytest.fixture
+def make_stream(tmp_path):
+    def make_stream(**configs) -> MeetupStream:
+        stream_configs = {config.value: 'unused' for config in ReqConfigs}
+        stream_configs.update({
+            OptConfigs.spill_dir.value: str(tmp_path / 'spill'),
+            OptConfigs.dead_letter_dir.value: str(tmp_path / 'dead_letter'),
+            OptConfigs.spool_dir.value: '',
+            OptConfigs.checkpoint_dir.value: '',
+            **configs})
+        return MeetupStream('https://stream.meetup.com/2/rsvps',
+                            stream_configs)
+    return make_stream
+
+
+@pytest.fixture
+def stream(make_stream):
+    return make_stream()
+
+
+def test_spill_replay_does_not_block_on_a_full_queue(stream):
+    """
+    Replaying the spill file into a full work queue used to block the only
+    dispatcher worker that could drain the queue.
+    """
+    stream.work_queue = queue.Queue(maxsize=3)
+    for mtime in range(10):
+        stream.spill_data_item({'mtime': mtime})
+
+    replayed = []
+    for _ in range(10):
+        replay = threading.Thread(
+            target=stream._MeetupStream__replay_spill, daemon=True)
+        replay.start()
+        replay.join(5)
+        assert not replay.is_alive()
+        while not stream.work_queue.empty():
+            replayed.append(stream.work_queue.get_nowait()[1]['mtime'])
+    assert replayed == list(range(10))
+    assert not os.path.exists(stream.spill_path)
+    assert stream.replay_offset == 0
+
+
+def test_spill_replay_resumes_after_new_spills(stream):
+    stream.work_queue = queue.Queue(maxsize=2)
+    for mtime in range(3):
+        stream.spill_data_item({'mtime': mtime})
+    stream._MeetupStream__replay_spill()
+    stream.spill_data_item({'mtime': 3})  # Spilled while replaying.
+
+    replayed = []
+    for _ in range(5):
+        while not stream.work_queue.empty():
+            replayed.append(stream.work_queue.get_nowait()[1]['mtime'])
+        stream._MeetupStream__replay_spill()
+    assert replayed == [0, 1, 2, 3]
+
+
+@pytest.fixture(autouse=True)
+def close_queues():
+    yield
+    BatchQueue.close_all(timeout=1)
+    trigger_gcf.Checkpoint.instances.clear()
+
+
+class RecordingLogger(object):
+    """
+    A logger that keeps the logs written to it.
+    """
+
+    def __init__(self):
+        self.logs = []
+
+    def log_struct(self, info: dict, severity: str = None, **kwargs):
+        self.logs.append((info, severity))
+
+
+def read_dead_letters(stream: MeetupStream) -> list:
+    with open(stream.dead_letter_path) as dead_letter_file:
+        return [json.loads(line) for line in dead_letter_file]
+
+
+def test_checkpoint_passes_items_that_failed_for_good(make_stream,
+                                                      tmp_path):
+    """
+    A data item whose GCF call failed for good was never released, so the
+    checkpoint stopped before it for the rest of the run.
+    """
+    stream = make_stream(checkpoint_dir=str(tmp_path / 'checkpoints'))
+    stream.trigger_save_stream_data = \
+        lambda data_item: data_item['mtime'] != 100
+    for mtime in range(100, 200):
+        data_item = {'mtime': mtime}
+        stream.spool_append(SpoolKinds.stream.value, data_item)
+        stream.save_data_item(data_item)
+    assert stream.checkpoint.mtime == 199
+    assert not stream.checkpoint.in_flight
+    assert read_dead_letters(stream) == [
+        {'kind': 'stream', 'reason': 'failed', 'time': pytest.approx(
+            time.time(), abs=60), 'item': {'mtime': 100}}]
+
+
+def test_checkpoint_passes_dropped_items(make_stream, tmp_path):
+    stream = make_stream(
+        checkpoint_dir=str(tmp_path / 'checkpoints'),
+        dispatch_full_policy=FullPolicies.drop_newest.value)
+    stream.work_queue = queue.Queue(maxsize=1)
+    for mtime in (1, 2):
+        data_item = {'mtime': mtime}
+        stream.spool_append(SpoolKinds.stream.value, data_item)
+        stream.enqueue_data_item(data_item)
+    assert stream.dropped == 1
+    assert list(stream.checkpoint.in_flight) == [1]
+    assert [entry['item'] for entry in read_dead_letters(stream)] == \
+        [{'mtime': 2}]
+
+    stream.trigger_save_stream_data = lambda data_item: True
+    stream.save_data_item(stream.work_queue.get_nowait()[1])
+    assert stream.checkpoint.mtime == 2
+
+
+def test_spool_acknowledges_items_that_failed_for_good(make_stream,
+                                                       tmp_path):
+    """
+    Entries that failed for good were never acknowledged, so their
+    segment was kept on disk for the rest of the run.
+    """
+    stream = make_stream(spool_dir=str(tmp_path / 'spool'),
+                         spool_segment_size=1024)
+    stream.trigger_save_stream_data = lambda data_item: False
+    for mtime in range(3):
+        data_item = {'mtime': mtime}
+        ref = stream.spool_append(SpoolKinds.stream.value, data_item)
+        stream.save_data_item(data_item, ref)
+    assert stream.spool.stats() == {'segments': 1, 'unacked': 0}
+    assert stream.stats()['dead_lettered'] == 3
+    assert len(read_dead_letters(stream)) == 3
+
+
+def test_profile_failures_only_dead_letter_the_failed_ids(make_stream,
+                                                          tmp_path):
+    stream = make_stream(spool_dir=str(tmp_path / 'spool'))
+
+    def trigger_save_member_data(member_ids: list) -> bool:
+        member_ids[:] = ['2']  # As narrowed down by a 207 response.
+        return False
+    trigger = stream.entries_trigger(trigger_save_member_data,
+                                     SpoolKinds.member.value)
+    trigger([(stream.spool_append(SpoolKinds.member.value, member_id),
+              member_id) for member_id in (1, 2, 3)])
+    assert stream.spool.stats()['unacked'] == 0
+    assert [entry['item'] for entry in read_dead_letters(stream)] == [2]
+
+
+def test_spool_dead_letters_entries_replayed_too_often(tmp_path,
+                                                       make_stream,
+                                                       monkeypatch):
+    spool_dir = str(tmp_path / 'spool')
+    spool = Spool(os.path.join(spool_dir, 'rsvps'), segment_size=1024)
+    spool.append(SpoolKinds.stream.value, {'mtime': 1}, replays=3)
+    spool.append(SpoolKinds.stream.value, {'mtime': 2}, replays=0)
+    spool.sync()
+    monkeypatch.setattr(trigger_gcf, 'LOGGER', RecordingLogger())
+    stream = make_stream(spool_dir=spool_dir, spool_max_replays=3)
+    replayed = [item for _, item, _ in stream.replayed_entries()]
+    assert replayed == [{'mtime': 2}]
+    assert [entry['reason'] for entry in read_dead_letters(stream)] == \
+        ['replays']
+
+
+
+
+def test_memory_budget_pauses_until_the_backlog_drains():
+    backlog = [10]
+    relieved = []
+    budget = MemoryBudget(limit=1, interval=0.01,
+                          backlog=lambda: backlog[0],
+                          relieve=lambda: relieved.append(True))
+    assert wait_for(lambda: budget.exceeded)
+    assert wait_for(lambda: relieved)
+    waiter = threading.Thread(target=budget.wait, daemon=True)
+    waiter.start()
+    time.sleep(0.05)
+    assert waiter.is_alive()
+    backlog[0] = 0
+    waiter.join(5)
+    assert not waiter.is_alive()
+    budget.limit = 1 << 60  # Stops the budget from being exceeded again.
+    assert wait_for(lambda: not budget.exceeded)
+    assert budget.stats()['pauses'] >= 1
+
+
+def test_spilled_data_stays_on_disk_while_the_budget_is_exceeded(
+        make_stream):
+    budget = MemoryBudget(limit=1, interval=0.01)
+    assert wait_for(lambda: budget.exceeded)
+    stream = make_stream()
+    stream.memory_budget = budget
+    stream.work_queue = queue.Queue(maxsize=3)
+    stream.spill_data_item({'mtime': 1})
+    stream._MeetupStream__replay_spill()
+    assert stream.work_queue.empty()
+    assert os.path.exists(stream.spill_path)
+    budget.limit = 1 << 60
+    assert wait_for(lambda: not budget.exceeded)
+
+@pytest.mark.parametrize('response, retried', [
+    ('{"failed_ids": ["2"]}', '2'),
+    ('Not JSON', '1,2,3'),  # The whole batch is retried.
+])
+def test_partial_profile_saves_only_retry_the_failed_ids(make_stream,
+                                                         response, retried):
+    stream = make_stream(retry_attempts=3, retry_base_sleep=0,
+                         retry_max_sleep=0)
+    requests = []
+
+    def trigger_http_gcf(url, data=None, params=None):
+        requests.append(params['member_id'])
+        if len(requests) == 1:
+            stream.raise_for_gcf_status(207, response)
+        return {}
+    stream.trigger_http_gcf = trigger_http_gcf
+    assert stream.trigger_save_member_data([1, 2, 3])
+    assert requests == ['1,2,3', retried]
+
+def test_async_engine_saves_the_stream_and_its_checkpoint(tmp_path):
+    """
+    The checkpoint, whose save syncs the spool and fsyncs its file, is
+    saved off the event loop.
+    """
+    simulator = StreamSimulator(labels=['rsvps'], rate=200, gcf_latency=0,
+                                profile_latency=0, seed=0)
+    simulator.start()
+    configs = {**simulator.gcf_configs,
+               OptConfigs.spill_dir.value: str(tmp_path / 'spill'),
+               OptConfigs.spool_dir.value: str(tmp_path / 'spool'),
+               OptConfigs.checkpoint_dir.value: str(tmp_path / 'checkpoints'),
+               OptConfigs.checkpoint_interval.value: 0}
+    save_threads = set()
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            stream = AsyncMeetupStream(url=simulator.stream_urls[0],
+                                       configs=configs, session=session)
+            save = stream.checkpoint.save
+
+            def recording_save():
+                save_threads.add(threading.current_thread())
+                save()
+            stream.checkpoint.save = recording_save
+            task = asyncio.ensure_future(stream.trigger_cloud_functions())
+            simulator.produce()
+            while len(simulator.received) < 50 and not task.done():
+                await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.wait([task])
+            stream.members_queue.close()
+            stream.groups_queue.close()
+            await stream.drain(timeout=5)
+            save()
+            return stream.checkpoint
+    try:
+        checkpoint = asyncio.run(asyncio.wait_for(run(), timeout=20))
+    finally:
+        simulator.stop()
+    assert len(simulator.received) >= 50
+    assert save_threads and threading.current_thread() not in save_threads
+    with open(checkpoint.path) as checkpoint_file:
+        assert json.load(checkpoint_file)['mtime'] == checkpoint.mtime
+    assert checkpoint.mtime >= simulator.history['rsvps'][49][0]
+
+
+@pytest.mark.parametrize('mode, printed', [
+    ('quiet', []),
+    ('status', ['message']),
+    ('verbose', ['message', 'batch', 'Batch.'])])
+def test_console_modes(mode, printed, monkeypatch, capsys):
+    formatted = []  # Structs are only formatted if they are printed.
+    monkeypatch.setattr(trigger_gcf, 'pretty_json', lambda json_dict: (
+        formatted.append(json_dict) or ''))
+    trigger_gcf.configure_console({OptConfigs.console_mode.value: mode})
+    try:
+        trigger_gcf.pprint('message', timestamp=False)
+        trigger_gcf.pprint('batch', timestamp=False, verbose=True)
+        trigger_gcf.pprint_struct({'desc': 'Batch.'}, timestamp=False,
+                                  verbose=True)
+    finally:
+        trigger_gcf.configure_console({})
+    output = capsys.readouterr().out
+    assert [text for text in ('message', 'batch', 'Batch.')
+            if text in output] == printed
+    assert len(formatted) == ('Batch.' in printed)
+
+
+def test_worker_stats_are_aggregated():
+    stream_stats = [
+        {'stream': 'rsvps', 'mtime': 2, 'queue_depth': 3, 'dropped': 1,
+         'memory': {'pid': 1, 'rss_mib': 10.0},
+         'entity_index': {'entities': {'member': 2, 'event': 1}}},
+        {'stream': 'photos', 'mtime': 5, 'queue_depth': 4, 'spilled': 2,
+         'memory': {'pid': 1, 'rss_mib': 12.0},
+         'entity_index': {'entities': {'member': 3, 'event': 1}}},
+        {'stream': 'open_events', 'mtime': None, 'dead_lettered': 6,
+         'memory': {'pid': 2, 'rss_mib': 20.5},
+         'entity_index': {'entities': {'group': 1}}}]
+    totals = trigger_gcf.aggregate_stats(stream_stats)
+    assert (totals['streams'], totals['queue_depth'], totals['dropped'],
+            totals['spilled'], totals['dead_lettered']) == (3, 7, 1, 2, 6)
+    assert totals['mtimes'] == {'rsvps': 2, 'photos': 5, 'open_events': None}
+    # The memory and entities of a worker are counted once, from the last
+    # stats of its streams.
+    assert totals['rss_mib'] == 32.5
+    assert totals['entities'] == {'member': 3, 'event': 1, 'group': 1}
+
+
+def test_streams_pool_their_connections(make_stream):
+    first = make_stream(**{OptConfigs.http_pool_size.value: 4})
+    second = make_stream(**{OptConfigs.http_pool_size.value: 4})
+    assert first.session is not second.session
+    for scheme in ('http://', 'https://'):
+        adapter = first.session.get_adapter(f'{scheme}example.com')
+        assert adapter._pool_maxsize == 4